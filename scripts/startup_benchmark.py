@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Import-time regression benchmark for the handmark CLI.
+
+Runs lightweight subcommands under `python -X importtime` and fails when
+their import time exceeds its budget, or when they load a provider SDK that
+only `digest`/`status`/`test-connection` should need.
+
+Usage:
+    python scripts/startup_benchmark.py [--runs N] [--scale FACTOR]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+MAIN_SCRIPT = REPO_ROOT / "src" / "main.py"
+
+# Import-time budget in milliseconds per subcommand. Help output costs more
+# because typer loads its rich formatting helpers to render it.
+BUDGETS_MS = {
+    "--version": 175,
+    "config": 175,
+    "--help": 350,
+    "auth --help": 350,
+    "set-model --help": 350,
+    "digest --help": 350,
+    "status --help": 350,
+}
+
+# Packages that must stay unloaded until a provider is actually created
+HEAVY_PACKAGES = ("azure", "ollama", "aiohttp", "PIL")
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Map top-level module names to their cumulative import time in us."""
+    top_level = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")  # noqa: E203
+        # Top-level imports have a single space before the name
+        if name.startswith(" ") and not name.startswith("  "):
+            top_level[name.strip()] = int(cumulative)
+    return top_level
+
+
+def loaded_modules(stderr: str) -> set:
+    """Every module name reported by -X importtime."""
+    modules = set()
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "imported package" not in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def run_importtime(args: list, env: dict) -> str:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    return result.stderr
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Runs per subcommand")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="Multiply every budget by this"
+    )
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, PYTHONDONTWRITEBYTECODE="")
+        env.pop("GITHUB_TOKEN", None)
+
+        # Modules the bare interpreter imports anyway are not handmark's cost
+        interpreter_modules = set(parse_importtime(run_importtime(["-c", "pass"], env)))
+
+        failures = []
+        print(f"{'subcommand':<20} {'import ms':>10} {'budget ms':>10}")
+        for subcommand, budget in BUDGETS_MS.items():
+            budget *= options.scale
+            best = None
+            modules = set()
+            for _ in range(options.runs):
+                stderr = run_importtime([str(MAIN_SCRIPT), *subcommand.split()], env)
+                timings = parse_importtime(stderr)
+                total = sum(
+                    cumulative
+                    for name, cumulative in timings.items()
+                    if name not in interpreter_modules
+                )
+                best = total if best is None else min(best, total)
+                modules = loaded_modules(stderr)
+
+            best_ms = best / 1000
+            status = "ok" if best_ms <= budget else "OVER BUDGET"
+            print(f"{subcommand:<20} {best_ms:>10.1f} {budget:>10.0f}  {status}")
+            if best_ms > budget:
+                failures.append(
+                    f"'{subcommand}' took {best_ms:.1f}ms (> {budget:.0f}ms)"
+                )
+
+            heavy = sorted(
+                name for name in modules if name.split(".")[0] in HEAVY_PACKAGES
+            )
+            if heavy:
+                failures.append(f"'{subcommand}' imported {', '.join(heavy[:5])}")
+
+    if failures:
+        print("\nStartup regressions:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
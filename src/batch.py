@@ -0,0 +1,788 @@
+"""Batch processing of many images through a staged, bounded pipeline."""
+
+import asyncio
+import glob
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cache import ResponseCache
+from dedup import DuplicatePlan, link_file
+from dissector import CANONICAL_FORMAT, ContentFormatter, ImageDissector
+from model import Model
+from pipeline import Pipeline, PipelineConfig, Stage
+from preprocess import PreprocessConfig, preprocess_image
+from profiling import Profiler, Trace, activate, span, traced
+from providers.concurrency import get_limiter
+from providers.registry import aclose_providers
+from ratelimit import RateLimiter, get_rate_limiter
+from routing import ModelRouter
+from transcript import TRANSCRIPT_SUFFIX, Transcript
+from usage import Usage
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp"}
+
+# Used when config.yaml has no `providers.<type>.jobs` entry
+DEFAULT_JOBS = {"azure": 4, "ollama": 1}
+
+
+@dataclass
+class BatchResult:
+    """Outcome of processing a single image in a batch."""
+
+    image_path: Path
+    output_path: Optional[str] = None
+    error: Optional[Exception] = None
+    # Every file written for the image when several formats were derived
+    output_paths: List[str] = field(default_factory=list)
+    # SHA-256 of the image, when the run hashes its inputs
+    input_hash: Optional[str] = None
+    # From entering the pipeline to the result, in seconds
+    seconds: Optional[float] = None
+    # Near-identical image whose result was reused instead of a model request
+    duplicate_of: Optional[Path] = None
+    # Tokens and time of the model requests made for the image
+    usage: List[Usage] = field(default_factory=list)
+    # Model that answered, when the run routes between models
+    model: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+
+def is_image_file(path: Path) -> bool:
+    """Check whether a path points to a file with a supported image extension."""
+    return path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+
+
+def read_file_list(list_path: str) -> List[str]:
+    """Read input paths from a file (one per line, '-' reads stdin).
+
+    Blank lines and lines starting with '#' are ignored.
+    """
+    if list_path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(list_path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+
+    return [
+        line.strip()
+        for line in lines
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def iter_image_paths(
+    inputs: Iterable[str],
+    recursive: bool = False,
+    on_unmatched: Optional[Callable[[str], None]] = None,
+) -> Iterator[Path]:
+    """Lazily expand files, directories and glob patterns into images.
+
+    Directories are listed one at a time, so huge trees start yielding
+    immediately and are never held in memory as a whole.
+
+    Args:
+        inputs: Files, directories or glob patterns
+        recursive: Descend into subdirectories of directory inputs
+        on_unmatched: Called with each input that did not match any image
+
+    Yields:
+        Path: Unique image paths, in input order
+    """
+    seen = set()
+
+    for raw_input in inputs:
+        raw_input = str(raw_input)
+        matched = False
+
+        if glob.has_magic(raw_input):
+            candidates = sorted(glob.iglob(raw_input, recursive=True))
+        else:
+            candidates = [raw_input]
+
+        for candidate in candidates:
+            for path in _walk_images(Path(candidate), recursive):
+                matched = True
+                key = os.path.realpath(path)
+                if key not in seen:
+                    seen.add(key)
+                    yield path
+
+        if not matched and on_unmatched:
+            on_unmatched(raw_input)
+
+
+def _walk_images(path: Path, recursive: bool) -> Iterator[Path]:
+    """Images at path: the path itself, or the contents of a directory."""
+    if not path.is_dir():
+        if is_image_file(path):
+            yield path
+        return
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        if not recursive:
+            dirs.clear()
+        for name in sorted(files):
+            child = Path(root) / name
+            if is_image_file(child):
+                yield child
+
+
+def collect_image_paths(
+    inputs: Iterable[str], recursive: bool = False
+) -> Tuple[List[Path], List[str]]:
+    """Expand files, directories and glob patterns into a list of images.
+
+    Args:
+        inputs: Files, directories or glob patterns
+        recursive: Descend into subdirectories of directory inputs
+
+    Returns:
+        Tuple[List[Path], List[str]]: Unique image paths (in input order) and
+        the inputs that did not match any image
+    """
+    unmatched: List[str] = []
+    images = list(iter_image_paths(inputs, recursive, on_unmatched=unmatched.append))
+    return images, unmatched
+
+
+def get_default_jobs(model: Model) -> int:
+    """Get the configured number of concurrent workers for a model's provider."""
+    from config import get_provider_settings
+
+    settings = get_provider_settings(model.provider_type)
+    try:
+        jobs = int(settings.get("jobs", DEFAULT_JOBS.get(model.provider_type, 1)))
+    except (TypeError, ValueError):
+        jobs = DEFAULT_JOBS.get(model.provider_type, 1)
+    return max(1, jobs)
+
+
+def get_request_workers(model: Model, jobs: Optional[int] = None) -> int:
+    """Number of requests a batch may keep in flight.
+
+    jobs is the limit the user asked for; None uses the provider's
+    configured `jobs`. With adaptive concurrency, the configured value is
+    only the starting limit, and enough workers are started for the limit to
+    grow up to `max_jobs`; an explicit jobs stays the ceiling.
+    """
+    start = max(1, jobs) if jobs else get_default_jobs(model)
+    limiter = get_limiter(
+        model.provider_type, model.ollama_model_name or model.name, initial=start
+    )
+    if limiter is None:
+        return start
+    return limiter.maximum if jobs is None else min(start, limiter.maximum)
+
+
+class _FilenameClaims:
+    """Hands out output filenames that are unique within a single batch run.
+
+    With overwrite=False, files that already exist on disk are skipped too.
+    """
+
+    def __init__(self, overwrite: bool = True):
+        self._claimed = set()
+        self._overwrite = overwrite
+        self._lock = threading.Lock()
+
+    def _taken(self, full_path: str) -> bool:
+        return full_path in self._claimed or (
+            not self._overwrite and os.path.exists(full_path)
+        )
+
+    def claim(self, dest_path: str, filename: str) -> str:
+        stem, extension = os.path.splitext(filename)
+        return self.claim_group(dest_path, stem, [extension])[0]
+
+    def claim_group(
+        self, dest_path: str, stem: str, extensions: List[str]
+    ) -> List[str]:
+        """Claim one file per extension, all sharing the same unique stem."""
+        candidate = stem
+        counter = 1
+        with self._lock:
+            while any(
+                self._taken(os.path.join(dest_path, f"{candidate}{extension}"))
+                for extension in extensions
+            ):
+                candidate = f"{stem}_{counter}"
+                counter += 1
+            full_paths = [
+                os.path.join(dest_path, f"{candidate}{extension}")
+                for extension in extensions
+            ]
+            self._claimed.update(full_paths)
+        return full_paths
+
+
+@dataclass
+class _BatchItem:
+    """An image moving through the batch pipeline."""
+
+    image_path: Path
+    data: Optional[bytes] = None
+    upload_path: Optional[str] = None
+    response: Optional[str] = None
+    # Output file stem, and file extension and content per output file
+    stem: Optional[str] = None
+    files: List[Tuple[str, str]] = field(default_factory=list)
+    # Extensions of the files written, in the order of output_paths
+    extensions: List[str] = field(default_factory=list)
+    transcript: Optional[Transcript] = None
+    output_paths: List[str] = field(default_factory=list)
+    error: Optional[Exception] = None
+    trace: Optional[Trace] = None
+    input_hash: Optional[str] = None
+    usage: List[Usage] = field(default_factory=list)
+    model: Optional[str] = None
+    started: float = field(default_factory=time.monotonic)
+
+    def to_result(self) -> BatchResult:
+        return BatchResult(
+            image_path=self.image_path,
+            output_path=self.output_paths[0] if self.output_paths else None,
+            error=self.error,
+            output_paths=self.output_paths if self.transcript else [],
+            input_hash=self.input_hash,
+            seconds=time.monotonic() - self.started,
+            usage=self.usage,
+            model=self.model,
+        )
+
+
+def _guarded(step: Callable[[_BatchItem], None]) -> Callable[[_BatchItem], _BatchItem]:
+    """Wrap a pipeline step so failed items skip it and errors stay on the item."""
+
+    def run(item: _BatchItem) -> _BatchItem:
+        if item.error is None:
+            try:
+                with activate(item.trace):
+                    step(item)
+            except Exception as e:
+                item.error = e
+                item.data = None
+        return item
+
+    return run
+
+
+@dataclass
+class _BatchContext:
+    """Settings and shared state for one batch run."""
+
+    model: Model
+    output_format: str
+    dest_path: str
+    claims: _FilenameClaims
+    cache: Optional[ResponseCache] = None
+    refresh: bool = False
+    preprocess: Optional[PreprocessConfig] = None
+    work_dir: Optional[str] = None
+    rate_limiter: Optional[RateLimiter] = None
+    wait_for_quota: bool = False
+    # When set, one canonical transcript is requested per image and these
+    # formats are derived from it locally
+    derived_formats: Optional[List[str]] = None
+    pool: Optional[Executor] = None
+    hash_inputs: bool = False
+    # Picks the model of every request instead of using `model`
+    router: Optional[ModelRouter] = None
+
+    def make_dissector(
+        self, upload_path: str, model: Optional[Model] = None
+    ) -> ImageDissector:
+        rate_limiter = self.rate_limiter
+        if model is not None:
+            rate_limiter = get_rate_limiter(model)
+        return ImageDissector(
+            image_path=upload_path,
+            model=model or self.model,
+            output_format=(
+                CANONICAL_FORMAT if self.derived_formats else self.output_format
+            ),
+            cache=self.cache,
+            refresh=self.refresh,
+            rate_limiter=rate_limiter,
+            wait_for_quota=self.wait_for_quota,
+        )
+
+    def preprocess_args(self, image_path: Path, data: bytes = None) -> tuple:
+        """Arguments for preprocess_image, picklable for a process pool."""
+        if self.router is not None:
+            max_edge = self.router.max_image_edge(self.preprocess)
+        else:
+            max_edge = self.preprocess.max_edge_for(self.model)
+        return (str(image_path), self.preprocess, self.work_dir, max_edge, data)
+
+    def send(self, item: _BatchItem, model: Optional[Model] = None) -> str:
+        """Request the image's response from model, or the run's model."""
+        dissector = self.make_dissector(item.upload_path, model)
+        if model is not None:
+            item.model = model.name
+        try:
+            return dissector.get_response()
+        finally:
+            item.usage = dissector.usage
+
+    async def asend(self, item: _BatchItem, model: Optional[Model] = None) -> str:
+        dissector = self.make_dissector(item.upload_path, model)
+        if model is not None:
+            item.model = model.name
+        try:
+            return await dissector.aget_response()
+        finally:
+            item.usage = dissector.usage
+
+    # Pipeline steps: read → prepare → request → process → write
+
+    def read(self, item: _BatchItem) -> None:
+        """Load the image so preprocessing never waits on the disk."""
+        # Without preprocessing the provider reads the file itself
+        if self.pool is None and not self.hash_inputs:
+            return
+        with span("read"):
+            data = item.image_path.read_bytes()
+        if self.hash_inputs:
+            item.input_hash = hashlib.sha256(data).hexdigest()
+        if self.pool is not None:
+            item.data = data
+
+    def prepare(self, item: _BatchItem) -> None:
+        """Preprocess the image in the process pool."""
+        if self.pool is None:
+            item.upload_path = str(item.image_path)
+            return
+        with span("preprocess"):
+            future = self.pool.submit(
+                preprocess_image, *self.preprocess_args(item.image_path, item.data)
+            )
+            item.data = None
+            item.upload_path = future.result()
+
+    def request(self, item: _BatchItem) -> None:
+        """Get the model response for the image."""
+        try:
+            if self.router is not None:
+                item.response = self.router.request(lambda m: self.send(item, m))
+            else:
+                item.response = self.send(item)
+        finally:
+            # Preprocessed copies are only needed for the upload
+            if item.upload_path != str(item.image_path):
+                Path(item.upload_path).unlink(missing_ok=True)
+
+    def process(self, item: _BatchItem) -> None:
+        """Turn the response into output file contents."""
+        if self.derived_formats:
+            item.transcript = Transcript(
+                content=item.response,
+                model=item.model or self.model.name,
+                source=str(item.image_path),
+            )
+            item.stem, item.files = item.transcript.render_all(
+                self.derived_formats, item.image_path.stem
+            )
+        else:
+            formatter = ContentFormatter(self.output_format)
+            extension = formatter.format_config.file_extension
+            filename, content = formatter.render(
+                item.response, f"{item.image_path.stem}{extension}"
+            )
+            item.stem, extension = os.path.splitext(filename)
+            item.files = [(extension, content)]
+        item.response = None
+
+    @traced("write")
+    def write(self, item: _BatchItem) -> None:
+        """Write the output files under names unique within the run."""
+        extensions = [extension for extension, _ in item.files]
+        if item.transcript is not None:
+            extensions.append(TRANSCRIPT_SUFFIX)
+
+        output_paths = self.claims.claim_group(self.dest_path, item.stem, extensions)
+        for output_path, (_, content) in zip(output_paths, item.files):
+            _write_output(output_path, content)
+        if item.transcript is not None:
+            item.transcript.save(output_paths[-1])
+
+        item.output_paths = output_paths
+        item.extensions = extensions
+        item.files = []
+
+    def share(self, item: _BatchItem, duplicate: Path, link: str) -> BatchResult:
+        """Give a near-duplicate of item links to item's output files."""
+        result = BatchResult(image_path=duplicate, duplicate_of=item.image_path)
+        try:
+            output_paths = self.claims.claim_group(
+                self.dest_path, item.stem, item.extensions
+            )
+            for source, target in zip(item.output_paths, output_paths):
+                link_file(source, target, link)
+        except OSError as e:
+            result.error = e
+            return result
+        result.output_path = output_paths[0]
+        result.output_paths = output_paths if item.transcript else []
+        return result
+
+
+async def _aprocess_image(item: _BatchItem, context: _BatchContext) -> _BatchItem:
+    try:
+        if context.router is not None:
+            item.response = await context.router.arequest(
+                lambda m: context.asend(item, m)
+            )
+        else:
+            item.response = await context.asend(item)
+    except Exception as e:
+        item.error = e
+        return item
+    finally:
+        # Preprocessed copies are only needed for the upload
+        if item.upload_path != str(item.image_path):
+            Path(item.upload_path).unlink(missing_ok=True)
+
+    await asyncio.to_thread(_guarded(context.process), item)
+    await asyncio.to_thread(_guarded(context.write), item)
+    return item
+
+
+def _write_output(output_path: str, content: str) -> None:
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(content if content else "")
+
+
+def _preprocess_pool(preprocess: Optional[PreprocessConfig]):
+    """Process pool for preprocessing, or a no-op context when disabled."""
+    if preprocess is None or not preprocess.enabled:
+        return nullcontext()
+    return ProcessPoolExecutor(max_workers=preprocess.workers or None)
+
+
+def iter_batch(
+    image_paths: Iterable[Path],
+    model: Model,
+    output_format: str = "markdown",
+    dest_path: str = "./",
+    jobs: Optional[int] = 1,
+    cache: Optional[ResponseCache] = None,
+    refresh: bool = False,
+    preprocess: Optional[PreprocessConfig] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    wait_for_quota: bool = False,
+    derived_formats: Optional[List[str]] = None,
+    pipeline: Optional[PipelineConfig] = None,
+    profiler: Optional[Profiler] = None,
+    overwrite: bool = True,
+    hash_inputs: bool = False,
+    duplicates: Optional[DuplicatePlan] = None,
+    router: Optional[ModelRouter] = None,
+) -> Iterator[BatchResult]:
+    """Process images through the staged pipeline, yielding each result.
+
+    Images flow through read → prepare → request → process → write stages
+    connected by bounded queues, so reading and preprocessing the next
+    images overlaps with requests in flight while at most a few queues'
+    worth of images is held in memory. image_paths is consumed lazily.
+
+    A failing image never aborts the run; its exception is stored on its
+    BatchResult instead.
+
+    Args:
+        image_paths: Images to process
+        model: Model used for every image
+        output_format: Output format for every image
+        dest_path: Directory where output files are written
+        jobs: Maximum number of model requests in flight at once; None for
+            the provider's configured `jobs`, which with adaptive
+            concurrency is only the starting limit
+        cache: Response cache consulted before calling the model
+        refresh: Ignore cached responses (fresh responses are still stored)
+        preprocess: Image preprocessing applied before upload
+        rate_limiter: Limiter every model request must pass through
+        wait_for_quota: Wait for quota to free up instead of failing images
+        derived_formats: Request one canonical transcript per image and derive
+            these formats from it locally (output_format is then ignored)
+        pipeline: Worker counts and queue size of the other stages
+        profiler: Receives a trace of every image's stage timings
+        overwrite: Replace existing files in dest_path instead of picking a
+            free name
+        hash_inputs: Record the SHA-256 of every image on its BatchResult
+        duplicates: Near-duplicates of the images, which get links to the
+            outputs of their image instead of a request of their own (if
+            the image fails, its first duplicate is requested instead)
+        router: Route every request to the fastest healthy of its models;
+            `model` then only sizes the request stage, and rate_limiter is
+            replaced by each routed model's own limiter
+
+    Yields:
+        BatchResult: Results in completion order
+    """
+    os.makedirs(dest_path, exist_ok=True)
+    pipeline = pipeline or PipelineConfig()
+    workers = get_request_workers(model, jobs)
+
+    with (
+        tempfile.TemporaryDirectory(prefix="handmark-") as work_dir,
+        _preprocess_pool(preprocess) as pool,
+    ):
+        context = _BatchContext(
+            model=model,
+            output_format=output_format,
+            dest_path=dest_path,
+            claims=_FilenameClaims(overwrite),
+            cache=cache,
+            refresh=refresh,
+            preprocess=preprocess,
+            work_dir=work_dir,
+            rate_limiter=rate_limiter,
+            wait_for_quota=wait_for_quota,
+            derived_formats=derived_formats,
+            pool=pool,
+            hash_inputs=hash_inputs,
+            router=router,
+        )
+
+        prepare_workers = 1
+        if pool is not None:
+            prepare_workers = preprocess.workers or os.cpu_count() or 1
+
+        stages = [
+            Stage("read", _guarded(context.read), pipeline.read_workers),
+            Stage("prepare", _guarded(context.prepare), prepare_workers),
+            Stage("request", _guarded(context.request), workers),
+            Stage("process", _guarded(context.process), pipeline.process_workers),
+            Stage("write", _guarded(context.write), pipeline.write_workers),
+        ]
+        groups = duplicates.duplicates if duplicates is not None else {}
+        while True:
+            items = (
+                _BatchItem(
+                    image_path=Path(path),
+                    trace=Trace(str(path)) if profiler is not None else None,
+                )
+                for path in image_paths
+            )
+            # Groups whose image failed; the next duplicate is tried instead
+            orphaned: Dict[Path, List[Path]] = {}
+
+            for item in Pipeline(stages, pipeline.queue_size_for(workers)).run(items):
+                _finish_trace(item, profiler)
+                yield item.to_result()
+                group = groups.get(item.image_path)
+                if not group:
+                    continue
+                if item.error is not None:
+                    orphaned[group[0]] = group[1:]
+                    continue
+                for duplicate in group:
+                    yield context.share(item, duplicate, duplicates.link)
+
+            if not orphaned:
+                break
+            image_paths, groups = list(orphaned), orphaned
+
+
+def _finish_trace(item: _BatchItem, profiler: Optional[Profiler]) -> None:
+    if item.trace is not None and profiler is not None:
+        item.trace.finish(item.error)
+        profiler.add(item.trace)
+
+
+def run_batch(
+    image_paths: Iterable[Path],
+    model: Model,
+    output_format: str = "markdown",
+    dest_path: str = "./",
+    jobs: Optional[int] = 1,
+    on_result: Optional[Callable[[BatchResult], None]] = None,
+    cache: Optional[ResponseCache] = None,
+    refresh: bool = False,
+    preprocess: Optional[PreprocessConfig] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    wait_for_quota: bool = False,
+    derived_formats: Optional[List[str]] = None,
+    pipeline: Optional[PipelineConfig] = None,
+    profiler: Optional[Profiler] = None,
+    overwrite: bool = True,
+    hash_inputs: bool = False,
+    duplicates: Optional[DuplicatePlan] = None,
+    router: Optional[ModelRouter] = None,
+) -> List[BatchResult]:
+    """Process images concurrently, collecting per-image results.
+
+    Takes the same arguments as iter_batch, plus `on_result`, which is
+    called from the calling thread as each image finishes. Use iter_batch
+    directly for very large runs, where keeping every result is wasteful.
+
+    Returns:
+        List[BatchResult]: Results in completion order
+    """
+    results: List[BatchResult] = []
+    for result in iter_batch(
+        image_paths,
+        model=model,
+        output_format=output_format,
+        dest_path=dest_path,
+        jobs=jobs,
+        cache=cache,
+        refresh=refresh,
+        preprocess=preprocess,
+        rate_limiter=rate_limiter,
+        wait_for_quota=wait_for_quota,
+        derived_formats=derived_formats,
+        pipeline=pipeline,
+        profiler=profiler,
+        overwrite=overwrite,
+        hash_inputs=hash_inputs,
+        duplicates=duplicates,
+        router=router,
+    ):
+        results.append(result)
+        if on_result:
+            on_result(result)
+    return results
+
+
+async def run_batch_async(
+    image_paths: Iterable[Path],
+    model: Model,
+    output_format: str = "markdown",
+    dest_path: str = "./",
+    jobs: Optional[int] = 1,
+    on_result: Optional[Callable[[BatchResult], None]] = None,
+    cache: Optional[ResponseCache] = None,
+    refresh: bool = False,
+    preprocess: Optional[PreprocessConfig] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    wait_for_quota: bool = False,
+    derived_formats: Optional[List[str]] = None,
+    profiler: Optional[Profiler] = None,
+    overwrite: bool = True,
+    hash_inputs: bool = False,
+    duplicates: Optional[DuplicatePlan] = None,
+    router: Optional[ModelRouter] = None,
+) -> List[BatchResult]:
+    """Async variant of run_batch driven by the providers' async clients.
+
+    All requests share the running event loop; `jobs` bounds how many are in
+    flight at once instead of how many threads are used. A fixed number of
+    worker tasks pull images from image_paths, which is consumed lazily, so
+    at most that many images are being preprocessed or requested at a time.
+    Duplicates are handled as in iter_batch, once all images are done.
+    """
+    os.makedirs(dest_path, exist_ok=True)
+    workers = get_request_workers(model, jobs)
+    loop = asyncio.get_running_loop()
+
+    with (
+        tempfile.TemporaryDirectory(prefix="handmark-") as work_dir,
+        _preprocess_pool(preprocess) as pool,
+    ):
+        context = _BatchContext(
+            model=model,
+            output_format=output_format,
+            dest_path=dest_path,
+            claims=_FilenameClaims(overwrite),
+            cache=cache,
+            refresh=refresh,
+            preprocess=preprocess,
+            work_dir=work_dir,
+            rate_limiter=rate_limiter,
+            wait_for_quota=wait_for_quota,
+            derived_formats=derived_formats,
+            pool=pool,
+            hash_inputs=hash_inputs,
+            router=router,
+        )
+
+        async def process(item: _BatchItem) -> _BatchItem:
+            await asyncio.to_thread(_guarded(context.read), item)
+            if item.error is not None:
+                return item
+            item.upload_path = str(item.image_path)
+            if pool is not None:
+                try:
+                    with span("preprocess"):
+                        item.upload_path = await loop.run_in_executor(
+                            pool,
+                            preprocess_image,
+                            *context.preprocess_args(item.image_path, item.data),
+                        )
+                except Exception as e:
+                    item.error = e
+                    return item
+                finally:
+                    item.data = None
+            return await _aprocess_image(item, context)
+
+        results: List[BatchResult] = []
+
+        def report(result: BatchResult) -> None:
+            results.append(result)
+            if on_result:
+                on_result(result)
+
+        async def worker(
+            paths: Iterator, groups: Dict[Path, List[Path]], orphaned: Dict
+        ) -> None:
+            # The workers share one iterator; each takes its next image
+            # only once the previous one is done
+            for path in paths:
+                item = _BatchItem(
+                    image_path=Path(path),
+                    trace=Trace(str(path)) if profiler is not None else None,
+                )
+                with activate(item.trace):
+                    item = await process(item)
+                _finish_trace(item, profiler)
+                report(item.to_result())
+                group = groups.get(item.image_path)
+                if not group:
+                    continue
+                if item.error is not None:
+                    orphaned[group[0]] = group[1:]
+                    continue
+                for duplicate in group:
+                    report(
+                        await asyncio.to_thread(
+                            context.share, item, duplicate, duplicates.link
+                        )
+                    )
+
+        groups = duplicates.duplicates if duplicates is not None else {}
+        try:
+            while True:
+                # Groups whose image failed; the next duplicate is tried instead
+                orphaned: Dict[Path, List[Path]] = {}
+                paths = iter(image_paths)
+                tasks = [
+                    asyncio.create_task(worker(paths, groups, orphaned))
+                    for _ in range(workers)
+                ]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                if not orphaned:
+                    break
+                image_paths, groups = list(orphaned), orphaned
+        finally:
+            # Async clients are shared by all images but bound to this loop
+            await aclose_providers()
+
+    return results
@@ -0,0 +1,311 @@
+"""Accuracy and latency benchmark over a set of reference transcripts.
+
+`handmark bench` sends every image of a directory to each selected model in
+each selected output format, bypassing the response cache, and measures the
+request latency, tokens, payload size and, where the image has a reference
+transcript, the character and word error rates of the response's text
+against it. The report is a JSON file with stable keys, so runs can be
+compared over time, e.g. after changing preprocessing settings.
+"""
+
+import re
+import time
+import unicodedata
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from model import Model
+from profiling import Trace, activate, summarize
+
+# Reference transcript names tried for an image, "{stem}" being its stem
+REFERENCE_NAMES = (
+    "{stem}.md",
+    "{stem}.txt",
+    "{stem}-response.md",
+    "{stem}-response.txt",
+)
+
+_FENCE_OR_RULE = re.compile(r"^\s*(?:```.*|~~~.*|(?:-{3,}|\*{3,}|_{3,}))\s*$")
+_LINE_MARKUP = re.compile(r"^\s*(?:#{1,6}\s+|>\s?)")
+_INLINE_MARKUP = re.compile(r"\*\*|__|`")
+
+
+def find_reference(image_path: Path, references_dir: Path) -> Optional[Path]:
+    """The reference transcript of an image, if references_dir has one."""
+    for name in REFERENCE_NAMES:
+        candidate = references_dir / name.format(stem=image_path.stem)
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def normalize_text(text: str) -> str:
+    """Text without Markdown markup, code fences and layout whitespace.
+
+    Responses and references differ in formatting far more often than in
+    content, so only the words and their order are compared.
+    """
+    lines = []
+    for line in unicodedata.normalize("NFC", text).splitlines():
+        if _FENCE_OR_RULE.match(line):
+            continue
+        lines.append(_INLINE_MARKUP.sub("", _LINE_MARKUP.sub("", line)))
+    return " ".join(" ".join(lines).split())
+
+
+def _strings(document: Any) -> Iterator[str]:
+    """Text values of parsed JSON or YAML data, in document order."""
+    if isinstance(document, dict):
+        for value in document.values():
+            yield from _strings(value)
+    elif isinstance(document, list):
+        for value in document:
+            yield from _strings(value)
+    elif document is not None and not isinstance(document, bool):
+        yield str(document)
+
+
+def document_text(result) -> str:
+    """Transcribed text of a DigestResult, without the format's structure."""
+    if isinstance(result.document, ET.Element):
+        return "\n".join(result.document.itertext())
+    if result.document is not None:
+        return "\n".join(_strings(result.document))
+    return result.content or result.raw
+
+
+def edit_distance(source: List[Any], target: List[Any]) -> int:
+    """Levenshtein distance between two sequences.
+
+    Each row of the distance matrix is computed with NumPy: substitutions
+    and deletions element-wise, insertions as a running minimum.
+    """
+    import numpy as np
+
+    if not source or not target:
+        return max(len(source), len(target))
+
+    # Map items to integers so rows compare as arrays
+    vocabulary: Dict[Any, int] = {}
+    target_ids = np.array([vocabulary.setdefault(t, len(vocabulary)) for t in target])
+    positions = np.arange(len(target) + 1)
+    previous = positions.copy()
+    for i, item in enumerate(source, start=1):
+        cost = (target_ids != vocabulary.get(item, -1)).astype(np.int64)
+        row = np.empty_like(previous)
+        row[0] = i
+        row[1:] = np.minimum(previous[1:] + 1, previous[:-1] + cost)
+        # row[j] = min over k <= j of row[k] + (j - k)
+        row = np.minimum.accumulate(row - positions) + positions
+        previous = row
+    return int(previous[-1])
+
+
+def error_rates(text: str, reference: str) -> Tuple[float, float]:
+    """Character and word error rates of text against reference."""
+    text, reference = normalize_text(text), normalize_text(reference)
+    reference_words = reference.split()
+    cer = edit_distance(list(text), list(reference)) / max(1, len(reference))
+    wer = edit_distance(text.split(), reference_words) / max(1, len(reference_words))
+    return cer, wer
+
+
+@dataclass
+class BenchCase:
+    """One request of a benchmark: an image, a model, a format and a run."""
+
+    image: str
+    model: str
+    output_format: str
+    run: int
+    # Seconds from sending the request to the parsed result, without
+    # waiting for quota
+    seconds: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Encoded image sent with the request, and the image file uploaded
+    payload_bytes: Optional[int] = None
+    image_bytes: Optional[int] = None
+    response_chars: Optional[int] = None
+    # Whether the response parsed in its format, possibly after repair
+    valid: Optional[bool] = None
+    repaired: bool = False
+    cer: Optional[float] = None
+    wer: Optional[float] = None
+    reference: Optional[str] = None
+    error: Optional[str] = None
+    spans: Dict[str, float] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        for key in ("seconds", "cer", "wer"):
+            if data[key] is not None:
+                data[key] = round(data[key], 4)
+        data["spans"] = {name: round(value, 4) for name, value in self.spans.items()}
+        return data
+
+
+def run_case(
+    image_path: Path,
+    upload_path: str,
+    model: Model,
+    output_format: str,
+    run: int,
+    reference: Optional[Path] = None,
+    rate_limiter=None,
+    wait_for_quota: bool = False,
+) -> BenchCase:
+    """Request one image from model in output_format and score the response."""
+    from dissector import ImageDissector
+
+    case = BenchCase(
+        image=str(image_path),
+        model=model.name,
+        output_format=output_format,
+        run=run,
+        image_bytes=Path(upload_path).stat().st_size,
+        reference=str(reference) if reference else None,
+    )
+    # No cache: every case measures a real request
+    dissector = ImageDissector(
+        image_path=upload_path,
+        model=model,
+        output_format=output_format,
+        rate_limiter=rate_limiter,
+        wait_for_quota=wait_for_quota,
+    )
+    trace = Trace(str(image_path))
+    error = None
+    with activate(trace):
+        try:
+            result = dissector.digest_response()
+        except Exception as e:
+            error = e
+    trace.finish(error)
+
+    case.seconds = trace.seconds - trace.spans.get("rate_limit", 0.0)
+    case.spans = dict(trace.spans)
+    case.payload_bytes = trace.counters.get("payload_bytes")
+    case.prompt_tokens = sum(usage.prompt_tokens for usage in dissector.usage)
+    case.completion_tokens = sum(usage.completion_tokens for usage in dissector.usage)
+    if error is not None:
+        case.error = trace.error
+        return case
+
+    case.response_chars = len(result.raw)
+    case.repaired = result.repaired
+    if output_format != "markdown":
+        case.valid = result.document is not None
+    if reference is not None:
+        case.cer, case.wer = error_rates(
+            document_text(result), reference.read_text(encoding="utf-8")
+        )
+    return case
+
+
+def _mean(values: List[float], digits: int = 4) -> Optional[float]:
+    return round(sum(values) / len(values), digits) if values else None
+
+
+def summarize_cases(cases: List[BenchCase]) -> List[Dict[str, Any]]:
+    """Aggregates per model and output format, in the order first seen."""
+    groups: Dict[Tuple[str, str], List[BenchCase]] = {}
+    for case in cases:
+        groups.setdefault((case.model, case.output_format), []).append(case)
+
+    rows = []
+    for (model_name, output_format), group in groups.items():
+        done = [case for case in group if case.error is None]
+        latencies = [case.seconds for case in done]
+        scored = [case for case in done if case.cer is not None]
+        structured = [case for case in done if case.valid is not None]
+        payloads = [case.payload_bytes for case in done if case.payload_bytes]
+        rows.append(
+            {
+                "model": model_name,
+                "format": output_format,
+                "requests": len(group),
+                "errors": len(group) - len(done),
+                "latency": summarize(latencies) if latencies else None,
+                "prompt_tokens": _mean([c.prompt_tokens for c in done], 1),
+                "completion_tokens": _mean([c.completion_tokens for c in done], 1),
+                "payload_bytes": _mean(payloads, 0),
+                "cer": _mean([case.cer for case in scored]),
+                "wer": _mean([case.wer for case in scored]),
+                "scored": len(scored),
+                "valid_rate": (
+                    _mean([float(case.valid) for case in structured])
+                    if structured
+                    else None
+                ),
+            }
+        )
+    return rows
+
+
+def compare(
+    summary: List[Dict[str, Any]], baseline: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Changes of latency, tokens and error rates against a previous report.
+
+    Only models and formats present in both reports are compared.
+    """
+    previous = {
+        (row["model"], row["format"]): row for row in baseline.get("summary", [])
+    }
+
+    def delta(new: Optional[float], old: Optional[float]) -> Optional[float]:
+        if new is None or old is None:
+            return None
+        return round(new - old, 4)
+
+    changes = []
+    for row in summary:
+        old = previous.get((row["model"], row["format"]))
+        if old is None:
+            continue
+        latency = row["latency"] or {}
+        old_latency = old.get("latency") or {}
+        changes.append(
+            {
+                "model": row["model"],
+                "format": row["format"],
+                "p50": delta(latency.get("p50"), old_latency.get("p50")),
+                "p95": delta(latency.get("p95"), old_latency.get("p95")),
+                "completion_tokens": delta(
+                    row["completion_tokens"], old.get("completion_tokens")
+                ),
+                "cer": delta(row["cer"], old.get("cer")),
+                "wer": delta(row["wer"], old.get("wer")),
+            }
+        )
+    return changes
+
+
+def make_report(
+    cases: List[BenchCase],
+    models: List[Model],
+    formats: List[str],
+    runs: int,
+    preprocess=None,
+    started: Optional[float] = None,
+) -> Dict[str, Any]:
+    """The JSON report of a benchmark."""
+    started = started if started is not None else time.time()
+    return {
+        "started": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+        "seconds": round(time.time() - started, 3),
+        "settings": {
+            "models": [model.name for model in models],
+            "formats": formats,
+            "runs": runs,
+            "preprocessing": (
+                asdict(preprocess) if preprocess and preprocess.enabled else None
+            ),
+        },
+        "summary": summarize_cases(cases),
+        "cases": [case.to_dict() for case in cases],
+    }
@@ -0,0 +1,184 @@
+"""Content-addressed on-disk cache for AI responses."""
+
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from payload import ImagePayload
+
+DEFAULT_MAX_SIZE_MB = 256
+
+# After eviction the cache is trimmed to this fraction of its size cap, so
+# that eviction does not run again on every following write
+_EVICTION_TARGET = 0.9
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+class ResponseCache:
+    """Stores raw AI responses keyed by a hash of everything that shaped them.
+
+    Entries are plain text files sharded by the first two hex digits of their
+    key. An entry's mtime is its last use: reads touch it, and once the cache
+    grows beyond its size cap the least recently used entries are evicted.
+    """
+
+    suffix = ".txt"
+
+    def __init__(self, cache_dir: Path, max_size_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_size_bytes = max_size_bytes
+        self._size_estimate = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        image_path: Union[str, ImagePayload],
+        model_name: str,
+        system_message: str,
+        user_message: str,
+        output_format: str,
+    ) -> str:
+        """Build a cache key from the image bytes and request parameters.
+
+        image_path may also be the image's payload, whose mapped contents
+        are hashed without reading the file again.
+        """
+        digest = hashlib.sha256()
+        if isinstance(image_path, ImagePayload):
+            with image_path.view() as contents:
+                digest.update(contents)
+        else:
+            with open(image_path, "rb") as image_file:
+                for chunk in iter(lambda: image_file.read(1 << 20), b""):
+                    digest.update(chunk)
+
+        for part in (model_name, system_message, user_message, output_format):
+            # Separator keeps ("ab", "c") and ("a", "bc") from colliding
+            digest.update(b"\0")
+            digest.update((part or "").encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss."""
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            os.utime(entry_path)
+            return content
+        except OSError:
+            return None
+
+    def put(self, key: str, content: str) -> None:
+        """Store a response. Failures are ignored; the cache is best-effort."""
+        if not content:
+            return
+
+        entry_path = self._entry_path(key)
+        try:
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=entry_path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(content)
+                os.replace(tmp_path, entry_path)
+            except OSError:
+                os.unlink(tmp_path)
+                raise
+            written = entry_path.stat().st_size
+        except OSError:
+            return
+
+        with self._lock:
+            if self._size_estimate is None:
+                self._size_estimate = sum(size for _, size, _ in self._entries())
+            else:
+                self._size_estimate += written
+
+            if self._size_estimate > self.max_size_bytes:
+                self._evict()
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        """List (mtime, size, path) for every cache entry."""
+        entries = []
+        if not self.cache_dir.exists():
+            return entries
+
+        for shard in self.cache_dir.iterdir():
+            if not shard.is_dir():
+                continue
+            for entry in shard.iterdir():
+                if entry.suffix != self.suffix:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+        return entries
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until under the size target."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_size_bytes * _EVICTION_TARGET)
+
+        for _, size, entry in entries:
+            if total <= target:
+                break
+            try:
+                entry.unlink()
+                total -= size
+            except OSError:
+                continue
+
+        self._size_estimate = total
+
+    def clear(self) -> int:
+        """Delete every cache entry.
+
+        Returns:
+            int: Number of entries removed
+        """
+        removed = 0
+        with self._lock:
+            for _, _, entry in self._entries():
+                try:
+                    entry.unlink()
+                    removed += 1
+                except OSError:
+                    continue
+            self._size_estimate = 0
+        return removed
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Get the process-wide response cache, or None if caching is disabled."""
+    global _shared_cache
+
+    from config import get_cache_settings, get_config_dir
+
+    settings = get_cache_settings()
+    if not settings.get("enabled", True):
+        return None
+
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            try:
+                max_size_mb = float(settings.get("max_size_mb", DEFAULT_MAX_SIZE_MB))
+            except (TypeError, ValueError):
+                max_size_mb = DEFAULT_MAX_SIZE_MB
+            _shared_cache = ResponseCache(
+                cache_dir=get_config_dir() / "cache",
+                max_size_bytes=int(max_size_mb * 1024 * 1024),
+            )
+        return _shared_cache
@@ -1,10 +1,22 @@
+import copy
+import threading
 import yaml
 import os
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple, Any
 from dataclasses import dataclass, asdict
 from model import Model
 
+# Use libyaml's C parser when PyYAML was built with it
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Parsed YAML files keyed by path, valid while (mtime_ns, size) is unchanged
+_yaml_cache: Dict[Path, Tuple[Tuple[int, int], Any]] = {}
+_yaml_cache_lock = threading.Lock()
+_config_dir_ready = False
+
+MIGRATION_MARKER = ".migrated"
+
 
 @dataclass
 class AppConfig:
@@ -30,11 +42,56 @@ class AppConfig:
         )
 
 
+def get_config_dir() -> Path:
+    """Get the user configuration directory, creating it if needed"""
+    global _config_dir_ready
+
+    config_dir = Path.home() / ".config" / "handmark"
+    if not _config_dir_ready:
+        config_dir.mkdir(parents=True, exist_ok=True)
+        _config_dir_ready = True
+    return config_dir
+
+
+def _read_yaml(path: Path) -> Optional[Any]:
+    """Parse a YAML file, reusing the last parse while the file is unchanged.
+
+    Returns a copy callers may modify, or None if the file does not exist.
+
+    Raises:
+        yaml.YAMLError: If the file is not valid YAML
+        OSError: If the file cannot be read
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        _invalidate_yaml(path)
+        return None
+
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _yaml_cache_lock:
+        cached = _yaml_cache.get(path)
+
+    if cached is not None and cached[0] == signature:
+        data = cached[1]
+    else:
+        with open(path, "r") as f:
+            data = yaml.load(f, Loader=_YamlLoader)
+        with _yaml_cache_lock:
+            _yaml_cache[path] = (signature, data)
+
+    return copy.deepcopy(data)
+
+
+def _invalidate_yaml(path: Path) -> None:
+    """Drop the memoized parse of a YAML file"""
+    with _yaml_cache_lock:
+        _yaml_cache.pop(path, None)
+
+
 def get_config_path() -> Path:
     """Get the path to the configuration file"""
-    config_dir = Path.home() / ".config" / "handmark"
-    config_dir.mkdir(parents=True, exist_ok=True)
-    return config_dir / "config.yaml"
+    return get_config_dir() / "config.yaml"
 
 
 def get_project_config_path() -> Path:
@@ -46,12 +103,8 @@ def load_project_config() -> dict:
     """Load the project-wide configuration from config.yaml"""
     config_path = get_project_config_path()
 
-    if not config_path.exists():
-        return {}
-
     try:
-        with open(config_path, "r") as f:
-            return yaml.safe_load(f) or {}
+        return _read_yaml(config_path) or {}
     except (yaml.YAMLError, OSError):
         return {}
 
@@ -60,17 +113,17 @@ def load_config() -> AppConfig:
     """Load configuration from YAML file"""
     config_path = get_config_path()
 
-    if not config_path.exists():
+    try:
+        data = _read_yaml(config_path)
+    except (yaml.YAMLError, OSError):
+        return AppConfig()
+
+    if data is None:
         default_config = AppConfig()
         save_config(default_config)
         return default_config
 
-    try:
-        with open(config_path, "r") as f:
-            data = yaml.safe_load(f) or {}
-        return AppConfig.from_dict(data)
-    except (yaml.YAMLError, OSError):
-        return AppConfig()
+    return AppConfig.from_dict(data or {})
 
 
 def save_config(config: AppConfig) -> bool:
@@ -83,6 +136,8 @@ def save_config(config: AppConfig) -> bool:
         return True
     except (yaml.YAMLError, OSError):
         return False
+    finally:
+        _invalidate_yaml(config_path)
 
 
 def get_selected_model() -> Optional[Model]:
@@ -204,11 +259,20 @@ def migrate_from_env_file() -> bool:
 
 def initialize_config() -> None:
     """Initialize configuration system and migrate old configurations"""
-    # Migrate from old JSON config if it exists
-    migrate_from_json_config()
+    marker_path = get_config_dir() / MIGRATION_MARKER
+
+    # Migrations only need to run once per installation
+    if not marker_path.exists():
+        # Migrate from old JSON config if it exists
+        migrate_from_json_config()
+
+        # Migrate from .env file if it exists
+        migrate_from_env_file()
 
-    # Migrate from .env file if it exists
-    migrate_from_env_file()
+        try:
+            marker_path.touch()
+        except OSError:
+            pass
 
     # Ensure config file exists
     load_config()
@@ -227,6 +291,61 @@ def get_available_models_from_config() -> list:
     return project_config.get("available_models", [])
 
 
+def get_provider_settings(provider_type: str) -> dict:
+    """Get provider-specific settings (e.g. concurrency) from project configuration"""
+    project_config = load_project_config()
+    providers = project_config.get("providers") or {}
+    return providers.get(provider_type) or {}
+
+
+def get_cache_settings() -> dict:
+    """Get response cache settings from project configuration"""
+    project_config = load_project_config()
+    return project_config.get("cache") or {}
+
+
+def get_preprocessing_settings() -> dict:
+    """Get image preprocessing settings from project configuration"""
+    project_config = load_project_config()
+    return project_config.get("preprocessing") or {}
+
+
+def get_pipeline_settings() -> dict:
+    """Get batch pipeline settings from project configuration"""
+    project_config = load_project_config()
+    return project_config.get("pipeline") or {}
+
+
+def get_watch_settings() -> dict:
+    """Get folder watch settings from project configuration"""
+    project_config = load_project_config()
+    return project_config.get("watch") or {}
+
+
+def get_dedup_settings() -> dict:
+    """Get near-duplicate detection settings from project configuration"""
+    project_config = load_project_config()
+    return project_config.get("dedup") or {}
+
+
+def get_server_settings() -> dict:
+    """Get HTTP server settings from project configuration"""
+    project_config = load_project_config()
+    return project_config.get("server") or {}
+
+
+def get_repair_settings() -> dict:
+    """Get malformed output repair settings from project configuration"""
+    project_config = load_project_config()
+    return project_config.get("repair") or {}
+
+
+def get_routing_settings() -> dict:
+    """Get model routing settings from project configuration"""
+    project_config = load_project_config()
+    return project_config.get("routing") or {}
+
+
 def get_default_model_from_config() -> dict:
     """Get default model from project configuration"""
     project_config = load_project_config()
@@ -253,12 +372,7 @@ def update_project_config(key_path: str, value) -> bool:
     """
     try:
         config_path = get_project_config_path()
-
-        if config_path.exists():
-            with open(config_path, "r") as f:
-                config = yaml.safe_load(f) or {}
-        else:
-            config = {}
+        config = _read_yaml(config_path) or {}
 
         keys = key_path.split(".")
         current = config
@@ -272,6 +386,7 @@ def update_project_config(key_path: str, value) -> bool:
 
         with open(config_path, "w") as f:
             yaml.dump(config, f, default_flow_style=False, indent=2)
+        _invalidate_yaml(config_path)
 
         return True
     except (yaml.YAMLError, OSError, KeyError):
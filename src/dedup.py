@@ -0,0 +1,241 @@
+"""Near-duplicate detection for batch inputs.
+
+The same whiteboard or page is often photographed several times. Before a
+batch starts, every image gets a 64-bit perceptual hash (dHash or pHash,
+computed for the whole batch at once with NumPy), images whose hashes are
+within a Hamming distance of each other are grouped, and only the first
+image of each group is sent to the model. The other images get links (or
+copies) of its output files.
+"""
+
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+HASH_METHODS = ("dhash", "phash")
+LINK_MODES = ("hardlink", "symlink", "copy")
+
+# Side of the hash grid; hashes have HASH_SIZE ** 2 = 64 bits
+HASH_SIZE = 8
+# pHash keeps the low frequencies of a DCT over this many pixels per side
+_PHASH_SIZE = 32
+
+
+@dataclass
+class DedupConfig:
+    """Dataclass for near-duplicate detection settings."""
+
+    enabled: bool = False
+    method: str = "dhash"
+    # Largest number of differing hash bits for two images to be duplicates
+    threshold: int = 6
+    link: str = "hardlink"
+    workers: Optional[int] = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "DedupConfig":
+        """Create DedupConfig from configuration dictionary"""
+        method = str(config.get("method", "dhash")).lower()
+        if method not in HASH_METHODS:
+            raise ValueError(
+                f"Unsupported dedup method '{method}'. "
+                f"Use one of: {', '.join(HASH_METHODS)}"
+            )
+        link = str(config.get("link", "hardlink")).lower()
+        if link not in LINK_MODES:
+            raise ValueError(
+                f"Unsupported dedup link mode '{link}'. "
+                f"Use one of: {', '.join(LINK_MODES)}"
+            )
+        workers = config.get("workers")
+
+        return cls(
+            enabled=bool(config.get("enabled", False)),
+            method=method,
+            threshold=min(HASH_SIZE**2, max(0, int(config.get("threshold", 6)))),
+            link=link,
+            workers=int(workers) if workers else None,
+        )
+
+
+def get_dedup_config() -> DedupConfig:
+    """Returns the near-duplicate detection configuration.
+
+    Raises:
+        ValueError: If the configured method or link mode is not supported
+    """
+    from config import get_dedup_settings
+
+    return DedupConfig.from_config(get_dedup_settings())
+
+
+def _load_pixels(path: Path, size: tuple):
+    """Grayscale pixels of an image scaled to size (width, height)."""
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        # Let JPEG decode at a reduced scale; the hash only needs a thumbnail
+        image.draft("L", (size[0] * 8, size[1] * 8))
+        image = ImageOps.exif_transpose(image)
+        return image.convert("L").resize(size, Image.Resampling.LANCZOS)
+
+
+def _dct_matrix(n: int):
+    """Orthonormal DCT-II matrix, so that D @ x is the DCT of x."""
+    import numpy as np
+
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def _pack(bits):
+    """Pack an (N, 64) boolean array into N unsigned 64-bit hashes."""
+    import numpy as np
+
+    return np.packbits(bits, axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def dhash(pixels):
+    """Difference hashes of a stack of (N, 8, 9) grayscale thumbnails."""
+    bits = pixels[:, :, 1:] > pixels[:, :, :-1]
+    return _pack(bits.reshape(len(pixels), -1))
+
+
+def phash(pixels):
+    """DCT hashes of a stack of (N, 32, 32) grayscale thumbnails."""
+    import numpy as np
+
+    matrix = _dct_matrix(_PHASH_SIZE)
+    coefficients = matrix @ pixels.astype(np.float64) @ matrix.T
+    low = coefficients[:, :HASH_SIZE, :HASH_SIZE].reshape(len(pixels), -1)
+    # The DC term only reflects overall brightness
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack(low > median)
+
+
+def hash_images(paths: List[Path], method: str = "dhash", workers: int = None):
+    """Perceptual hashes of images.
+
+    Returns:
+        Tuple[numpy.ndarray, List[int]]: Hashes of the images that could be
+        read, and their indices in paths
+    """
+    import numpy as np
+
+    if method == "phash":
+        size, compute = (_PHASH_SIZE, _PHASH_SIZE), phash
+    else:
+        size, compute = (HASH_SIZE + 1, HASH_SIZE), dhash
+
+    def load(path: Path):
+        try:
+            return np.asarray(_load_pixels(path, size), dtype=np.int16)
+        except Exception:
+            return None  # Left for the batch to report
+
+    # Decoding and scaling release the GIL
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        thumbnails = list(pool.map(load, paths))
+
+    indices = [i for i, pixels in enumerate(thumbnails) if pixels is not None]
+    if not indices:
+        return np.zeros(0, dtype=np.uint64), []
+    return compute(np.stack([thumbnails[i] for i in indices])), indices
+
+
+def hamming_distances(hash_value, hashes):
+    """Number of differing bits between one hash and each of hashes."""
+    import numpy as np
+
+    xor = np.bitwise_xor(hashes, np.uint64(hash_value))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor)
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+@dataclass
+class DuplicatePlan:
+    """Images to send to the model and the near-duplicates each one stands for."""
+
+    representatives: List[Path]
+    # Representative -> duplicates reusing its result
+    duplicates: Dict[Path, List[Path]] = field(default_factory=dict)
+    link: str = "hardlink"
+
+    @property
+    def skipped(self) -> int:
+        """Number of model requests saved."""
+        return sum(len(paths) for paths in self.duplicates.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "images": len(self.representatives) + self.skipped,
+            "requests": len(self.representatives),
+            "skipped": self.skipped,
+            "groups": [
+                {"image": str(representative), "duplicates": [str(p) for p in paths]}
+                for representative, paths in self.duplicates.items()
+            ],
+        }
+
+
+def find_duplicates(paths: List[Path], config: DedupConfig) -> DuplicatePlan:
+    """Group near-identical images.
+
+    Every image in a group is within config.threshold bits of the group's
+    first image (in input order), which becomes its representative. Images
+    that cannot be read are kept as representatives of their own.
+    """
+    import numpy as np
+
+    hashes, indices = hash_images(paths, config.method, config.workers)
+    group_of: Dict[int, int] = {}
+    # Positions in hashes of the group leaders, and their hashes
+    leaders: List[int] = []
+    leader_hashes = np.empty(len(hashes), dtype=np.uint64)
+    for position, index in enumerate(indices):
+        count = len(leaders)
+        if count:
+            distances = hamming_distances(hashes[position], leader_hashes[:count])
+            closest = int(np.argmin(distances))
+            if distances[closest] <= config.threshold:
+                group_of[index] = indices[leaders[closest]]
+                continue
+        leader_hashes[count] = hashes[position]
+        leaders.append(position)
+
+    representatives = []
+    duplicates: Dict[Path, List[Path]] = {}
+    for index, path in enumerate(paths):
+        leader = group_of.get(index)
+        if leader is None:
+            representatives.append(path)
+        else:
+            duplicates.setdefault(paths[leader], []).append(path)
+    return DuplicatePlan(representatives, duplicates, config.link)
+
+
+def link_file(source: str, target: str, mode: str = "hardlink") -> None:
+    """Make target a link to (or copy of) source, replacing target.
+
+    Hard links fall back to copies where the file system does not allow
+    them, e.g. across devices.
+    """
+    if os.path.lexists(target):
+        os.remove(target)
+    if mode == "symlink":
+        os.symlink(os.path.relpath(source, os.path.dirname(target)), target)
+        return
+    if mode == "hardlink":
+        try:
+            os.link(source, target)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source, target)
@@ -1,29 +1,66 @@
+import asyncio
 import os
+from contextlib import contextmanager
 import re
 import json
 import yaml
 import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+from models.canonical import get_canonical_config
 from models.json import get_json_config
 from models.markdown import get_markdown_config
 from models.xml import get_xml_config
 from models.yaml import get_yaml_config
 from providers.factory import create_provider
+from providers.retry import charge_retries
+from cache import ResponseCache
+from ratelimit import RateLimiter
 from model import Model
+from payload import ImagePayload
+from profiling import count, span, traced
+from usage import Usage, collect
 
+# Format requested from the model when several output formats are derived
+# locally from a single response
+CANONICAL_FORMAT = "canonical"
 
-class ImageDissector:
-    def __init__(
-        self,
-        image_path: str,
-        model: Model,
-        output_format: str = "markdown",
-    ):
-        self.image_path = image_path
-        self.image_format = image_path.split(".")[-1]
+# Formats whose responses are parsed into a document
+_STRUCTURED_FORMATS = ("json", "yaml", "xml")
+
+
+@dataclass
+class DigestResult:
+    """A model response, parsed once.
+
+    Filename derivation and serialization both read from here, so the
+    response is never parsed a second time.
+    """
+
+    # Text as the model returned it
+    raw: str
+    output_format: str
+    # Parsed JSON or YAML data, or an XML Element; None for Markdown and
+    # for responses that are not valid in the output format
+    document: Any = None
+    # Serialized output, the raw text if it could not be parsed
+    content: str = ""
+    # Title read from the document, not yet sanitized into a filename
+    title: Optional[str] = None
+    # Whether the raw text was malformed and had to be repaired
+    repaired: bool = False
+
+
+class ContentFormatter:
+    """Turns raw model output into a named document in one output format.
+
+    Formatting needs no provider, so content that was already produced (for
+    example a saved transcript) can be rendered again without a model call.
+    """
+
+    def __init__(self, output_format: str = "markdown"):
         self.output_format = output_format.lower()
         self.format_config = self._get_format_config()
-        self._model = model
-        self._provider = create_provider(model)
 
     def _get_format_config(self):
         """Get configuration for the current output format using dataclasses"""
@@ -35,6 +72,8 @@ class ImageDissector:
             return get_yaml_config()
         elif self.output_format == "xml":
             return get_xml_config()
+        elif self.output_format == CANONICAL_FORMAT:
+            return get_canonical_config()
         else:
             raise ValueError(f"Unknown output format '{self.output_format}'.")
 
@@ -64,74 +103,17 @@ class ImageDissector:
         extension = self._get_file_extension()
         return f"{name}{extension}"
 
-    def get_response(self) -> str:
-        """Get AI response using the configured provider"""
-        system_message_content = self.format_config.system_message_content
-        user_message_text = self.format_config.user_message_content
-
-        model_name = (
-            self._model.ollama_model_name
-            if self._model.ollama_model_name
-            else self._model.name
-        )
+    @staticmethod
+    def _title_from_line(line: str) -> str:
+        """Title in the first line of a Markdown document"""
+        title_candidate = line.strip()
+        if title_candidate.startswith("#"):
+            title_candidate = title_candidate.lstrip("#").strip()
+        return title_candidate
 
-        return self._provider.get_response(
-            image_path=self.image_path,
-            system_message=system_message_content,
-            user_message=user_message_text,
-            model_name=model_name,
-        )
-
-    def _process_content(self, raw_content: str) -> str:
-        """Process the raw content based on the output format"""
-        if self.output_format == "markdown":
-            return raw_content
-        elif self.output_format == "json":
-            return self._process_json_content(raw_content)
-        elif self.output_format == "yaml":
-            return self._process_yaml_content(raw_content)
-        elif self.output_format == "xml":
-            return self._process_xml_content(raw_content)
-        else:
-            return raw_content
-
-    def _process_json_content(self, content: str) -> str:
-        """Process and validate JSON content"""
-        try:
-            clean_content = self._strip_code_blocks(content, "json")
-            parsed = json.loads(clean_content)
-            return json.dumps(
-                parsed,
-                indent=2 if self.format_config.pretty_print else None,
-                ensure_ascii=not self.format_config.ensure_ascii,
-            )
-        except json.JSONDecodeError:
-            # If it's not valid JSON, return as-is
-            return content
-
-    def _process_yaml_content(self, content: str) -> str:
-        """Process and validate YAML content"""
-        try:
-            clean_content = self._strip_code_blocks(content, "yaml")
-            parsed = yaml.safe_load(clean_content)
-            return yaml.dump(
-                parsed,
-                default_flow_style=self.format_config.default_flow_style,
-                allow_unicode=self.format_config.allow_unicode,
-            )
-        except yaml.YAMLError:
-            return content
-
-    def _process_xml_content(self, content: str) -> str:
-        """Process and validate XML content"""
-        try:
-            clean_content = self._strip_code_blocks(content, "xml")
-            root = ET.fromstring(clean_content)
-            if self.format_config.pretty_print:
-                ET.indent(root, space="  ")
-            return ET.tostring(root, encoding="unicode")
-        except ET.ParseError:
-            return content
+    def _filename_from_title_line(self, line: str) -> str:
+        """Derive a filename from the first line of a Markdown document"""
+        return self._sanitize_filename(self._title_from_line(line))
 
     def _strip_code_blocks(self, content: str, format_type: str) -> str:
         """Strip markdown code blocks from content if present"""
@@ -157,94 +139,559 @@ class ImageDissector:
 
         return content
 
-    def write_response(
-        self, dest_path: str = "./", fallback_filename: str = None
-    ) -> str:
-        raw_content = self.get_response()
-        processed_content = self._process_content(raw_content)
+    @property
+    def document_format(self) -> Optional[str]:
+        """Format the model response is parsed as, None for Markdown."""
+        if self.output_format == CANONICAL_FORMAT:
+            return "json"
+        return self.output_format if self.output_format in _STRUCTURED_FORMATS else None
+
+    def _parse_document(self, content: str) -> Any:
+        """Parse content in the output format.
+
+        Returns:
+            Any: The parsed data, or an Element for XML
+
+        Raises:
+            ValueError: If content is not valid in the output format
+        """
+        document_format = self.document_format
+        clean_content = self._strip_code_blocks(content, document_format)
+        try:
+            if document_format == "json":
+                return json.loads(clean_content)
+            if document_format == "yaml":
+                return yaml.safe_load(clean_content)
+            return ET.fromstring(clean_content)
+        except (json.JSONDecodeError, yaml.YAMLError, ET.ParseError) as e:
+            raise ValueError(str(e)) from e
+
+    def _repair_document(self, content: str) -> Any:
+        """Parse malformed content after repairing it locally (see repair.py).
+
+        Raises:
+            ValueError: If the content cannot be repaired, or local repair
+                is disabled
+        """
+        from repair import get_repair_config, repair_document
+
+        if not get_repair_config().local:
+            raise ValueError("Local repair is disabled")
+        with span("repair"):
+            document = repair_document(content, self.document_format)
+        count("repaired")
+        return document
+
+    def _serialize(self, document: Any) -> str:
+        """Serialize a parsed document with the output format's settings."""
+        if self.output_format == "json":
+            return json.dumps(
+                document,
+                indent=2 if self.format_config.pretty_print else None,
+                ensure_ascii=not self.format_config.ensure_ascii,
+            )
+        if self.output_format == "yaml":
+            return yaml.dump(
+                document,
+                default_flow_style=self.format_config.default_flow_style,
+                allow_unicode=self.format_config.allow_unicode,
+            )
+        if self.format_config.pretty_print:
+            ET.indent(document, space="  ")
+        return ET.tostring(document, encoding="unicode")
+
+    @staticmethod
+    def _xml_title(root: ET.Element) -> Optional[str]:
+        """Title of an XML document, or the first words of its text."""
+        title_elem = root.find(".//title")
+        if title_elem is not None and title_elem.text:
+            return title_elem.text.strip()
+
+        # Fallback: use the first few words of the content element
+        content_elem = root.find(".//content")
+        if content_elem is not None and content_elem.text:
+            content_text = content_elem.text.strip()
+            if content_text:
+                return " ".join(content_text.split()[:4])
+
+        # If still no title, use the first text content of any element
+        for elem in root.iter():
+            if elem.text and elem.text.strip():
+                return " ".join(elem.text.strip().split()[:3])
+        return None
+
+    def _title(self, document: Any) -> Optional[str]:
+        """Title of a parsed document, if it names one."""
+        if isinstance(document, ET.Element):
+            return self._xml_title(document)
+        if isinstance(document, dict):
+            title = document.get("title")
+            if title and isinstance(title, str):
+                return title
+        return None
+
+    @traced("format")
+    def parse(self, raw_content: str) -> DigestResult:
+        """Parse raw AI output once into a DigestResult.
+
+        Content that is not valid in the output format is repaired locally
+        if possible, otherwise passed through unchanged, without a document
+        or title.
+        """
+        if self.output_format == "markdown":
+            lines = raw_content.splitlines()
+            title = self._title_from_line(lines[0]) if lines else None
+            return DigestResult(
+                raw_content, self.output_format, None, raw_content, title
+            )
 
+        passthrough = DigestResult(raw_content, self.output_format, None, raw_content)
+        if self.output_format not in _STRUCTURED_FORMATS:
+            return passthrough
+        repaired = False
+        try:
+            document = self._parse_document(raw_content)
+        except ValueError:
+            try:
+                document = self._repair_document(raw_content)
+            except ValueError:
+                return passthrough
+            repaired = True
+        result = self.from_document(document, raw_content)
+        result.repaired = repaired
+        return result
+
+    @traced("format")
+    def from_document(self, document: Any, raw_content: str = None) -> DigestResult:
+        """Build a DigestResult from an already parsed document.
+
+        Args:
+            document: Parsed JSON or YAML data, or an XML Element
+            raw_content: Text the document was parsed from, if any
+        """
+        # Indenting rewrites the whitespace of XML elements, so the title
+        # is read first
+        title = self._title(document)
+        content = self._serialize(document)
+        return DigestResult(
+            content if raw_content is None else raw_content,
+            self.output_format,
+            document,
+            content,
+            title,
+        )
+
+    def filename_for(self, result: DigestResult, fallback_filename: str = None) -> str:
+        """Output filename for a result, derived from its title if it has one."""
         if fallback_filename is None:
-            extension = self._get_file_extension()
-            fallback_filename = f"response{extension}"
-
-        final_filename_to_use = fallback_filename
-
-        if processed_content:
-            if self.output_format == "markdown":
-                lines = processed_content.splitlines()
-                if lines:
-                    title_candidate = lines[0].strip()
-                    if title_candidate.startswith("#"):
-                        title_candidate = title_candidate.lstrip("#").strip()
-                    if title_candidate:
-                        derived_filename = self._sanitize_filename(title_candidate)
-                        if derived_filename:
-                            final_filename_to_use = derived_filename
-
-            elif self.output_format in ["json", "yaml"]:
-                try:
-                    content_to_parse = self._strip_code_blocks(
-                        processed_content, self.output_format
+            fallback_filename = f"response{self._get_file_extension()}"
+        if result.content and result.title:
+            return self._sanitize_filename(result.title) or fallback_filename
+        return fallback_filename
+
+    def render(
+        self, raw_content: str, fallback_filename: str = None
+    ) -> Tuple[str, str]:
+        """Process raw AI output and derive the output filename from it.
+
+        Returns:
+            Tuple[str, str]: Output filename and processed content
+        """
+        result = self.parse(raw_content)
+        return self.filename_for(result, fallback_filename), result.content
+
+    @traced("write")
+    def _write_file(self, dest_path: str, filename: str, content: str) -> str:
+        """Write processed content to dest_path/filename."""
+        os.makedirs(dest_path, exist_ok=True)
+        full_output_path = os.path.join(dest_path, filename)
+
+        with open(full_output_path, "w", encoding="utf-8") as f:
+            f.write(content if content else "")
+
+        return full_output_path
+
+
+class ImageDissector(ContentFormatter):
+    def __init__(
+        self,
+        image_path: str,
+        model: Model,
+        output_format: str = "markdown",
+        cache: Optional[ResponseCache] = None,
+        refresh: bool = False,
+        rate_limiter: Optional[RateLimiter] = None,
+        wait_for_quota: bool = False,
+    ):
+        self.image_path = image_path
+        self.image_format = image_path.split(".")[-1]
+        super().__init__(output_format)
+        self._model = model
+        self._provider = create_provider(model)
+        self._cache = cache
+        self._refresh = refresh
+        self._rate_limiter = rate_limiter
+        self._wait_for_quota = wait_for_quota
+        # Usage of the model requests made for the last response
+        self.usage: List[Usage] = []
+
+    def _get_model_name(self) -> str:
+        """Get the provider-side name of the configured model"""
+        return (
+            self._model.ollama_model_name
+            if self._model.ollama_model_name
+            else self._model.name
+        )
+
+    def _get_cache_key(self, payload: Optional[ImagePayload] = None) -> str:
+        """Get the response cache key for this image and request"""
+        return ResponseCache.make_key(
+            image_path=payload or self.image_path,
+            model_name=self._get_model_name(),
+            system_message=self.format_config.system_message_content,
+            user_message=self.format_config.user_message_content,
+            output_format=self.output_format,
+        )
+
+    def _get_cached_response(self, cache_key: Optional[str]) -> Optional[str]:
+        """Look up a cached response unless a refresh was requested"""
+        if cache_key is None or self._refresh:
+            return None
+        with span("cache"):
+            cached = self._cache.get(cache_key)
+        if cached is not None:
+            count("cache_hits")
+            count("response_chars", len(cached))
+        return cached
+
+    def _store_response(self, cache_key: Optional[str], response: str) -> None:
+        """Record the size of a fresh response and cache it if enabled"""
+        count("response_chars", len(response))
+        if cache_key is not None:
+            with span("cache"):
+                self._cache.put(cache_key, response)
+
+    @contextmanager
+    def _metered(self) -> Iterator[None]:
+        """Keep the usage of the requests made in the block in self.usage.
+
+        Retries made by the provider in the block take quota like the first
+        attempt.
+        """
+        with (
+            collect() as usages,
+            charge_retries(self._rate_limiter, self._wait_for_quota),
+        ):
+            try:
+                yield
+            finally:
+                for usage in usages:
+                    usage.output_format = self.output_format
+                self.usage = usages
+
+    def _needs_remote_repair(self, response: str):
+        """Repair settings if response should be repaired by the model, else None.
+
+        That is when remote repair is enabled and the response can be parsed
+        neither as it is nor after local repair.
+        """
+        if self.document_format is None:
+            return None
+        from repair import get_repair_config
+
+        config = get_repair_config()
+        if not config.remote or len(response) > config.max_chars:
+            return None
+        for parse in (self._parse_document, self._repair_document):
+            try:
+                parse(response)
+                return None
+            except ValueError:
+                continue
+        return config
+
+    def _remote_repair_request(self, response: str, config) -> dict:
+        """Arguments of the text-only request that repairs response."""
+        from repair import REMOTE_SYSTEM_MESSAGE
+
+        return {
+            "system_message": REMOTE_SYSTEM_MESSAGE.format(
+                name=self.document_format.upper()
+            ),
+            "user_message": response,
+            "model_name": config.model or self._get_model_name(),
+        }
+
+    def _accept_repair(self, response: str, repaired: str) -> str:
+        """The repaired response if it can be parsed, otherwise response."""
+        count("remote_repairs")
+        for parse in (self._parse_document, self._repair_document):
+            try:
+                parse(repaired)
+                return repaired
+            except ValueError:
+                continue
+        return response
+
+    def _repair_remotely(self, response: str) -> str:
+        """Let the model fix a malformed response, sending only its text.
+
+        Any failure keeps the response as it is; it is still saved.
+        """
+        config = self._needs_remote_repair(response)
+        if config is None:
+            return response
+        try:
+            if self._rate_limiter is not None:
+                with span("rate_limit"):
+                    self._rate_limiter.acquire(wait_for_quota=self._wait_for_quota)
+            with span("repair"):
+                repaired = self._provider.complete_text(
+                    **self._remote_repair_request(response, config)
+                )
+        except Exception:
+            return response
+        return self._accept_repair(response, repaired)
+
+    async def _arepair_remotely(self, response: str) -> str:
+        """Async variant of _repair_remotely."""
+        config = await asyncio.to_thread(self._needs_remote_repair, response)
+        if config is None:
+            return response
+        try:
+            if self._rate_limiter is not None:
+                with span("rate_limit"):
+                    await self._rate_limiter.aacquire(
+                        wait_for_quota=self._wait_for_quota
                     )
+            with span("repair"):
+                repaired = await self._provider.acomplete_text(
+                    **self._remote_repair_request(response, config)
+                )
+        except Exception:
+            return response
+        return await asyncio.to_thread(self._accept_repair, response, repaired)
 
-                    if self.output_format == "json":
-                        data = json.loads(content_to_parse)
-                    else:
-                        data = yaml.safe_load(content_to_parse)
-
-                    if isinstance(data, dict) and "title" in data:
-                        title = data["title"]
-                        if title and isinstance(title, str):
-                            derived_filename = self._sanitize_filename(title)
-                            if derived_filename:
-                                final_filename_to_use = derived_filename
-                except (json.JSONDecodeError, yaml.YAMLError):
-                    pass
-
-            elif self.output_format == "xml":
-                try:
-                    content_to_parse = self._strip_code_blocks(
-                        processed_content, self.output_format
+    def get_response(self) -> str:
+        """Get AI response using the configured provider"""
+        # One mapping of the image serves the cache key and every attempt
+        with self._metered(), ImagePayload(self.image_path) as payload:
+            with span("cache"):
+                cache_key = (
+                    self._get_cache_key(payload) if self._cache is not None else None
+                )
+            cached = self._get_cached_response(cache_key)
+            if cached is not None:
+                return cached
+
+            if self._rate_limiter is not None:
+                with span("rate_limit"):
+                    self._rate_limiter.acquire(wait_for_quota=self._wait_for_quota)
+
+            with span("request"):
+                response = self._provider.get_response(
+                    image_path=self.image_path,
+                    system_message=self.format_config.system_message_content,
+                    user_message=self.format_config.user_message_content,
+                    model_name=self._get_model_name(),
+                    payload=payload,
+                )
+
+            response = self._repair_remotely(response)
+            self._store_response(cache_key, response)
+            return response
+
+    async def aget_response(self) -> str:
+        """Get AI response using the configured provider's async client"""
+        with self._metered(), ImagePayload(self.image_path) as payload:
+            cache_key = None
+            if self._cache is not None:
+                with span("cache"):
+                    cache_key = await asyncio.to_thread(self._get_cache_key, payload)
+                cached = await asyncio.to_thread(self._get_cached_response, cache_key)
+                if cached is not None:
+                    return cached
+
+            if self._rate_limiter is not None:
+                with span("rate_limit"):
+                    await self._rate_limiter.aacquire(
+                        wait_for_quota=self._wait_for_quota
                     )
-                    root = ET.fromstring(content_to_parse)
-
-                    # First, try to find a title element
-                    title_elem = root.find(".//title")
-                    title_text = None
-
-                    if title_elem is not None and title_elem.text:
-                        title_text = title_elem.text.strip()
-                    else:
-                        # Fallback: try to extract meaningful content
-                        # Look for content element and use first few words
-                        content_elem = root.find(".//content")
-                        if content_elem is not None and content_elem.text:
-                            content_text = content_elem.text.strip()
-                            if content_text:
-                                # Use first 3-5 words as title
-                                words = content_text.split()[:4]
-                                title_text = " ".join(words)
-
-                        # If still no title, use the root element's first text content
-                        if not title_text:
-                            for elem in root.iter():
-                                if elem.text and elem.text.strip():
-                                    words = elem.text.strip().split()[:3]
-                                    title_text = " ".join(words)
-                                    break
-
-                    if title_text:
-                        derived_filename = self._sanitize_filename(title_text)
-                        if derived_filename:
-                            final_filename_to_use = derived_filename
-
-                except ET.ParseError:
-                    pass
 
+            with span("request"):
+                response = await self._provider.aget_response(
+                    image_path=self.image_path,
+                    system_message=self.format_config.system_message_content,
+                    user_message=self.format_config.user_message_content,
+                    model_name=self._get_model_name(),
+                    payload=payload,
+                )
+
+            response = await self._arepair_remotely(response)
+            await asyncio.to_thread(self._store_response, cache_key, response)
+            return response
+
+    def stream_response(self) -> Iterator[str]:
+        """Get AI response chunks as the configured provider generates them"""
+        with self._metered(), ImagePayload(self.image_path) as payload:
+            with span("cache"):
+                cache_key = (
+                    self._get_cache_key(payload) if self._cache is not None else None
+                )
+            cached = self._get_cached_response(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+            if self._rate_limiter is not None:
+                with span("rate_limit"):
+                    self._rate_limiter.acquire(wait_for_quota=self._wait_for_quota)
+
+            chunks = self._provider.stream_response(
+                image_path=self.image_path,
+                system_message=self.format_config.system_message_content,
+                user_message=self.format_config.user_message_content,
+                model_name=self._get_model_name(),
+                payload=payload,
+            )
+            # Chunks are only kept when the complete response has to be cached
+            parts = [] if cache_key is not None else None
+            received = 0
+            for chunk in chunks:
+                if parts is not None:
+                    parts.append(chunk)
+                received += len(chunk)
+                yield chunk
+
+            count("response_chars", received)
+            if cache_key is not None:
+                with span("cache"):
+                    self._cache.put(cache_key, "".join(parts))
+
+    async def aclose(self) -> None:
+        """Release async clients held by the provider.
+
+        The provider is shared by the whole process, so only call this once
+        no other dissector is using it from the current event loop.
+        """
+        await self._provider.aclose()
+
+    def digest_response(self) -> DigestResult:
+        """Get the AI response and parse it once."""
+        return self.parse(self.get_response())
+
+    async def adigest_response(self) -> DigestResult:
+        """Async variant of digest_response.
+
+        Parsing may repair a large document, so it runs in a worker thread
+        instead of blocking the event loop.
+        """
+        response = await self.aget_response()
+        return await asyncio.to_thread(self.parse, response)
+
+    def render_response(self, fallback_filename: str = None) -> Tuple[str, str]:
+        """Get the AI response and derive the output filename from its content.
+
+        Returns:
+            Tuple[str, str]: Output filename and processed content
+        """
+        result = self.digest_response()
+        return self.filename_for(result, fallback_filename), result.content
+
+    async def arender_response(self, fallback_filename: str = None) -> Tuple[str, str]:
+        """Async variant of render_response."""
+        result = await self.adigest_response()
+        return self.filename_for(result, fallback_filename), result.content
+
+    def write_response(
+        self, dest_path: str = "./", fallback_filename: str = None
+    ) -> str:
+        result = self.digest_response()
+        return self._write_file(
+            dest_path, self.filename_for(result, fallback_filename), result.content
+        )
+
+    def write_stream(
+        self,
+        dest_path: str = "./",
+        fallback_filename: str = None,
+        on_progress: Optional[Callable[[str, int], None]] = None,
+    ) -> str:
+        """Stream the AI response into a file as it is generated.
+
+        Only Markdown can be written before the response is complete. The
+        filename is derived from the title line as soon as that line has
+        arrived, and a partially written file is removed if the stream fails.
+
+        Args:
+            dest_path: Directory where the file is written
+            fallback_filename: Filename used when the title line gives none
+            on_progress: Called with the output path and the number of
+                characters written after each chunk
+
+        Returns:
+            str: Path of the written file
+        """
+        if self.output_format != "markdown":
+            raise ValueError("Streaming output is only supported for Markdown.")
+
+        if fallback_filename is None:
+            fallback_filename = f"response{self._get_file_extension()}"
         os.makedirs(dest_path, exist_ok=True)
-        full_output_path = os.path.join(dest_path, final_filename_to_use)
 
-        with open(full_output_path, "w", encoding="utf-8") as f:
-            f.write(processed_content if processed_content else "")
+        buffer = ""
+        output_file = None
+        full_output_path = None
+        written = 0
+
+        def open_output(title_line: str):
+            nonlocal output_file, full_output_path
+            filename = self._filename_from_title_line(title_line) or fallback_filename
+            full_output_path = os.path.join(dest_path, filename)
+            output_file = open(full_output_path, "w", encoding="utf-8")
+
+        def write(text: str):
+            nonlocal written
+            output_file.write(text)
+            output_file.flush()
+            written += len(text)
+            if on_progress:
+                on_progress(full_output_path, written)
 
+        try:
+            for chunk in self.stream_response():
+                if output_file is not None:
+                    write(chunk)
+                    continue
+
+                # Hold chunks back until the title line is complete
+                buffer += chunk
+                first_line = buffer.splitlines(keepends=True)[0] if buffer else ""
+                if first_line and first_line.splitlines()[0] != first_line:
+                    open_output(first_line)
+                    write(buffer)
+                    buffer = ""
+
+            if output_file is None:
+                open_output(buffer.splitlines()[0] if buffer else "")
+                write(buffer)
+        except BaseException:
+            if output_file is not None:
+                output_file.close()
+                os.unlink(full_output_path)
+            raise
+
+        output_file.close()
         return full_output_path
+
+    async def awrite_response(
+        self, dest_path: str = "./", fallback_filename: str = None
+    ) -> str:
+        """Async variant of write_response."""
+        result = await self.adigest_response()
+        return await asyncio.to_thread(
+            self._write_file,
+            dest_path,
+            self.filename_for(result, fallback_filename),
+            result.content,
+        )
@@ -0,0 +1,238 @@
+"""SQLite checkpoint journal for resumable batch runs.
+
+Every finished image of a batch is recorded with its content hash, size,
+mtime, status, attempts, output files and processing time. `digest
+--resume` reads the journal back and skips the images that are already
+done, so an interrupted run continues where it stopped. Results are
+buffered and written in one transaction per `batch_size` results or
+`flush_interval` seconds, so the journal keeps up with any number of
+workers; at worst the last interval is redone after a crash.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from batch import BatchResult
+
+JOURNAL_FILENAME = ".handmark-journal.sqlite"
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    path TEXT PRIMARY KEY,
+    hash TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    output_paths TEXT,
+    error TEXT,
+    seconds REAL,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS job (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_UPSERT = """
+INSERT INTO items (
+    path, hash, size, mtime_ns, status, output_paths, error, seconds, updated_at
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(path) DO UPDATE SET
+    hash = excluded.hash,
+    size = excluded.size,
+    mtime_ns = excluded.mtime_ns,
+    status = excluded.status,
+    attempts = items.attempts + 1,
+    output_paths = excluded.output_paths,
+    error = excluded.error,
+    seconds = excluded.seconds,
+    updated_at = excluded.updated_at
+"""
+
+
+def _file_key(path: Path) -> str:
+    return os.path.realpath(path)
+
+
+def _file_hash(path: Path) -> Optional[str]:
+    """SHA-256 of a file, as recorded for batch inputs."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def _file_state(path: Path) -> Tuple[Optional[int], Optional[int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
+
+
+@dataclass
+class JournalState:
+    """What the journal of an earlier job records, read without changing it."""
+
+    # Size, mtime and SHA-256 of images recorded as done, by real path
+    done: Dict[str, Tuple[int, int, Optional[str]]] = field(default_factory=dict)
+    # Images of the job that are not done: failed ones, and ones the job
+    # never reached when it was interrupted
+    unfinished: int = 0
+    # Outcome of is_done() per real path, since images are listed twice
+    _checked: Dict[str, bool] = field(default_factory=dict, repr=False)
+
+    def is_done(self, path: Path) -> bool:
+        """Check whether an image was processed in its current state.
+
+        Size and mtime rule out most changed images without reading them;
+        when both match, the content hash decides, since copies that keep
+        mtimes (`cp -p`, `rsync -t`, backups) can change a file without
+        changing either.
+        """
+        key = _file_key(path)
+        recorded = self.done.get(key)
+        if recorded is None or recorded[:2] != _file_state(path):
+            return False
+        if key not in self._checked:
+            self._checked[key] = recorded[2] is None or recorded[2] == _file_hash(path)
+        return self._checked[key]
+
+
+def read_journal(path: Path) -> Optional[JournalState]:
+    """Read the journal at path, if there is one, leaving it as it is."""
+    if not Path(path).is_file():
+        return None
+    db = sqlite3.connect(str(path))
+    try:
+        state = JournalState()
+        counts: Dict[str, int] = {}
+        for key, status, size, mtime_ns, digest in db.execute(
+            "SELECT path, status, size, mtime_ns, hash FROM items"
+        ):
+            counts[status] = counts.get(status, 0) + 1
+            if status == STATUS_DONE:
+                state.done[key] = (size, mtime_ns, digest)
+        row = db.execute("SELECT value FROM job WHERE key = 'total'").fetchone()
+    except sqlite3.DatabaseError:
+        # Not a journal, or one this version cannot read
+        return None
+    finally:
+        db.close()
+
+    failed = counts.get(STATUS_FAILED, 0)
+    total = int(row[0]) if row else 0
+    state.unfinished = max(failed, total - counts.get(STATUS_DONE, 0))
+    return state
+
+
+class JobJournal:
+    """Checkpoint journal of one batch job, kept in a SQLite file."""
+
+    def __init__(self, path: Path, batch_size: int = 100, flush_interval: float = 1.0):
+        self.path = Path(path)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._pending: List[tuple] = []
+        self._last_flush = time.monotonic()
+
+        self._db = sqlite3.connect(str(self.path))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def start(self, resume: bool, total: int) -> None:
+        """Begin a job of total images, continuing the recorded one if resume
+        is set.
+
+        Without resume, earlier records are discarded.
+        """
+        with self._db:
+            if not resume:
+                self._db.execute("DELETE FROM items")
+                self._db.execute("DELETE FROM job")
+            self._db.execute(
+                "INSERT OR REPLACE INTO job (key, value) VALUES ('total', ?)",
+                (str(total),),
+            )
+
+    def set_settings(self, settings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Store the settings of the job (model, formats, ...).
+
+        Returns:
+            Optional[Dict[str, Any]]: The previously stored settings if they
+            differ, e.g. when resuming with another model, otherwise None
+        """
+        encoded = json.dumps(settings, sort_keys=True)
+        with self._db:
+            row = self._db.execute(
+                "SELECT value FROM job WHERE key = 'settings'"
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO job (key, value) VALUES ('settings', ?)",
+                (encoded,),
+            )
+        if row and row[0] != encoded:
+            return json.loads(row[0])
+        return None
+
+    def record(self, result: BatchResult) -> None:
+        """Buffer the outcome of an image, writing the buffer when it is due."""
+        size, mtime_ns = _file_state(result.image_path)
+        output_paths = result.output_paths or (
+            [result.output_path] if result.output_path else []
+        )
+        self._pending.append(
+            (
+                _file_key(result.image_path),
+                result.input_hash,
+                size,
+                mtime_ns,
+                STATUS_DONE if result.success else STATUS_FAILED,
+                json.dumps(output_paths),
+                None if result.success else str(result.error),
+                result.seconds,
+                datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            )
+        )
+
+        if (
+            len(self._pending) >= self.batch_size
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered results in a single transaction."""
+        if self._pending:
+            with self._db:
+                self._db.executemany(_UPSERT, self._pending)
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+    def counts(self) -> Dict[str, int]:
+        """Number of recorded images per status."""
+        self.flush()
+        return dict(
+            self._db.execute("SELECT status, COUNT(*) FROM items GROUP BY status")
+        )
+
+    def close(self) -> None:
+        self.flush()
+        self._db.close()
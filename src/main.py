@@ -1,8 +1,9 @@
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterable, List, Optional
 import typer
 from rich.panel import Panel
 from rich.text import Text
-from dissector import ImageDissector
 from model import (
     get_available_models,
     get_default_model,
@@ -190,32 +191,13 @@ def test_connection():
         console.print(f"[blue]Using selected model: {selected_model.name}[/blue]")
 
     try:
-        from azure.ai.inference import ChatCompletionsClient
-        from azure.core.credentials import AzureKeyCredential
-        from azure.ai.inference.models import (
-            SystemMessage,
-            UserMessage,
-            TextContentItem,
-        )
+        from providers.registry import get_provider
 
-        client = ChatCompletionsClient(
-            endpoint="https://models.github.ai/inference",
-            credential=AzureKeyCredential(token),
-        )
+        azure_provider = get_provider("azure")
 
         console.print("[yellow]Testing connection to AI service...[/yellow]")
 
-        response = client.complete(
-            messages=[
-                SystemMessage(content="You are a helpful assistant."),
-                UserMessage(
-                    content=[TextContentItem(text="Hello, respond with just 'OK'")]
-                ),
-            ],
-            model=selected_model.name,
-        )
-
-        if response and response.choices:
+        if azure_provider.test_model(selected_model.name):
             console.print("[green]✓ Connection successful![/green]")
             console.print(f"[green]✓ Model {selected_model.name} is responding[/green]")
             return
@@ -242,14 +224,17 @@ def test_connection():
 
 @app.command("digest")
 def digest(
-    image_path: Path = typer.Argument(
-        ..., help="Path to the image file to process.", show_default=False
+    image_paths: List[str] = typer.Argument(
+        None,
+        help="Image files, directories or glob patterns to process.",
+        show_default=False,
     ),
     output: Path = typer.Option(
         "./",
         "-o",
         "--output",
-        help="Directory to save the output file (default: current directory).",
+        help="Directory to save the output file, or '-' for stdout "
+        "(default: current directory).",
     ),
     filename: str = typer.Option(
         None,
@@ -260,60 +245,421 @@ def digest(
         "markdown",
         "-f",
         "--format",
-        help="Output format: markdown, json, yaml, or xml (default: markdown).",
+        help="Output format: markdown, json, yaml, or xml (default: markdown). "
+        "Comma-separate several to derive them all from a single model request.",
+    ),
+    keep_transcript: bool = typer.Option(
+        False,
+        "--transcript",
+        help="Save the raw transcript so 'handmark reformat' can render other "
+        "formats later (always on with several formats).",
+    ),
+    stream: bool = typer.Option(
+        False,
+        "--stream",
+        help="Write the response while it is being generated (Markdown only).",
+    ),
+    files_from: Path = typer.Option(
+        None,
+        "--files-from",
+        help="Read additional input paths from a file, one per line ('-' for stdin).",
+    ),
+    recursive: bool = typer.Option(
+        False,
+        "-r",
+        "--recursive",
+        help="Descend into subdirectories of directory inputs.",
+    ),
+    jobs: int = typer.Option(
+        None,
+        "-j",
+        "--jobs",
+        min=1,
+        help="Images processed concurrently (default: per-provider setting).",
+    ),
+    no_cache: bool = typer.Option(
+        False,
+        "--no-cache",
+        help="Neither read nor store cached responses.",
+    ),
+    refresh: bool = typer.Option(
+        False,
+        "--refresh",
+        help="Ignore cached responses and store the fresh ones.",
+    ),
+    preprocess: bool = typer.Option(
+        None,
+        "--preprocess/--no-preprocess",
+        help="Downscale and re-encode images before upload "
+        "(default: 'preprocessing' in config.yaml).",
+        show_default=False,
+    ),
+    schedule: bool = typer.Option(
+        False,
+        "--schedule",
+        help="Wait for the model's request quota to free up instead of refusing "
+        "runs that exceed it.",
+    ),
+    profile: Path = typer.Option(
+        None,
+        "--profile",
+        help="Write a JSON report of per-stage timings, retries and payload "
+        "sizes to this file.",
+    ),
+    resume: bool = typer.Option(
+        False,
+        "--resume",
+        help="Continue an interrupted batch, skipping images its journal "
+        "records as done.",
+    ),
+    dedup: bool = typer.Option(
+        None,
+        "--dedup/--no-dedup",
+        help="Send near-identical images to the model once and link the "
+        "result to the others (default: 'dedup' in config.yaml).",
+        show_default=False,
+    ),
+    model: str = typer.Option(
+        None,
+        "-m",
+        "--model",
+        help="Model for this run, or 'auto' to send each image to the fastest "
+        "healthy model under 'routing.models' in config.yaml "
+        "(default: the selected model).",
     ),
 ):
-    """Process a handwritten image and convert it to the specified format."""
-    valid_formats = ["markdown", "json", "yaml", "xml"]
-    if format.lower() not in valid_formats:
-        formats_str = ", ".join(valid_formats)
-        error_msg = f"[red]Error: Invalid format '{format}'. Valid formats: "
-        error_msg += f"{formats_str}[/red]"
-        console.print(error_msg)
+    """Process handwritten images and convert them to the specified format."""
+    # Imported here so that other subcommands don't load the provider SDKs
+    import glob
+    import sys
+    import tempfile
+    from contextlib import nullcontext
+    from batch import iter_image_paths, read_file_list
+    from cache import get_response_cache
+    from dedup import get_dedup_config
+    from dissector import CANONICAL_FORMAT, ImageDissector
+    from journal import JOURNAL_FILENAME, JobJournal, read_journal
+    from preprocess import get_preprocess_config, preprocess_image
+    from profiling import Profiler, span
+    from ratelimit import QuotaExceededError, get_rate_limiter
+    from routing import AUTO_MODEL, get_router
+    from transcript import Transcript, parse_formats, write_outputs
+    from usage import UsageSummary
+
+    try:
+        output_formats = parse_formats(format)
+    except ValueError as e:
+        console.print(f"[red]Error: {e}[/red]")
+        raise typer.Exit(code=1)
+
+    # Several formats (or a kept transcript) are derived from one canonical
+    # response instead of one request per format
+    derived_formats = (
+        output_formats if len(output_formats) > 1 or keep_transcript else None
+    )
+
+    to_stdout = str(output) == "-"
+    if to_stdout:
+        # stdout carries the document itself; progress goes to stderr
+        console.file = sys.stderr
+        if derived_formats:
+            console.print(
+                "[red]Error: Output to stdout supports a single format "
+                "without --transcript.[/red]"
+            )
+            raise typer.Exit(code=1)
+
+    if stream and (derived_formats or output_formats != ["markdown"]):
+        console.print("[red]Error: --stream only supports Markdown output.[/red]")
         raise typer.Exit(code=1)
 
-    valid_path, error_msg = validate_image_path(image_path)
-    if not valid_path:
-        console.print(f"[red]Error: {error_msg}[/red]")
+    inputs = list(image_paths or [])
+    if files_from:
+        try:
+            inputs.extend(read_file_list(str(files_from)))
+        except OSError as e:
+            console.print(f"[red]Error: Could not read file list: {e}[/red]")
+            raise typer.Exit(code=1)
+
+    if not inputs:
+        console.print("[red]Error: You must provide at least one image path.[/red]")
         raise typer.Exit(code=1)
 
+    single_image = (
+        len(inputs) == 1
+        and not files_from
+        and not Path(inputs[0]).is_dir()
+        and not glob.has_magic(inputs[0])
+    )
+
+    if single_image:
+        image_path = Path(inputs[0])
+        valid_path, error_msg = validate_image_path(image_path)
+        if not valid_path:
+            console.print(f"[red]Error: {error_msg}[/red]")
+            raise typer.Exit(code=1)
+    else:
+        if filename:
+            console.print(
+                "[red]Error: --filename can only be used with a single image.[/red]"
+            )
+            raise typer.Exit(code=1)
+        if stream or to_stdout:
+            console.print(
+                "[red]Error: --stream and '-o -' can only be used with a "
+                "single image.[/red]"
+            )
+            raise typer.Exit(code=1)
+
+        output.mkdir(parents=True, exist_ok=True)
+        # The journal is only read here and opened for writing once every
+        # check below has passed, so a rerun that fails keeps its records
+        journal_path = output.absolute() / JOURNAL_FILENAME
+        previous = read_journal(journal_path)
+        if previous is not None and previous.unfinished and not resume:
+            console.print(
+                f"[yellow]⚠ The journal in {output} records an unfinished batch "
+                f"({previous.unfinished} images not done); starting a new one. "
+                f"Use --resume to continue it instead.[/yellow]"
+            )
+        skip = previous if resume else None
+
+        def pending_images(on_unmatched=None):
+            return (
+                path
+                for path in iter_image_paths(inputs, recursive, on_unmatched)
+                if skip is None or not skip.is_done(path)
+            )
+
+        # Count first, then enumerate again lazily while processing, so huge
+        # runs never hold the full list of paths
+        unmatched: List[str] = []
+        batch_total = sum(1 for _ in pending_images(unmatched.append))
+        for pattern in unmatched:
+            console.print(f"[yellow]⚠ No images found for '{pattern}'[/yellow]")
+        done_count = len(skip.done) if skip is not None else 0
+        if done_count:
+            console.print(
+                f"[blue]Resuming: skipping images already done "
+                f"({done_count} in the journal)[/blue]"
+            )
+        if not batch_total:
+            if done_count:
+                console.print("[green]✓ Every image is already done.[/green]")
+                return
+            console.print("[red]Error: No image files to process.[/red]")
+            raise typer.Exit(code=1)
+
     token_valid, error_msg, guidance_msg = validate_github_token()
     if not token_valid:
         console.print(Text(error_msg, style="red"))
         console.print(Text(guidance_msg, style="yellow"))
         raise typer.Exit(code=1)
 
-    selected_model = get_selected_model()
-    if not selected_model:
-        selected_model = get_default_model()
-        console.print(
-            f"[yellow]No model configured. Using default: {selected_model.name}[/yellow]"
+    router = None
+    if model == AUTO_MODEL:
+        try:
+            router = get_router()
+        except ValueError as e:
+            console.print(f"[red]✗ Configuration Error:[/red] {str(e)}")
+            raise typer.Exit(code=1)
+        # Sizes the worker pool; each image gets its model from the router
+        selected_model = router.models[0]
+        names = ", ".join(m.name for m in router.models)
+        console.print(f"[blue]Routing each image to the fastest of: {names}[/blue]")
+    elif model:
+        selected_model = next(
+            (m for m in get_available_models() if model in (m.name, m.pretty_name)),
+            None,
         )
-    else:
+        if selected_model is None:
+            console.print(
+                f"[red]Error: Unknown model '{model}'. "
+                f"Run 'handmark set-model' to list the available models.[/red]"
+            )
+            raise typer.Exit(code=1)
         console.print(
             f"[blue]Using model: {selected_model.name} ({selected_model.provider})[/blue]"
         )
+    else:
+        selected_model = get_selected_model()
+        if not selected_model:
+            selected_model = get_default_model()
+            console.print(
+                f"[yellow]No model configured. Using default: {selected_model.name}[/yellow]"
+            )
+        else:
+            console.print(
+                f"[blue]Using model: {selected_model.name} ({selected_model.provider})[/blue]"
+            )
+
+    formats_upper = ", ".join(f.upper() for f in output_formats)
+    console.print(f"[blue]Output format: {formats_upper}[/blue]")
+
+    cache = None if no_cache else get_response_cache()
+
+    try:
+        preprocess_config = get_preprocess_config()
+    except ValueError as e:
+        console.print(f"[red]✗ Configuration Error:[/red] {str(e)}")
+        raise typer.Exit(code=1)
+    if preprocess is not None:
+        preprocess_config.enabled = preprocess
 
-    console.print(f"[blue]Output format: {format.upper()}[/blue]")
+    duplicates = None
+    if not single_image:
+        try:
+            dedup_config = get_dedup_config()
+        except ValueError as e:
+            console.print(f"[red]✗ Configuration Error:[/red] {str(e)}")
+            raise typer.Exit(code=1)
+        use_dedup = dedup if dedup is not None else dedup_config.enabled
+        if use_dedup:
+            duplicates = _plan_duplicates(list(pending_images()), dedup_config)
+
+    if router is not None and single_image:
+        selected_model = router.choose()
+        console.print(f"[blue]Routed to {selected_model.name}[/blue]")
+
+    # Routed batches skip models without quota left instead
+    rate_limiter = get_rate_limiter(selected_model)
+    if rate_limiter is not None and (router is None or single_image):
+        if single_image:
+            requests = 1
+        elif duplicates is not None:
+            requests = len(duplicates.representatives)
+        else:
+            requests = batch_total
+        _check_quota(rate_limiter, requests, schedule)
+
+    profiler = Profiler() if profile else None
+
+    if not single_image:
+        journal = JobJournal(journal_path)
+        with _closing_journal(journal):
+            journal.start(resume, total=done_count + batch_total)
+            previous_settings = journal.set_settings(
+                {
+                    "model": AUTO_MODEL if router else selected_model.name,
+                    "formats": output_formats,
+                }
+            )
+            if resume and previous_settings:
+                console.print(
+                    f"[yellow]⚠ The journal was written with different settings "
+                    f"({previous_settings}); images already done are kept as they "
+                    f"are.[/yellow]"
+                )
 
-    format_upper = format.upper()
-    status_msg = f"[bold green]Processing image to {format_upper}...[/bold green]"
-    with console.status(status_msg):
+            _digest_batch(
+                duplicates.representatives if duplicates else pending_images(),
+                batch_total,
+                selected_model,
+                output_formats[0],
+                output.absolute(),
+                jobs,
+                cache=cache,
+                refresh=refresh,
+                preprocess=preprocess_config,
+                rate_limiter=rate_limiter,
+                wait_for_quota=schedule,
+                derived_formats=derived_formats,
+                profiler=profiler,
+                profile_path=profile,
+                journal=journal,
+                resume=resume,
+                duplicates=duplicates,
+                router=router,
+            )
+        return
+
+    status_msg = f"[bold green]Processing image to {formats_upper}...[/bold green]"
+    with (
+        _profile_report(profiler, profile),
+        _saving_router(router, profiler),
+        profiler.record(str(image_path)) if profiler else nullcontext(),
+        nullcontext() if to_stdout else console.status(status_msg) as status,
+        tempfile.TemporaryDirectory(prefix="handmark-") as work_dir,
+        router.track(selected_model) if router else nullcontext(),
+    ):
         try:
+            upload_path = str(image_path)
+            if preprocess_config.enabled:
+                with span("preprocess"):
+                    upload_path = preprocess_image(
+                        upload_path,
+                        preprocess_config,
+                        work_dir,
+                        preprocess_config.max_edge_for(selected_model),
+                    )
+
             sample = ImageDissector(
-                image_path=str(image_path),
+                image_path=upload_path,
                 model=selected_model,
-                output_format=format.lower(),
+                output_format=(
+                    CANONICAL_FORMAT if derived_formats else output_formats[0]
+                ),
+                cache=cache,
+                refresh=refresh,
+                rate_limiter=rate_limiter,
+                wait_for_quota=schedule,
             )
             output_dir = output.absolute()
 
-            actual_output_path = sample.write_response(
-                dest_path=str(output_dir),
-                fallback_filename=filename,
-            )
+            if derived_formats:
+                transcript = Transcript(
+                    content=sample.get_response(),
+                    model=selected_model.name,
+                    source=str(image_path),
+                )
+                output_paths = write_outputs(
+                    transcript,
+                    derived_formats,
+                    str(output_dir),
+                    fallback_stem=Path(filename).stem if filename else None,
+                )
+            elif to_stdout:
+                if stream:
+                    for chunk in sample.stream_response():
+                        sys.stdout.write(chunk)
+                        sys.stdout.flush()
+                else:
+                    _, content = sample.render_response(filename)
+                    sys.stdout.write(content)
+                output_paths = []
+            elif stream:
+
+                def show_progress(path: str, written: int):
+                    status.update(
+                        f"[bold green]Streaming to {path} "
+                        f"({written} characters)...[/bold green]"
+                    )
+
+                output_paths = [
+                    sample.write_stream(
+                        dest_path=str(output_dir),
+                        fallback_filename=filename,
+                        on_progress=show_progress,
+                    )
+                ]
+            else:
+                output_paths = [
+                    sample.write_response(
+                        dest_path=str(output_dir),
+                        fallback_filename=filename,
+                    )
+                ]
 
             console.print("[green]✓ Image processed successfully![/green]")
-            console.print(f"[bold]Output file saved to:[/bold] {actual_output_path}")
+            for actual_output_path in output_paths:
+                console.print(
+                    f"[bold]Output file saved to:[/bold] {actual_output_path}"
+                )
+            usage = UsageSummary()
+            usage.add(sample.usage)
+            if profiler is not None:
+                profiler.add_section("usage", usage.to_dict())
+            _print_usage(usage)
         except TimeoutError as e:
             console.print(f"[red]✗ Timeout Error:[/red] {str(e)}")
             console.print(
@@ -331,6 +677,13 @@ def digest(
             else:
                 console.print(f"[red]✗ Configuration Error:[/red] {str(e)}")
             raise typer.Exit(code=1)
+        except QuotaExceededError as e:
+            console.print(f"[red]✗ Quota Exceeded:[/red] {str(e)}")
+            console.print(
+                "[yellow]💡 Use --schedule to wait for quota, or pick another "
+                "model with 'handmark set-model'[/yellow]"
+            )
+            raise typer.Exit(code=1)
         except RuntimeError as e:
             console.print(f"[red]✗ API Error:[/red] {str(e)}")
             console.print(
@@ -347,6 +700,773 @@ def digest(
             raise typer.Exit(code=1)
 
 
+def _check_quota(rate_limiter, requests_needed: int, schedule: bool):
+    """Refuse a run up front when the remaining quota cannot cover it."""
+    from ratelimit import format_duration
+
+    remaining = rate_limiter.remaining()
+    if requests_needed <= remaining:
+        return
+
+    wait = rate_limiter.wait_time(requests_needed)
+    console.print(
+        f"[yellow]⚠ Quota for {rate_limiter.model_name}: {remaining} requests left, "
+        f"this run needs up to {requests_needed}.[/yellow]"
+    )
+    if schedule:
+        console.print(
+            "[yellow]Requests will wait for quota to free up "
+            "(cached images are not counted against it).[/yellow]"
+        )
+        return
+
+    if wait == float("inf"):
+        console.print(
+            "[red]✗ This run exceeds the model's quota window. "
+            "Split it up or use --schedule.[/red]"
+        )
+    else:
+        console.print(
+            f"[red]✗ Enough quota is available in {format_duration(wait)}. "
+            "Use --schedule to start now and wait as needed.[/red]"
+        )
+    raise typer.Exit(code=1)
+
+
+def _plan_duplicates(image_paths: List[Path], config):
+    """Group near-identical images and report the requests saved."""
+    from dedup import find_duplicates
+
+    with console.status(
+        f"[bold green]Hashing {len(image_paths)} images...[/bold green]"
+    ):
+        plan = find_duplicates(image_paths, config)
+
+    if plan.skipped:
+        console.print(
+            f"[blue]Found {plan.skipped} near-duplicate "
+            f"image{'s' if plan.skipped != 1 else ''} in "
+            f"{len(plan.duplicates)} group{'s' if len(plan.duplicates) != 1 else ''}; "
+            f"{len(plan.representatives)} model requests instead of "
+            f"{len(image_paths)}[/blue]"
+        )
+        for representative, paths in plan.duplicates.items():
+            names = ", ".join(str(path) for path in paths)
+            console.print(f"  [dim]{representative} ← {names}[/dim]")
+    else:
+        console.print("[blue]No near-duplicate images found[/blue]")
+    return plan
+
+
+@contextmanager
+def _profile_report(profiler, profile_path: Path):
+    """Write the profiler's report once the block is done, even if it failed.
+
+    A report that cannot be written is only reported, so it never replaces
+    the block's own exception.
+    """
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            from providers.concurrency import concurrency_report
+
+            try:
+                profiler.add_section("concurrency", concurrency_report())
+                report = profiler.write(str(profile_path))
+            except Exception as e:
+                console.print(
+                    f"[red]Error: Could not save profile report to "
+                    f"{profile_path}: {e}[/red]"
+                )
+            else:
+                stages = report["stages"]
+                if report["images"] > 1 and "total" in stages:
+                    total = stages["total"]
+                    console.print(
+                        f"[blue]Latency per image: p50 {total['p50']:.2f}s, "
+                        f"p95 {total['p95']:.2f}s, p99 {total['p99']:.2f}s[/blue]"
+                    )
+                console.print(f"[blue]Profile report saved to {profile_path}[/blue]")
+
+
+def _print_usage(summary) -> None:
+    """Report the tokens a run used and what they were spent on."""
+    if not summary.requests:
+        return
+
+    requests = len(summary.requests)
+    notes = []
+    per_image = summary.tokens_per_image()
+    if per_image is not None and len(summary.image_tokens) > 1:
+        notes.append(f"{per_image:,.0f} per image")
+    speed = summary.tokens_per_second()
+    if speed is not None:
+        notes.append(f"{speed:,.1f} tokens/s")
+    console.print(
+        f"[blue]Tokens: {summary.prompt_tokens:,} prompt + "
+        f"{summary.completion_tokens:,} completion over {requests} "
+        f"request{'s' if requests != 1 else ''}"
+        f"{' (' + ', '.join(notes) + ')' if notes else ''}[/blue]"
+    )
+    # Only worth a table when there is something to compare
+    for dimension, rows in summary.breakdowns().items():
+        if len(rows) < 2:
+            continue
+        console.print(f"[blue]Tokens by {dimension}, most expensive first:[/blue]")
+        for row in rows:
+            console.print(
+                f"  {row['name']}: {row['total_tokens']:,} tokens "
+                f"({row['requests']} request{'s' if row['requests'] != 1 else ''}, "
+                f"{row['tokens_per_request']:,.0f} per request)"
+            )
+
+
+@contextmanager
+def _saving_router(router, profiler=None):
+    """Persist the router's statistics once the block is done, and report them."""
+    try:
+        yield
+    finally:
+        if router is not None:
+            router.save()
+            if profiler is not None:
+                profiler.add_section("routing", router.snapshot())
+
+
+def _print_routing(router) -> None:
+    """Report where a routed run sent its images."""
+    console.print("[blue]Requests per model:[/blue]")
+    for row in router.snapshot():
+        notes = []
+        if row["latency"] is not None:
+            notes.append(f"{row['latency']:.2f}s per request")
+        if row["error_rate"]:
+            notes.append(f"{row['error_rate']:.0%} errors")
+        if row["throttled_for"]:
+            notes.append(f"throttled for {row['throttled_for']:.0f}s")
+        console.print(
+            f"  {row['model']}: {row['requests']}"
+            f"{' (' + ', '.join(notes) + ')' if notes else ''}"
+        )
+
+
+@contextmanager
+def _closing_journal(journal):
+    """Write out and close the journal once the block is done."""
+    try:
+        yield
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def _digest_batch(
+    image_paths: Iterable[Path],
+    total: int,
+    selected_model,
+    output_format: str,
+    output_dir: Path,
+    jobs: Optional[int],
+    cache=None,
+    refresh: bool = False,
+    preprocess=None,
+    rate_limiter=None,
+    wait_for_quota: bool = False,
+    derived_formats=None,
+    profiler=None,
+    profile_path: Path = None,
+    journal=None,
+    resume: bool = False,
+    duplicates=None,
+    router=None,
+):
+    """Run digest over many images and report per-image results."""
+    from batch import get_request_workers, iter_batch
+    from pipeline import get_pipeline_config
+    from providers.concurrency import get_limiter
+    from usage import UsageSummary
+
+    workers = get_request_workers(selected_model, jobs)
+    limiter = None
+    if router is None:
+        limiter = get_limiter(
+            selected_model.provider_type,
+            selected_model.ollama_model_name or selected_model.name,
+        )
+    if limiter is not None:
+        console.print(
+            f"[blue]Processing {total} images with adaptive concurrency "
+            f"(starting at {int(limiter.limit)}, up to {workers} "
+            f"in flight)[/blue]"
+        )
+    else:
+        console.print(
+            f"[blue]Processing {total} images with {workers} concurrent "
+            f"worker{'s' if workers != 1 else ''}[/blue]"
+        )
+
+    completed = 0
+    failed = 0
+    reused = 0
+    usage = UsageSummary()
+    results = iter_batch(
+        image_paths,
+        model=selected_model,
+        output_format=output_format,
+        dest_path=str(output_dir),
+        jobs=jobs,
+        cache=cache,
+        refresh=refresh,
+        preprocess=preprocess,
+        rate_limiter=rate_limiter,
+        wait_for_quota=wait_for_quota,
+        derived_formats=derived_formats,
+        pipeline=get_pipeline_config(),
+        profiler=profiler,
+        # Outputs of the interrupted run must not be replaced
+        overwrite=not resume,
+        hash_inputs=journal is not None,
+        duplicates=duplicates,
+        router=router,
+    )
+    if profiler is not None and duplicates is not None:
+        profiler.add_section("dedup", duplicates.to_dict())
+
+    with (
+        _profile_report(profiler, profile_path),
+        _saving_router(router, profiler),
+    ):
+        for result in results:
+            if journal is not None:
+                journal.record(result)
+            usage.add(result.usage)
+            completed += 1
+            prefix = f"[{completed}/{total}]"
+            if result.success:
+                written = ", ".join(result.output_paths or [result.output_path])
+                note = ""
+                if result.duplicate_of:
+                    reused += 1
+                    note = f" [dim](duplicate of {result.duplicate_of})[/dim]"
+                console.print(
+                    f"{prefix} [green]✓[/green] {result.image_path} → {written}"
+                    f"{note}"
+                )
+            else:
+                failed += 1
+                console.print(
+                    f"{prefix} [red]✗[/red] {result.image_path}: {result.error}"
+                )
+        if profiler is not None:
+            profiler.add_section("usage", usage.to_dict())
+
+    console.print()
+    if router is not None:
+        _print_routing(router)
+    if limiter is not None:
+        state = limiter.snapshot()
+        console.print(
+            f"[blue]Concurrency limit settled at {state['limit']:.1f} "
+            f"(peak {state['peak_in_flight']} in flight, "
+            f"{state['throttled']} throttled)[/blue]"
+        )
+    if reused:
+        console.print(
+            f"[blue]Skipped {reused} model request{'s' if reused != 1 else ''} "
+            f"for near-duplicate images[/blue]"
+        )
+    _print_usage(usage)
+    console.print(
+        f"[bold]Done:[/bold] [green]{completed - failed} succeeded[/green], "
+        f"[red]{failed} failed[/red]"
+    )
+    if failed:
+        raise typer.Exit(code=1)
+
+
+@app.command("reformat")
+def reformat(
+    transcript_paths: List[Path] = typer.Argument(
+        ...,
+        help="Transcript files (*.transcript.json) saved by 'digest'.",
+        show_default=False,
+    ),
+    format: str = typer.Option(
+        "markdown",
+        "-f",
+        "--format",
+        help="Output format(s) to render, comma-separated (default: markdown).",
+    ),
+    output: Path = typer.Option(
+        None,
+        "-o",
+        "--output",
+        help="Directory to save the output files (default: next to each transcript).",
+    ),
+):
+    """Render saved transcripts into other formats without calling the model."""
+    from transcript import Transcript, parse_formats, transcript_stem, write_outputs
+
+    try:
+        output_formats = parse_formats(format)
+    except ValueError as e:
+        console.print(f"[red]Error: {e}[/red]")
+        raise typer.Exit(code=1)
+
+    failed = 0
+    for transcript_path in transcript_paths:
+        try:
+            transcript = Transcript.load(str(transcript_path))
+            output_dir = output or transcript_path.parent
+            output_paths = write_outputs(
+                transcript,
+                output_formats,
+                str(output_dir.absolute()),
+                keep_transcript=False,
+                stem=transcript_stem(str(transcript_path)),
+            )
+        except (OSError, ValueError) as e:
+            failed += 1
+            console.print(f"[red]✗[/red] {transcript_path}: {e}")
+            continue
+
+        for output_path in output_paths:
+            console.print(f"[green]✓[/green] {transcript_path} → {output_path}")
+
+    if failed:
+        raise typer.Exit(code=1)
+
+
+@app.command("bench")
+def bench(
+    directory: Path = typer.Argument(
+        ...,
+        help="Directory of images, each optionally with a reference transcript "
+        "(<name>.md, <name>.txt or <name>-response.md).",
+        show_default=False,
+    ),
+    models: str = typer.Option(
+        None,
+        "-m",
+        "--models",
+        help="Models to compare, comma-separated (default: the selected model).",
+    ),
+    format: str = typer.Option(
+        "markdown",
+        "-f",
+        "--format",
+        help="Output format(s) to request, comma-separated (default: markdown).",
+    ),
+    references: Path = typer.Option(
+        None,
+        "--references",
+        help="Directory of the reference transcripts (default: the image directory).",
+    ),
+    runs: int = typer.Option(
+        1, "--runs", min=1, help="Requests per image, model and format."
+    ),
+    preprocess: bool = typer.Option(
+        None,
+        "--preprocess/--no-preprocess",
+        help="Downscale and re-encode images before upload "
+        "(default: 'preprocessing' in config.yaml).",
+        show_default=False,
+    ),
+    output: Path = typer.Option(
+        None,
+        "-o",
+        "--output",
+        help="JSON file for the results (default: bench-<timestamp>.json).",
+    ),
+    baseline: Path = typer.Option(
+        None,
+        "--baseline",
+        help="Results of an earlier run to compare against.",
+    ),
+    schedule: bool = typer.Option(
+        False,
+        "--schedule",
+        help="Wait for request quota instead of refusing runs that exceed it.",
+    ),
+):
+    """Measure latency, tokens and accuracy of models on reference images."""
+    import json
+    import tempfile
+    import time
+    from batch import iter_image_paths
+    from bench import BenchCase, compare, find_reference, make_report, run_case
+    from preprocess import get_preprocess_config, preprocess_image
+    from ratelimit import get_rate_limiter
+    from transcript import parse_formats
+
+    if not directory.is_dir():
+        console.print(f"[red]Error: '{directory}' is not a directory.[/red]")
+        raise typer.Exit(code=1)
+
+    try:
+        output_formats = parse_formats(format)
+        preprocess_config = get_preprocess_config()
+    except ValueError as e:
+        console.print(f"[red]Error: {e}[/red]")
+        raise typer.Exit(code=1)
+    if preprocess is not None:
+        preprocess_config.enabled = preprocess
+
+    if models:
+        available = get_available_models()
+        selected_models = []
+        for name in (name.strip() for name in models.split(",")):
+            match = next(
+                (m for m in available if name in (m.name, m.pretty_name)), None
+            )
+            if match is None:
+                console.print(
+                    f"[red]Error: Unknown model '{name}'. "
+                    f"Run 'handmark set-model' to list the available models.[/red]"
+                )
+                raise typer.Exit(code=1)
+            if match not in selected_models:
+                selected_models.append(match)
+    else:
+        selected_models = [get_selected_model() or get_default_model()]
+
+    previous = None
+    if baseline:
+        try:
+            previous = json.loads(baseline.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            console.print(f"[red]Error: Could not read the baseline: {e}[/red]")
+            raise typer.Exit(code=1)
+
+    images = sorted(iter_image_paths([str(directory)]))
+    if not images:
+        console.print(f"[red]Error: No images found in '{directory}'.[/red]")
+        raise typer.Exit(code=1)
+    references_dir = references or directory
+    reference_of = {image: find_reference(image, references_dir) for image in images}
+    scored = sum(1 for path in reference_of.values() if path is not None)
+    console.print(
+        f"[blue]Benchmarking {len(images)} images ({scored} with a reference "
+        f"transcript) on {', '.join(m.name for m in selected_models)} in "
+        f"{', '.join(output_formats)}, {runs} run{'s' if runs != 1 else ''} "
+        f"each[/blue]"
+    )
+
+    token_valid, error_msg, guidance_msg = validate_github_token()
+    if not token_valid:
+        console.print(Text(error_msg, style="red"))
+        console.print(Text(guidance_msg, style="yellow"))
+        raise typer.Exit(code=1)
+
+    requests = len(images) * len(output_formats) * runs
+    for bench_model in selected_models:
+        rate_limiter = get_rate_limiter(bench_model)
+        if rate_limiter is not None:
+            _check_quota(rate_limiter, requests, schedule)
+
+    started = time.time()
+    total = requests * len(selected_models)
+    cases = []
+    with tempfile.TemporaryDirectory(prefix="handmark-") as work_dir:
+        for bench_model in selected_models:
+            rate_limiter = get_rate_limiter(bench_model)
+            for image in images:
+                # Every format and run of a model uploads the same image
+                upload_path, error = str(image), None
+                if preprocess_config.enabled:
+                    try:
+                        upload_path = preprocess_image(
+                            upload_path,
+                            preprocess_config,
+                            work_dir,
+                            preprocess_config.max_edge_for(bench_model),
+                        )
+                    except Exception as e:
+                        error = str(e) or type(e).__name__
+                for output_format in output_formats:
+                    for run in range(1, runs + 1):
+                        if error is not None:
+                            case = BenchCase(
+                                str(image), bench_model.name, output_format, run
+                            )
+                            case.error = error
+                        else:
+                            case = run_case(
+                                image,
+                                upload_path,
+                                bench_model,
+                                output_format,
+                                run,
+                                reference=reference_of[image],
+                                rate_limiter=rate_limiter,
+                                wait_for_quota=schedule,
+                            )
+                        cases.append(case)
+                        prefix = (
+                            f"[{len(cases)}/{total}] {bench_model.name} {output_format}"
+                        )
+                        if case.error:
+                            console.print(
+                                f"{prefix} [red]✗[/red] {image}: {case.error}"
+                            )
+                            continue
+                        score = f", CER {case.cer:.1%}" if case.cer is not None else ""
+                        console.print(
+                            f"{prefix} [green]✓[/green] {image}: "
+                            f"{case.seconds:.2f}s, "
+                            f"{case.prompt_tokens + case.completion_tokens:,} tokens"
+                            f"{score}"
+                        )
+
+    report = make_report(
+        cases, selected_models, output_formats, runs, preprocess_config, started
+    )
+    if previous is not None:
+        report["baseline"] = {
+            "path": str(baseline),
+            "changes": compare(report["summary"], previous),
+        }
+
+    output = output or Path(time.strftime("bench-%Y%m%d-%H%M%S.json"))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), "utf-8")
+
+    console.print()
+    _print_bench_summary(report)
+    console.print(f"[blue]Results saved to {output}[/blue]")
+
+
+def _print_bench_summary(report) -> None:
+    """Print one line per model and format, and changes against a baseline."""
+    for row in report["summary"]:
+        notes = [f"{row['requests'] - row['errors']}/{row['requests']} ok"]
+        latency = row["latency"]
+        if latency is not None:
+            notes.append(f"p50 {latency['p50']:.2f}s, p95 {latency['p95']:.2f}s")
+        if row["completion_tokens"] is not None:
+            notes.append(
+                f"{row['prompt_tokens']:,.0f} + {row['completion_tokens']:,.0f} tokens"
+            )
+        if row["payload_bytes"] is not None:
+            notes.append(f"{row['payload_bytes'] / 1024:,.0f} KiB payload")
+        if row["cer"] is not None:
+            notes.append(f"CER {row['cer']:.1%}, WER {row['wer']:.1%}")
+        if row["valid_rate"] is not None:
+            notes.append(f"{row['valid_rate']:.0%} valid")
+        console.print(
+            f"[bold]{row['model']}[/bold] ({row['format']}): {', '.join(notes)}"
+        )
+
+    changes = (report.get("baseline") or {}).get("changes")
+    if not changes:
+        return
+    console.print(f"[blue]Compared with {report['baseline']['path']}:[/blue]")
+    for change in changes:
+        deltas = []
+        if change["p50"] is not None:
+            deltas.append(f"p50 {change['p50']:+.2f}s")
+        if change["cer"] is not None:
+            deltas.append(f"CER {change['cer']:+.1%}")
+        if change["completion_tokens"] is not None:
+            deltas.append(f"{change['completion_tokens']:+,.0f} completion tokens")
+        console.print(
+            f"  {change['model']} ({change['format']}): "
+            f"{', '.join(deltas) or 'no comparable results'}"
+        )
+
+
+@app.command("watch")
+def watch(
+    folder: Path = typer.Argument(
+        ..., help="Folder the scanner drops images into.", show_default=False
+    ),
+    output: Path = typer.Option(
+        None,
+        "-o",
+        "--output",
+        help="Directory to save the output files (default: the watched folder).",
+    ),
+    format: str = typer.Option(
+        "markdown",
+        "-f",
+        "--format",
+        help="Output format(s), comma-separated (default: markdown).",
+    ),
+    recursive: bool = typer.Option(
+        False,
+        "-r",
+        "--recursive",
+        help="Also watch subfolders.",
+    ),
+    jobs: int = typer.Option(
+        None,
+        "-j",
+        "--jobs",
+        min=1,
+        help="Images processed concurrently (default: per-provider setting).",
+    ),
+    poll: bool = typer.Option(
+        False,
+        "--poll",
+        help="Poll the folder instead of using inotify (needed for network shares).",
+    ),
+    preprocess: bool = typer.Option(
+        None,
+        "--preprocess/--no-preprocess",
+        help="Downscale and re-encode images before upload "
+        "(default: 'preprocessing' in config.yaml).",
+        show_default=False,
+    ),
+):
+    """Process images as they arrive in a folder, until interrupted."""
+    from batch import get_request_workers, iter_batch
+    from cache import get_response_cache
+    from pipeline import get_pipeline_config
+    from preprocess import get_preprocess_config
+    from providers.registry import get_provider
+    from ratelimit import get_rate_limiter
+    from transcript import parse_formats
+    from watch import INDEX_FILENAME, ProcessedIndex, get_watch_config, watch_images
+
+    if not folder.is_dir():
+        console.print(f"[red]Error: '{folder}' is not a directory.[/red]")
+        raise typer.Exit(code=1)
+
+    try:
+        output_formats = parse_formats(format)
+        preprocess_config = get_preprocess_config()
+        watch_config = get_watch_config()
+    except ValueError as e:
+        console.print(f"[red]Error: {e}[/red]")
+        raise typer.Exit(code=1)
+    if preprocess is not None:
+        preprocess_config.enabled = preprocess
+
+    token_valid, error_msg, guidance_msg = validate_github_token()
+    if not token_valid:
+        console.print(Text(error_msg, style="red"))
+        console.print(Text(guidance_msg, style="yellow"))
+        raise typer.Exit(code=1)
+
+    selected_model = get_selected_model() or get_default_model()
+    output_dir = (output or folder).absolute()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    index = ProcessedIndex(output_dir / INDEX_FILENAME)
+
+    # Create the provider's client (and its connection pool) up front, so
+    # the first scan does not pay for it
+    get_provider(selected_model.provider_type)
+
+    workers = get_request_workers(selected_model, jobs)
+    console.print(
+        f"[blue]Watching {folder.absolute()} with {selected_model.name}, "
+        f"up to {workers} concurrent request{'s' if workers != 1 else ''} "
+        f"({len(index)} images already processed). Press Ctrl+C to stop.[/blue]"
+    )
+
+    results = iter_batch(
+        watch_images(folder, index, recursive, watch_config, poll),
+        model=selected_model,
+        output_format=output_formats[0],
+        dest_path=str(output_dir),
+        jobs=jobs,
+        cache=get_response_cache(),
+        preprocess=preprocess_config,
+        rate_limiter=get_rate_limiter(selected_model),
+        # A daemon waits for quota instead of failing every image
+        wait_for_quota=True,
+        derived_formats=output_formats if len(output_formats) > 1 else None,
+        pipeline=get_pipeline_config(),
+        # Outputs of earlier sessions stay untouched
+        overwrite=False,
+    )
+
+    try:
+        for result in results:
+            index.finish(result.image_path, result.success)
+            if result.success:
+                written = ", ".join(result.output_paths or [result.output_path])
+                console.print(f"[green]✓[/green] {result.image_path} → {written}")
+            else:
+                console.print(f"[red]✗[/red] {result.image_path}: {result.error}")
+    except KeyboardInterrupt:
+        console.print("\n[yellow]Stopped watching.[/yellow]")
+
+
+@app.command("serve")
+def serve(
+    host: str = typer.Option(
+        None, "--host", help="Address to listen on (default: 'server.host')."
+    ),
+    port: int = typer.Option(
+        None, "--port", help="Port to listen on (default: 'server.port')."
+    ),
+    jobs: int = typer.Option(
+        None,
+        "-j",
+        "--jobs",
+        min=1,
+        help="Images processed concurrently (default: per-provider setting).",
+    ),
+):
+    """Serve an HTTP API that converts uploaded images."""
+    from batch import get_default_jobs
+    from cache import get_response_cache
+    from preprocess import get_preprocess_config
+    from providers.registry import get_provider
+    from ratelimit import get_rate_limiter
+    from server import DigestServer, DigestService, get_server_config
+
+    try:
+        server_config = get_server_config()
+        preprocess_config = get_preprocess_config()
+    except ValueError as e:
+        console.print(f"[red]✗ Configuration Error:[/red] {str(e)}")
+        raise typer.Exit(code=1)
+
+    token_valid, error_msg, guidance_msg = validate_github_token()
+    if not token_valid:
+        console.print(Text(error_msg, style="red"))
+        console.print(Text(guidance_msg, style="yellow"))
+        raise typer.Exit(code=1)
+
+    selected_model = get_selected_model() or get_default_model()
+    # Created once here and shared by every request
+    get_provider(selected_model.provider_type)
+    service = DigestService(
+        selected_model,
+        workers=jobs or get_default_jobs(selected_model),
+        queue_size=server_config.queue_size,
+        cache=get_response_cache(),
+        preprocess=preprocess_config,
+        rate_limiter=get_rate_limiter(selected_model),
+    )
+
+    address = (host or server_config.host, port or server_config.port)
+    try:
+        httpd = DigestServer(address, service, server_config.max_upload_bytes)
+    except OSError as e:
+        service.close()
+        console.print(
+            f"[red]Error: Cannot listen on {address[0]}:{address[1]}: {e}[/red]"
+        )
+        raise typer.Exit(code=1)
+
+    console.print(
+        f"[blue]Serving {selected_model.name} on http://{address[0]}:{address[1]} "
+        f"({service.workers} workers, {server_config.queue_size} queued). "
+        "Press Ctrl+C to stop.[/blue]"
+    )
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        console.print("\n[yellow]Server stopped.[/yellow]")
+    finally:
+        httpd.server_close()
+        service.close()
+
+
 @app.command("config")
 def show_config():
     """Show current configuration settings."""
@@ -374,7 +1494,9 @@ def show_config():
     if project_config:
         console.print("\n[bold]Project Configuration:[/bold]")
 
-        formats = ", ".join(project_config.get("formats", {}).keys())
+        formats = ", ".join(
+            name for name in project_config.get("formats", {}) if name != "canonical"
+        )
         console.print(f"  [cyan]Available Formats:[/cyan] {formats}")
 
         models = project_config.get("available_models", [])
@@ -390,14 +1512,14 @@ def show_config():
 @app.command("status")
 def status():
     """Check provider availability and configuration status."""
-    from providers.azure_provider import AzureProvider
+    from providers.registry import get_provider
     from utils import check_ollama_service, list_ollama_models
 
     console.print(Panel("Provider Status", style="blue"))
 
     # Check Azure provider
     console.print("[bold]Azure AI Provider:[/bold]")
-    azure_provider = AzureProvider()
+    azure_provider = get_provider("azure")
     if azure_provider.validate_configuration():
         console.print("  [green]✓ GitHub token configured[/green]")
         if azure_provider.is_service_available():
@@ -445,6 +1567,14 @@ def status():
     if selected_model:
         console.print(f"[bold]Current Model:[/bold] {selected_model.pretty_name}")
         console.print(f"[bold]Provider Type:[/bold] {selected_model.provider_type}")
+        from ratelimit import get_rate_limiter
+
+        rate_limiter = get_rate_limiter(selected_model)
+        if rate_limiter is not None:
+            console.print(
+                f"[bold]Remaining Quota:[/bold] {rate_limiter.remaining()} requests "
+                f"({selected_model.rate_limit})"
+            )
     else:
         console.print("[yellow]No model configured. Run 'handmark set-model'[/yellow]")
 
@@ -10,6 +10,7 @@ class Model:
     rate_limit: str
     provider_type: str = "azure"  # "azure" or "ollama"
     ollama_model_name: Optional[str] = None
+    max_image_edge: Optional[int] = None  # Native input resolution, if known
 
     def __str__(self):
         return f"{self.pretty_name} | {self.provider} | {self.rate_limit}"
@@ -22,6 +23,7 @@ class Model:
             "rate_limit": self.rate_limit,
             "provider_type": self.provider_type,
             "ollama_model_name": self.ollama_model_name,
+            "max_image_edge": self.max_image_edge,
         }
 
     @classmethod
@@ -34,6 +36,7 @@ class Model:
             rate_limit=data["rate_limit"],
             provider_type=data.get("provider_type", "azure"),
             ollama_model_name=data.get("ollama_model_name"),
+            max_image_edge=data.get("max_image_edge"),
         )
 
 
@@ -53,6 +56,7 @@ def get_available_models() -> List[Model]:
                 rate_limit=model_data["rate_limit"],
                 provider_type=model_data.get("provider_type", "azure"),
                 ollama_model_name=model_data.get("ollama_model_name"),
+                max_image_edge=model_data.get("max_image_edge"),
             )
         )
 
@@ -112,4 +116,5 @@ def get_default_model() -> Model:
         rate_limit=default_config["rate_limit"],
         provider_type=default_config.get("provider_type", "azure"),
         ollama_model_name=default_config.get("ollama_model_name"),
+        max_image_edge=default_config.get("max_image_edge"),
     )
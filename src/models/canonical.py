@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+from typing import Dict, Any
+from .base import BaseFormat
+
+
+@dataclass
+class CanonicalConfig(BaseFormat):
+    """Dataclass for the canonical transcript requested for multi-format output."""
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "CanonicalConfig":
+        """Create CanonicalConfig from configuration dictionary"""
+        return cls(
+            system_message_content=config.get("system_message_content", ""),
+            user_message_content=config.get("user_message_content", ""),
+            file_extension=config.get("file_extension", ".transcript.json"),
+            content_type=config.get("content_type", "application/json"),
+        )
+
+
+def get_canonical_config() -> CanonicalConfig:
+    """Returns the configuration for the canonical transcript format."""
+    from config import get_format_config
+
+    config = get_format_config("canonical")
+
+    if config:
+        return CanonicalConfig.from_config(config)
+
+    return CanonicalConfig(
+        system_message_content=(
+            "You are a helpful assistant that transcribes handwritten images "
+            "into a structured JSON document."
+        ),
+        user_message_content=(
+            "Transcribe the handwritten text in this image as a single JSON object "
+            "with these fields: 'title' (a short descriptive title), 'content' "
+            "(the main text), 'sections' (an array of objects with 'heading' and "
+            "'content' for each topic or group of bullet points, empty if there is "
+            "only one topic) and 'markdown' (the complete transcription as "
+            "well-structured Markdown whose first line is '# ' followed by the "
+            "title). Return only valid JSON, no explanations."
+        ),
+        file_extension=".transcript.json",
+        content_type="application/json",
+    )
@@ -0,0 +1,130 @@
+"""Encode-once image payloads for model requests.
+
+An ImagePayload memory-maps the image file, so hashing it for the response
+cache and encoding it for upload read the page cache directly instead of
+copying the file into memory. The image is base64 encoded once, into a
+buffer of the exact final size, and kept for the lifetime of the payload,
+so retries and provider fallbacks reuse it instead of reading and encoding
+the file again. Clients that send bytes take the buffer as it is; for SDKs
+that only accept text, the text is built from the buffer once and replaces
+it, so a payload never holds two encoded copies of the image.
+"""
+
+import binascii
+import mmap
+import os
+import threading
+from contextlib import nullcontext
+from typing import Optional
+
+# Bytes encoded per step; a multiple of 3 so chunks need no padding
+_ENCODE_CHUNK = 3 * 256 * 1024
+
+_MIME_SUBTYPES = {"jpg": "jpeg", "tif": "tiff"}
+
+
+class ImagePayload:
+    """An image file prepared for upload, shared by every attempt of a request.
+
+    Use it as a context manager, or call close(), to release the mapping.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.format = self.path.rsplit(".", 1)[-1].lower()
+        self._file = open(self.path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        # Empty files cannot be mapped
+        self._map: Optional[mmap.mmap] = None
+        if self.size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._encoded: Optional[bytearray] = None
+        self._base64: Optional[str] = None
+        self._data_url: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def mime_type(self) -> str:
+        return f"image/{_MIME_SUBTYPES.get(self.format, self.format)}"
+
+    def view(self) -> memoryview:
+        """The file contents, without copying them."""
+        return memoryview(self._map if self._map is not None else b"")
+
+    def _encode(self, prefix: bytes = b"") -> bytearray:
+        """Base64 encode the file, after prefix, into a buffer of the final size."""
+        data = self.view()
+        buffer = bytearray(len(prefix) + 4 * ((len(data) + 2) // 3))
+        out = memoryview(buffer)
+        out[: len(prefix)] = prefix
+        position = len(prefix)
+        for start in range(0, len(data), _ENCODE_CHUNK):
+            end = start + _ENCODE_CHUNK
+            chunk = binascii.b2a_base64(data[start:end], newline=False)
+            stop = position + len(chunk)
+            out[position:stop] = chunk
+            position = stop
+        out.release()
+        data.release()
+        return buffer
+
+    def encoded(self) -> memoryview:
+        """The image as base64 bytes, encoded on first use, without a copy."""
+        with self._lock:
+            if self._encoded is None:
+                if self._base64 is not None:
+                    # Only the text is kept; lend out a temporary copy of it
+                    return memoryview(self._base64.encode("ascii"))
+                self._encoded = self._encode()
+            return memoryview(self._encoded).toreadonly()
+
+    def base64(self) -> str:
+        """The image as base64 text, for SDKs that only accept a str.
+
+        The text is decoded from the encoded buffer once, and the buffer is
+        dropped, so only one encoded copy is kept.
+        """
+        with self._lock:
+            if self._base64 is None:
+                buffer, self._encoded = self._encoded, None
+                if buffer is None:
+                    buffer = self._encode()
+                self._base64 = buffer.decode("ascii")
+            return self._base64
+
+    def data_url(self) -> str:
+        """The image as a base64 data URL, for SDKs that only accept a str.
+
+        The URL is encoded straight into a buffer that starts with its prefix,
+        and decoded once; the buffer is not kept.
+        """
+        with self._lock:
+            if self._data_url is None:
+                prefix = f"data:{self.mime_type};base64,".encode("ascii")
+                self._data_url = self._encode(prefix).decode("ascii")
+            return self._data_url
+
+    def close(self) -> None:
+        """Release the mapping and the encoded forms."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        self._encoded = None
+        self._base64 = None
+        self._data_url = None
+
+    def __enter__(self) -> "ImagePayload":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def open_payload(image_path: str, payload: Optional[ImagePayload] = None):
+    """Context manager for payload, or for a new payload of image_path.
+
+    Only a payload created here is closed on exit; a given one belongs to
+    the caller.
+    """
+    return nullcontext(payload) if payload is not None else ImagePayload(image_path)
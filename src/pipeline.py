@@ -0,0 +1,188 @@
+"""Staged execution with bounded queues between the stages.
+
+Every stage has its own worker threads and hands its output to the next
+stage through a bounded queue. A full queue blocks the workers feeding it,
+so a slow stage (e.g. model requests) throttles the stages before it
+instead of letting work pile up in memory. Inputs are pulled lazily from
+an iterable, which keeps memory use a function of queue sizes and worker
+counts rather than of the number of inputs.
+"""
+
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+# Seconds between checks whether the pipeline was stopped while a worker
+# waits on a queue
+_POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+@dataclass
+class PipelineConfig:
+    """Dataclass for batch pipeline settings.
+
+    Preprocessing and request workers are configured elsewhere
+    (`preprocessing.workers` and `--jobs`).
+    """
+
+    read_workers: int = 2
+    process_workers: int = 1
+    write_workers: int = 1
+    queue_size: Optional[int] = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "PipelineConfig":
+        """Create PipelineConfig from configuration dictionary"""
+        return cls(
+            read_workers=max(1, int(config.get("read_workers", 2))),
+            process_workers=max(1, int(config.get("process_workers", 1))),
+            write_workers=max(1, int(config.get("write_workers", 1))),
+            queue_size=config.get("queue_size"),
+        )
+
+    def queue_size_for(self, request_workers: int) -> int:
+        """Size of each queue; by default two items per request worker."""
+        if self.queue_size:
+            return max(1, int(self.queue_size))
+        return max(2, 2 * request_workers)
+
+
+def get_pipeline_config() -> PipelineConfig:
+    """Returns the batch pipeline configuration."""
+    from config import get_pipeline_settings
+
+    return PipelineConfig.from_config(get_pipeline_settings())
+
+
+@dataclass
+class Stage:
+    """One step of a pipeline.
+
+    `func` takes an item and returns the item passed to the next stage. It
+    should not raise; failures belong on the item so they reach the caller
+    in order with everything else.
+    """
+
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+
+
+class Pipeline:
+    """Runs items through a sequence of stages on bounded queues."""
+
+    def __init__(self, stages: List[Stage], queue_size: int = 8):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage.")
+        for stage in stages:
+            stage.workers = max(1, stage.workers)
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        """Process items, yielding results in completion order.
+
+        Closing the returned generator early stops all workers once their
+        current item is done, without waiting for them.
+
+        Raises:
+            Exception: The first error raised by a stage function or by
+                iterating `items`, once the pipeline has drained
+        """
+        stop = threading.Event()
+        errors: List[BaseException] = []
+        queues = [
+            queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)
+        ]
+
+        def put(target: queue.Queue, item: Any) -> bool:
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(source: queue.Queue) -> Any:
+            while not stop.is_set():
+                try:
+                    return source.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        def consumers(index: int) -> int:
+            """Number of workers reading queues[index]."""
+            return self.stages[index].workers if index < len(self.stages) else 1
+
+        def feed():
+            try:
+                for item in items:
+                    if not put(queues[0], item):
+                        return
+            except Exception as e:
+                errors.append(e)
+            finally:
+                for _ in range(consumers(0)):
+                    put(queues[0], _DONE)
+
+        def work(index: int, remaining: List[int], lock: threading.Lock):
+            stage = self.stages[index]
+            source, target = queues[index], queues[index + 1]
+            try:
+                while True:
+                    item = get(source)
+                    if item is _DONE:
+                        break
+                    try:
+                        result = stage.func(item)
+                    except Exception as e:
+                        errors.append(e)
+                        continue
+                    if not put(target, result):
+                        break
+            finally:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                # The last worker of a stage tells the next stage to finish
+                if last:
+                    for _ in range(consumers(index + 1)):
+                        put(target, _DONE)
+
+        threads = [threading.Thread(target=feed, name="pipeline-feed", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for number in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=work,
+                        args=(index, remaining, lock),
+                        name=f"pipeline-{stage.name}-{number}",
+                        daemon=True,
+                    )
+                )
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                result = get(queues[-1])
+                if result is _DONE:
+                    break
+                yield result
+        finally:
+            # Workers are daemon threads; after an early exit they stop on
+            # their own instead of holding up the caller
+            stop.set()
+
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,134 @@
+"""Image preprocessing applied before upload to shrink request payloads."""
+
+import io
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from model import Model
+
+SUPPORTED_OUTPUT_FORMATS = {"jpeg": ".jpg", "webp": ".webp"}
+
+_EXIF_ORIENTATION = 0x0112
+
+
+@dataclass
+class PreprocessConfig:
+    """Dataclass for image preprocessing settings."""
+
+    enabled: bool = False
+    max_edge: Optional[int] = 2048
+    use_model_resolution: bool = True
+    grayscale: bool = False
+    format: str = "jpeg"
+    quality: int = 85
+    workers: Optional[int] = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "PreprocessConfig":
+        """Create PreprocessConfig from configuration dictionary"""
+        output_format = str(config.get("format", "jpeg")).lower()
+        if output_format == "jpg":
+            output_format = "jpeg"
+        if output_format not in SUPPORTED_OUTPUT_FORMATS:
+            raise ValueError(
+                f"Unsupported preprocessing format '{output_format}'. "
+                f"Use one of: {', '.join(SUPPORTED_OUTPUT_FORMATS)}"
+            )
+
+        return cls(
+            enabled=config.get("enabled", False),
+            max_edge=config.get("max_edge", 2048),
+            use_model_resolution=config.get("use_model_resolution", True),
+            grayscale=config.get("grayscale", False),
+            format=output_format,
+            quality=config.get("quality", 85),
+            workers=config.get("workers"),
+        )
+
+    def max_edge_for(self, model: Optional[Model]) -> Optional[int]:
+        """Get the longest allowed image side for a model."""
+        if self.use_model_resolution and model and model.max_image_edge:
+            if self.max_edge:
+                return min(self.max_edge, model.max_image_edge)
+            return model.max_image_edge
+        return self.max_edge
+
+
+def get_preprocess_config() -> PreprocessConfig:
+    """Returns the image preprocessing configuration."""
+    from config import get_preprocessing_settings
+
+    return PreprocessConfig.from_config(get_preprocessing_settings())
+
+
+def preprocess_image(
+    image_path: str,
+    settings: PreprocessConfig,
+    dest_dir: str,
+    max_edge: Optional[int] = None,
+    data: Optional[bytes] = None,
+) -> str:
+    """Fix orientation, downscale and re-encode an image for upload.
+
+    This is a plain module-level function so batches can run it in a
+    process pool.
+
+    Args:
+        image_path: Path to the original image
+        settings: Preprocessing settings
+        dest_dir: Directory where the processed image is written
+        max_edge: Longest allowed side in pixels (None keeps the size)
+        data: Contents of image_path when the caller has already read them
+
+    Returns:
+        str: Path of the image to upload. This is the original path when
+        preprocessing would not make the file smaller.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError as e:
+        raise RuntimeError(
+            "Image preprocessing requires Pillow. Install it with "
+            "'pip install pillow' or disable preprocessing in config.yaml."
+        ) from e
+
+    source = io.BytesIO(data) if data is not None else image_path
+    with Image.open(source) as original:
+        orientation_fixed = original.getexif().get(_EXIF_ORIENTATION, 1) != 1
+        image = ImageOps.exif_transpose(original)
+        resized = False
+
+        if max_edge and max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            resized = True
+
+        if settings.grayscale:
+            image = image.convert("L")
+        elif image.mode not in ("RGB", "L"):
+            # JPEG has no alpha channel; flatten transparency onto white
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+
+        extension = SUPPORTED_OUTPUT_FORMATS[settings.format]
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        fd, output_path = tempfile.mkstemp(
+            prefix=f"{stem}-", suffix=extension, dir=dest_dir
+        )
+        with os.fdopen(fd, "wb") as output_file:
+            image.save(
+                output_file,
+                format=settings.format.upper(),
+                quality=settings.quality,
+                optimize=True,
+            )
+
+    original_size = len(data) if data is not None else os.path.getsize(image_path)
+    changed_pixels = orientation_fixed or resized or settings.grayscale
+    if not changed_pixels and os.path.getsize(output_path) >= original_size:
+        os.unlink(output_path)
+        return image_path
+
+    return output_path
@@ -0,0 +1,228 @@
+"""Lightweight per-image latency tracing for `digest --profile`.
+
+Code marks the stages it runs with `span()` (or the `traced` decorator) and
+reports sizes and retries with `count()`. Both only record anything while a
+Trace is active in the current context, so they cost a single context
+variable lookup when profiling is off. Traces follow asyncio tasks and
+`asyncio.to_thread` automatically; other threads activate the trace of the
+image they work on with `activate()`.
+"""
+
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+REPORT_VERSION = 1
+
+PERCENTILES = (50, 95, 99)
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("handmark_trace", default=None)
+
+
+@dataclass
+class Trace:
+    """Stage timings and counters of one image."""
+
+    label: str
+    spans: Dict[str, float] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+    started: float = field(default_factory=time.perf_counter, repr=False)
+    # Spans currently open, so a stage nested in itself is timed once
+    _open: set = field(default_factory=set, repr=False)
+
+    def add_span(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def add_count(self, name: str, value: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """Record the end-to-end time and outcome of the image."""
+        self.seconds = time.perf_counter() - self.started
+        if error is not None:
+            self.error = str(error) or type(error).__name__
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "image": self.label,
+            "seconds": _round(self.seconds),
+            "error": self.error,
+            "spans": {name: _round(value) for name, value in self.spans.items()},
+            "counters": dict(self.counters),
+        }
+
+
+@contextmanager
+def activate(trace: Optional[Trace]) -> Iterator[None]:
+    """Make trace the target of span() and count() in the current context."""
+    token = _current.set(trace)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Add the time spent in the block to the stage `name` of the active trace.
+
+    Repeated spans of one stage (e.g. one per retry) add up.
+    """
+    trace = _current.get()
+    if trace is None or name in trace._open:
+        yield
+        return
+
+    trace._open.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, time.perf_counter() - start)
+        trace._open.discard(name)
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """Decorator form of span() for plain and async functions."""
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add value to the counter `name` of the active trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add_count(name, value)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Linearly interpolated percentile of an ascending, non-empty list."""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (
+        rank - lower
+    )
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Total, mean, percentiles and maximum of a list of samples."""
+    ordered = sorted(values)
+    summary = {
+        "count": len(ordered),
+        "total": _round(sum(ordered)),
+        "mean": _round(sum(ordered) / len(ordered)),
+    }
+    for pct in PERCENTILES:
+        summary[f"p{pct}"] = _round(percentile(ordered, pct))
+    summary["max"] = _round(ordered[-1])
+    return summary
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 6)
+
+
+class Profiler:
+    """Collects finished traces and turns them into a run report."""
+
+    def __init__(self):
+        self._traces: List[Trace] = []
+        # Run-wide data reported next to the traces, e.g. concurrency limits
+        self._sections: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    def add(self, trace: Trace) -> None:
+        """Add a finished trace to the report."""
+        with self._lock:
+            self._traces.append(trace)
+
+    @contextmanager
+    def record(self, label: str) -> Iterator[Trace]:
+        """Trace the block as the processing of one image."""
+        trace = Trace(label)
+        error = None
+        try:
+            with activate(trace):
+                yield trace
+        except BaseException as e:
+            # Exits raised while reporting a failure carry no message of their own
+            error = e.__context__ if not str(e) and e.__context__ else e
+            raise
+        finally:
+            trace.finish(error)
+            self.add(trace)
+
+    def add_section(self, name: str, data: Any) -> None:
+        """Include run-wide data under `name` in the report."""
+        with self._lock:
+            self._sections[name] = data
+
+    def report(self) -> Dict[str, Any]:
+        """The run report: aggregate stage timings and counters, then traces.
+
+        Stage and counter summaries only include images that ran the stage
+        or reported the counter.
+        """
+        with self._lock:
+            traces = list(self._traces)
+            sections = dict(self._sections)
+
+        samples: Dict[str, List[float]] = {}
+        counters: Dict[str, List[float]] = {}
+        for trace in traces:
+            if trace.seconds is not None:
+                samples.setdefault("total", []).append(trace.seconds)
+            for name, seconds in trace.spans.items():
+                samples.setdefault(name, []).append(seconds)
+            for name, value in trace.counters.items():
+                counters.setdefault(name, []).append(value)
+
+        return {
+            "version": REPORT_VERSION,
+            "started_at": self._started_at,
+            "wall_seconds": _round(time.perf_counter() - self._started),
+            "images": len(traces),
+            "failed": sum(1 for trace in traces if trace.error is not None),
+            "stages": {name: summarize(values) for name, values in samples.items()},
+            "counters": {name: summarize(values) for name, values in counters.items()},
+            **sections,
+            "traces": [trace.to_dict() for trace in traces],
+        }
+
+    def write(self, path: str) -> Dict[str, Any]:
+        """Write the report to path as JSON and return it."""
+        report = self.report()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        return report
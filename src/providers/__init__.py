@@ -1,9 +1,19 @@
-"""Provider module for AI services."""
+"""Provider module for AI services.
+
+Provider classes are loaded on first access so that importing this package
+does not pull in the Azure or Ollama SDKs.
+"""
+
+from importlib import import_module
 
 from .base import BaseProvider
-from .azure_provider import AzureProvider
-from .ollama_provider import OllamaProvider
 from .factory import create_provider, get_best_available_provider
+from .registry import aclose_providers, get_provider
+
+_LAZY_PROVIDERS = {
+    "AzureProvider": ".azure_provider",
+    "OllamaProvider": ".ollama_provider",
+}
 
 __all__ = [
     "BaseProvider",
@@ -11,4 +21,13 @@ __all__ = [
     "OllamaProvider",
     "create_provider",
     "get_best_available_provider",
+    "get_provider",
+    "aclose_providers",
 ]
+
+
+def __getattr__(name):
+    if name in _LAZY_PROVIDERS:
+        module = import_module(_LAZY_PROVIDERS[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,7 +1,8 @@
 """Azure AI provider implementation."""
 
+import asyncio
 import time
-from typing import List
+from typing import Iterator, List, Optional
 from azure.ai.inference import ChatCompletionsClient
 from azure.ai.inference.models import (
     SystemMessage,
@@ -14,19 +15,34 @@ from azure.ai.inference.models import (
 from azure.core.credentials import AzureKeyCredential
 from azure.core.exceptions import (
     HttpResponseError,
+    ServiceRequestError,
     ServiceRequestTimeoutError,
     ServiceResponseError,
 )
 from .base import BaseProvider
+from .concurrency import alimit_concurrency, limit_concurrency
+from .retry import RetryBudget, get_retry_policy
 from model import Model
+from payload import ImagePayload, open_payload
+from profiling import count, span, traced
+from usage import TEXT_ONLY, Usage, record
 
 
 class AzureProvider(BaseProvider):
     """Azure AI provider for image processing."""
 
-    def __init__(self):
+    endpoint = "https://models.github.ai/inference"
+    image_detail = ImageDetailLevel.LOW
+
+    def __init__(self, transport=None):
         self._token = None
+        self._retry_policy = get_retry_policy(
+            "azure", transient_errors=(ServiceRequestError, ServiceResponseError)
+        )
         self._client = None
+        self._async_client = None
+        # azure-core transport shared with other clients (see registry.py)
+        self._transport = transport
         self._initialize_client()
 
     def _initialize_client(self):
@@ -35,13 +51,111 @@ class AzureProvider(BaseProvider):
 
         self._token = get_github_token()
         if self._token:
+            # Retries are handled by the provider's RetryPolicy only
+            client_options = {"retry_total": 0}
+            if self._transport is not None:
+                client_options["transport"] = self._transport
             self._client = ChatCompletionsClient(
-                endpoint="https://models.github.ai/inference",
+                endpoint=self.endpoint,
+                credential=AzureKeyCredential(self._token),
+                **client_options,
+            )
+
+    def _get_async_client(self):
+        """Lazily create the async Azure AI client on first use."""
+        if self._async_client is None and self._token:
+            from azure.ai.inference.aio import (
+                ChatCompletionsClient as AsyncChatCompletionsClient,
+            )
+            from .registry import create_async_transport
+
+            self._async_client = AsyncChatCompletionsClient(
+                endpoint=self.endpoint,
                 credential=AzureKeyCredential(self._token),
+                transport=create_async_transport("azure"),
+                retry_total=0,
+            )
+        return self._async_client
+
+    @traced("encode")
+    def _build_messages(
+        self, image: ImagePayload, system_message: str, user_message: str
+    ) -> list:
+        """Build the chat messages for an image request.
+
+        ImageUrl only accepts a str, so the payload's data URL is used; it is
+        built once and shared by every attempt.
+        """
+        image_url = ImageUrl(url=image.data_url(), detail=self.image_detail)
+        count("payload_bytes", len(image_url.url))
+        return [
+            SystemMessage(content=system_message),
+            UserMessage(
+                content=[
+                    TextContentItem(text=user_message),
+                    ImageContentItem(image_url=image_url),
+                ],
+            ),
+        ]
+
+    def _translate_error(self, error: Exception, attempts: int) -> Exception:
+        """Map an SDK error from the last attempt to the error raised to callers.
+
+        The translated error keeps the HTTP status of the response, if any,
+        as `status_code`.
+        """
+        if isinstance(
+            error,
+            (HttpResponseError, ServiceRequestTimeoutError, ServiceResponseError),
+        ):
+            if "Read timed out" in str(error) or "timeout" in str(error).lower():
+                translated = TimeoutError(
+                    f"Request timed out after {attempts} "
+                    f"attempt{'s' if attempts != 1 else ''}. "
+                    "The API might be experiencing high load. "
+                    "Please try again later."
+                )
+            elif "Unauthorized" in str(error):
+                translated = ValueError(
+                    "Authentication failed. Please check your GitHub token "
+                    "with 'handmark auth'."
+                )
+            else:
+                translated = RuntimeError(f"API request failed: {str(error)}")
+        else:
+            translated = RuntimeError(f"Unexpected error occurred: {str(error)}")
+        translated.status_code = getattr(error, "status_code", None)
+        return translated
+
+    @staticmethod
+    def _record_usage(
+        usage, model_name: str, started: float, detail: str = TEXT_ONLY
+    ) -> None:
+        """Report the token usage the service returned for a request."""
+        record(
+            Usage(
+                provider="azure",
+                model=model_name,
+                prompt_tokens=getattr(usage, "prompt_tokens", None) or 0,
+                completion_tokens=getattr(usage, "completion_tokens", None) or 0,
+                seconds=time.monotonic() - started,
+                detail=detail,
             )
+        )
+
+    @staticmethod
+    def _call_options(budget: RetryBudget) -> dict:
+        """Per-request transport options that keep an attempt within the deadline."""
+        remaining = budget.remaining()
+        return {} if remaining is None else {"read_timeout": max(1.0, remaining)}
 
     def get_response(
-        self, image_path: str, system_message: str, user_message: str, model_name: str
+        self,
+        image_path: str,
+        system_message: str,
+        user_message: str,
+        model_name: str,
+        payload: Optional[ImagePayload] = None,
     ) -> str:
         """Get AI response using Azure AI service."""
         if not self._client:
@@ -49,66 +163,161 @@ class AzureProvider(BaseProvider):
                 "GITHUB_TOKEN was not found in environment or configuration."
             )
 
-        image_format = image_path.split(".")[-1]
-        max_retries = 3
-        base_delay = 2  # seconds
+        with open_payload(image_path, payload) as image:
+            # Encoded once; every attempt sends the same messages
+            messages = self._build_messages(image, system_message, user_message)
+        return self._complete(messages, model_name, self.image_detail.value)
 
-        for attempt in range(max_retries):
+    def _complete(
+        self, messages: list, model_name: str, detail: str = TEXT_ONLY
+    ) -> str:
+        """Send chat messages, retrying transient failures."""
+        budget = self._retry_policy.start()
+        while True:
             try:
-                response = self._client.complete(
-                    messages=[
-                        SystemMessage(content=system_message),
-                        UserMessage(
-                            content=[
-                                TextContentItem(text=user_message),
-                                ImageContentItem(
-                                    image_url=ImageUrl.load(
-                                        image_file=image_path,
-                                        image_format=image_format,
-                                        detail=ImageDetailLevel.LOW,
-                                    )
-                                ),
-                            ],
-                        ),
-                    ],
-                    model=model_name,
-                )
+                started = time.monotonic()
+                with limit_concurrency("azure", model_name), span("network"):
+                    response = self._client.complete(
+                        messages=messages,
+                        model=model_name,
+                        **self._call_options(budget),
+                    )
 
+                self._record_usage(response.usage, model_name, started, detail)
                 return response.choices[0].message.content
 
-            except (
-                HttpResponseError,
-                ServiceRequestTimeoutError,
-                ServiceResponseError,
-            ) as e:
-                if attempt == max_retries - 1:  # Last attempt
-                    if "Read timed out" in str(e) or "timeout" in str(e).lower():
-                        raise TimeoutError(
-                            f"Request timed out after {max_retries} attempts. "
-                            "The API might be experiencing high load. "
-                            "Please try again later."
-                        ) from e
-                    elif "Unauthorized" in str(e):
-                        raise ValueError(
-                            "Authentication failed. Please check your GitHub token "
-                            "with 'handmark auth'."
-                        ) from e
-                    else:
-                        raise RuntimeError(f"API request failed: {str(e)}") from e
-
-                delay = base_delay * (2**attempt)
-                time.sleep(delay)
+            except Exception as e:
+                delay = budget.next_delay(e)
+                if delay is None:
+                    raise self._translate_error(e, budget.attempts) from e
+
+                count("retries")
+                with span("backoff"):
+                    time.sleep(delay)
+                budget.before_retry()
+
+    def complete_text(
+        self, system_message: str, user_message: str, model_name: str
+    ) -> str:
+        """Get AI response to a text-only request using Azure AI service."""
+        if not self._client:
+            raise ValueError(
+                "GITHUB_TOKEN was not found in environment or configuration."
+            )
+
+        messages = [
+            SystemMessage(content=system_message),
+            UserMessage(content=user_message),
+        ]
+        return self._complete(messages, model_name)
+
+    def stream_response(
+        self,
+        image_path: str,
+        system_message: str,
+        user_message: str,
+        model_name: str,
+        payload: Optional[ImagePayload] = None,
+    ) -> Iterator[str]:
+        """Stream the AI response from Azure AI service as it is generated."""
+        if not self._client:
+            raise ValueError(
+                "GITHUB_TOKEN was not found in environment or configuration."
+            )
+
+        with open_payload(image_path, payload) as image:
+            messages = self._build_messages(image, system_message, user_message)
+        budget = self._retry_policy.start()
+        yielded = False
+        while True:
+            try:
+                started = time.monotonic()
+                usage = None
+                # The slot is held until the whole response has arrived
+                with limit_concurrency("azure", model_name):
+                    with span("network"):
+                        stream = self._client.complete(
+                            messages=messages,
+                            model=model_name,
+                            stream=True,
+                            **self._call_options(budget),
+                        )
+                    with stream:
+                        for update in stream:
+                            # Only sent with the last update, if at all
+                            usage = getattr(update, "usage", None) or usage
+                            if update.choices and update.choices[0].delta.content:
+                                yielded = True
+                                yield update.choices[0].delta.content
+                self._record_usage(usage, model_name, started, self.image_detail.value)
+                return
+
+            except Exception as e:
+                # Once content has been handed out, a retry would repeat it
+                delay = None if yielded else budget.next_delay(e)
+                if delay is None:
+                    raise self._translate_error(e, budget.attempts or 1) from e
+
+                count("retries")
+                with span("backoff"):
+                    time.sleep(delay)
+                budget.before_retry()
+
+    async def aget_response(
+        self,
+        image_path: str,
+        system_message: str,
+        user_message: str,
+        model_name: str,
+        payload: Optional[ImagePayload] = None,
+    ) -> str:
+        """Get AI response using the async Azure AI client.
+
+        Waits between attempts are awaited, so a request backing off does
+        not hold a thread or a request slot.
+        """
+        client = self._get_async_client()
+        if not client:
+            raise ValueError(
+                "GITHUB_TOKEN was not found in environment or configuration."
+            )
+
+        with open_payload(image_path, payload) as image:
+            messages = await asyncio.to_thread(
+                self._build_messages, image, system_message, user_message
+            )
+        budget = self._retry_policy.start()
+        while True:
+            try:
+                started = time.monotonic()
+                async with alimit_concurrency("azure", model_name):
+                    with span("network"):
+                        response = await client.complete(
+                            messages=messages,
+                            model=model_name,
+                            **self._call_options(budget),
+                        )
+
+                self._record_usage(
+                    response.usage, model_name, started, self.image_detail.value
+                )
+                return response.choices[0].message.content
 
             except Exception as e:
-                # For any other unexpected errors
-                if attempt == max_retries - 1:
-                    raise RuntimeError(f"Unexpected error occurred: {str(e)}") from e
+                delay = budget.next_delay(e)
+                if delay is None:
+                    raise self._translate_error(e, budget.attempts) from e
 
-                delay = base_delay * (2**attempt)
-                time.sleep(delay)
+                count("retries")
+                with span("backoff"):
+                    await asyncio.sleep(delay)
+                await budget.abefore_retry()
 
-        # This should never be reached, but added for safety
-        raise RuntimeError("Maximum retries exceeded")
+    async def aclose(self) -> None:
+        """Close the async Azure AI client and its HTTP session."""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
 
     def validate_configuration(self) -> bool:
         """Validate Azure provider configuration."""
@@ -132,11 +341,38 @@ class AzureProvider(BaseProvider):
                         rate_limit=model_data["rate_limit"],
                         provider_type=model_data.get("provider_type", "azure"),
                         ollama_model_name=model_data.get("ollama_model_name"),
+                        max_image_edge=model_data.get("max_image_edge"),
                     )
                 )
 
         return azure_models
 
+    def test_model(self, model_name: str) -> bool:
+        """Send a minimal text request to a model.
+
+        Returns:
+            bool: True if the model answered with at least one choice
+
+        Raises:
+            ValueError: If no GitHub token is configured
+            Exception: SDK errors are passed through unchanged
+        """
+        if not self._client:
+            raise ValueError(
+                "GITHUB_TOKEN was not found in environment or configuration."
+            )
+
+        response = self._client.complete(
+            messages=[
+                SystemMessage(content="You are a helpful assistant."),
+                UserMessage(
+                    content=[TextContentItem(text="Hello, respond with just 'OK'")]
+                ),
+            ],
+            model=model_name,
+        )
+        return bool(response and response.choices)
+
     def is_service_available(self) -> bool:
         """Check if Azure AI service is available."""
         if not self._client:
@@ -144,15 +380,6 @@ class AzureProvider(BaseProvider):
 
         try:
             # Simple test request to check connectivity
-            response = self._client.complete(
-                messages=[
-                    SystemMessage(content="You are a helpful assistant."),
-                    UserMessage(
-                        content=[TextContentItem(text="Hello, respond with just 'OK'")]
-                    ),
-                ],
-                model="microsoft/Phi-3.5-vision-instruct",  # Use a known model
-            )
-            return response and response.choices
+            return self.test_model("microsoft/Phi-3.5-vision-instruct")
         except Exception:
             return False
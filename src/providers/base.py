@@ -1,8 +1,10 @@
 """Provider abstraction for AI services."""
 
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Iterator, List, Optional
 from model import Model
+from payload import ImagePayload
 
 
 class BaseProvider(ABC):
@@ -10,7 +12,12 @@ class BaseProvider(ABC):
 
     @abstractmethod
     def get_response(
-        self, image_path: str, system_message: str, user_message: str, model_name: str
+        self,
+        image_path: str,
+        system_message: str,
+        user_message: str,
+        model_name: str,
+        payload: Optional[ImagePayload] = None,
     ) -> str:
         """Get AI response for image processing.
 
@@ -19,12 +26,110 @@ class BaseProvider(ABC):
             system_message: System message content
             user_message: User message content
             model_name: Name of the model to use
+            payload: Encoded form of the image, shared by every attempt and
+                provider; created from image_path when not given
 
         Returns:
             str: AI response content
         """
         pass
 
+    async def aget_response(
+        self,
+        image_path: str,
+        system_message: str,
+        user_message: str,
+        model_name: str,
+        payload: Optional[ImagePayload] = None,
+    ) -> str:
+        """Get AI response for image processing without blocking the event loop.
+
+        Providers backed by an async SDK client should override this. The
+        default implementation runs get_response in a worker thread.
+
+        Args:
+            image_path: Path to the image file
+            system_message: System message content
+            user_message: User message content
+            model_name: Name of the model to use
+            payload: Encoded form of the image, shared by every attempt and
+                provider; created from image_path when not given
+
+        Returns:
+            str: AI response content
+        """
+        return await asyncio.to_thread(
+            self.get_response,
+            image_path,
+            system_message,
+            user_message,
+            model_name,
+            payload,
+        )
+
+    def stream_response(
+        self,
+        image_path: str,
+        system_message: str,
+        user_message: str,
+        model_name: str,
+        payload: Optional[ImagePayload] = None,
+    ) -> Iterator[str]:
+        """Get AI response for image processing as it is generated.
+
+        Providers whose service can stream should override this. The default
+        implementation yields the complete response as a single chunk.
+
+        Args:
+            image_path: Path to the image file
+            system_message: System message content
+            user_message: User message content
+            model_name: Name of the model to use
+            payload: Encoded form of the image, shared by every attempt and
+                provider; created from image_path when not given
+
+        Yields:
+            str: Successive pieces of the AI response content
+        """
+        yield self.get_response(
+            image_path, system_message, user_message, model_name, payload
+        )
+
+    def complete_text(
+        self, system_message: str, user_message: str, model_name: str
+    ) -> str:
+        """Get AI response to a text-only request, without an image.
+
+        Used for follow-up requests such as repairing a malformed response,
+        which must not pay for another image upload.
+
+        Args:
+            system_message: System message content
+            user_message: User message content
+            model_name: Name of the model to use
+
+        Returns:
+            str: AI response content
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support text-only requests."
+        )
+
+    async def acomplete_text(
+        self, system_message: str, user_message: str, model_name: str
+    ) -> str:
+        """Async variant of complete_text.
+
+        The default implementation runs complete_text in a worker thread.
+        """
+        return await asyncio.to_thread(
+            self.complete_text, system_message, user_message, model_name
+        )
+
+    async def aclose(self) -> None:
+        """Release resources held by async clients."""
+        pass
+
     @abstractmethod
     def validate_configuration(self) -> bool:
         """Validate provider configuration.
@@ -0,0 +1,331 @@
+"""Adaptive (AIMD) concurrency limits for model requests.
+
+Every provider and model gets one process-wide limiter that bounds how many
+requests are in flight at once. The limit grows additively, by about one
+request per round of successful requests, while latency stays close to the
+best latency seen so far. It is cut multiplicatively as soon as the service
+pushes back with a 429, a 503 or a timeout, so a batch settles just below
+the throughput the service will take instead of relying on a fixed --jobs.
+Limits are tuned by `providers.<type>.adaptive_jobs` and `max_jobs` in
+config.yaml.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Type
+
+from profiling import count, span
+
+# HTTP statuses a service uses to say it is overloaded
+OVERLOAD_STATUSES = (429, 503)
+
+_limiters: Dict[Tuple[str, str], "AdaptiveLimiter"] = {}
+_limiters_lock = threading.Lock()
+
+
+@dataclass
+class ConcurrencyConfig:
+    """Dataclass for the adaptive concurrency settings of a provider."""
+
+    adaptive: bool = True
+    min_jobs: int = 1
+    max_jobs: int = 16
+    # Latency counts as stable up to this multiple of the baseline latency
+    latency_tolerance: float = 2.0
+    decrease_factor: float = 0.5
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ConcurrencyConfig":
+        """Create ConcurrencyConfig from configuration dictionary"""
+        min_jobs = max(1, int(config.get("min_jobs", 1)))
+        return cls(
+            adaptive=bool(config.get("adaptive_jobs", True)),
+            min_jobs=min_jobs,
+            max_jobs=max(min_jobs, int(config.get("max_jobs", 16))),
+            latency_tolerance=max(1.0, float(config.get("latency_tolerance", 2.0))),
+            decrease_factor=min(
+                0.9, max(0.1, float(config.get("decrease_factor", 0.5)))
+            ),
+        )
+
+
+def get_concurrency_config(provider_type: str) -> ConcurrencyConfig:
+    """Returns the adaptive concurrency configuration of a provider."""
+    from config import get_provider_settings
+
+    try:
+        return ConcurrencyConfig.from_config(get_provider_settings(provider_type))
+    except (TypeError, ValueError):
+        return ConcurrencyConfig()
+
+
+@lru_cache(maxsize=None)
+def _timeout_errors() -> Tuple[Type[BaseException], ...]:
+    """Errors the providers' SDKs raise when a request times out."""
+    errors: List[Type[BaseException]] = [TimeoutError, asyncio.TimeoutError]
+    try:
+        from azure.core.exceptions import (
+            ServiceRequestTimeoutError,
+            ServiceResponseTimeoutError,
+        )
+
+        errors += [ServiceRequestTimeoutError, ServiceResponseTimeoutError]
+    except ImportError:
+        pass
+    try:
+        import httpx
+
+        errors.append(httpx.TimeoutException)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def is_timeout_error(error: BaseException) -> bool:
+    """Check whether a request failed because it timed out."""
+    return isinstance(error, _timeout_errors())
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """Check whether an error means the service is overloaded.
+
+    That is a 429 or 503 response, or a request that timed out. Providers
+    keep the status code on the errors they translate SDK errors into.
+    """
+    if is_timeout_error(error):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status in OVERLOAD_STATUSES
+
+
+class AdaptiveLimiter:
+    """Bounds in-flight requests with an additive-increase/multiplicative-decrease limit.
+
+    Args:
+        initial: Limit to start from
+        config: Bounds and tuning of the limit
+    """
+
+    def __init__(self, initial: int, config: Optional[ConcurrencyConfig] = None):
+        self.config = config or ConcurrencyConfig()
+        self.limit = float(
+            min(self.config.max_jobs, max(self.config.min_jobs, initial))
+        )
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        # Tasks waiting in aacquire(), woken by release() on their own loop
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        # Smoothed latency of the fastest requests, seconds
+        self._baseline: Optional[float] = None
+        self._last_decrease = float("-inf")
+        self.peak_in_flight = 0
+        self.throttled = 0
+        self.decreases = 0
+
+    @property
+    def maximum(self) -> int:
+        return self.config.max_jobs
+
+    def _try_acquire(self) -> bool:
+        if self._in_flight >= int(self.limit):
+            return False
+        self._in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+        return True
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        with self._cond:
+            while not self._try_acquire():
+                self._cond.wait()
+
+    async def aacquire(self) -> None:
+        """Wait until a request may be sent without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._try_acquire():
+                    return
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._cond:
+                    try:
+                        self._waiters.remove((loop, waiter))
+                    except ValueError:
+                        # Already woken for a free slot; pass it on
+                        self._wake_waiters()
+                raise
+
+    def _wake_waiters(self) -> None:
+        """Wake as many waiting tasks as there are free slots."""
+        free = int(self.limit) - self._in_flight
+        while free > 0 and self._waiters:
+            loop, waiter = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # Its loop is closed, so nothing waits on it any more
+                continue
+            free -= 1
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False):
+        """Finish a request and adapt the limit to its outcome.
+
+        Args:
+            latency: Duration of a successful request in seconds, None if
+                it failed
+            overloaded: Whether the service rejected the request as
+                overloaded
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if overloaded:
+                self.throttled += 1
+                self._decrease()
+            elif latency is not None:
+                self._observe(latency)
+            self._cond.notify_all()
+            self._wake_waiters()
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        # Requests sent in the same round fail together; cut once per round
+        if now - self._last_decrease < (self._baseline or 1.0):
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(
+            float(self.config.min_jobs), self.limit * self.config.decrease_factor
+        )
+
+    def _observe(self, latency: float) -> None:
+        if self._baseline is None:
+            self._baseline = latency
+        if latency <= self._baseline * self.config.latency_tolerance:
+            # One full step after a whole limit's worth of good requests
+            self.limit = min(float(self.config.max_jobs), self.limit + 1 / self.limit)
+        # Follows faster requests at once and slower ones only slowly
+        self._baseline = min(latency, 0.95 * self._baseline + 0.05 * latency)
+
+    def _finish(self, started: float, error: Optional[BaseException]) -> None:
+        if error is None:
+            self.release(latency=time.monotonic() - started)
+            return
+        overloaded = is_overload_error(error)
+        if overloaded:
+            count("throttled")
+        self.release(overloaded=overloaded)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one request slot for the block, learning from its outcome."""
+        with span("concurrency"):
+            self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._finish(started, e)
+            raise
+        self._finish(started, None)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Async form of slot()."""
+        with span("concurrency"):
+            await self.aacquire()
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._finish(started, e)
+            raise
+        self._finish(started, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current state of the limiter, for run reports."""
+        with self._cond:
+            return {
+                "limit": round(self.limit, 2),
+                "min": self.config.min_jobs,
+                "max": self.config.max_jobs,
+                "peak_in_flight": self.peak_in_flight,
+                "throttled": self.throttled,
+                "decreases": self.decreases,
+                "baseline_latency": (
+                    None if self._baseline is None else round(self._baseline, 6)
+                ),
+            }
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def get_limiter(
+    provider_type: str, model_name: str, initial: Optional[int] = None
+) -> Optional[AdaptiveLimiter]:
+    """Get the process-wide limiter of a provider and model.
+
+    Args:
+        provider_type: Provider the requests go to
+        model_name: Provider-side name of the model
+        initial: Starting limit if the limiter does not exist yet (default:
+            the configured `providers.<type>.jobs`)
+
+    Returns:
+        Optional[AdaptiveLimiter]: None if adaptive concurrency is disabled
+        for the provider
+    """
+    key = (provider_type, model_name)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+    if limiter is not None:
+        return limiter
+
+    config = get_concurrency_config(provider_type)
+    if not config.adaptive:
+        return None
+    if initial is None:
+        from config import get_provider_settings
+
+        try:
+            initial = int(get_provider_settings(provider_type).get("jobs", 1))
+        except (TypeError, ValueError):
+            initial = 1
+
+    with _limiters_lock:
+        return _limiters.setdefault(key, AdaptiveLimiter(initial, config))
+
+
+def limit_concurrency(provider_type: str, model_name: str):
+    """Context manager holding a request slot of a provider and model."""
+    limiter = get_limiter(provider_type, model_name)
+    return limiter.slot() if limiter is not None else nullcontext()
+
+
+def alimit_concurrency(provider_type: str, model_name: str):
+    """Async context manager holding a request slot of a provider and model."""
+    limiter = get_limiter(provider_type, model_name)
+    return limiter.aslot() if limiter is not None else nullcontext()
+
+
+def concurrency_report() -> Dict[str, Dict[str, Any]]:
+    """Snapshots of every limiter, keyed by "<provider>/<model>"."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {
+        f"{provider_type}/{model_name}": limiter.snapshot()
+        for (provider_type, model_name), limiter in limiters.items()
+    }
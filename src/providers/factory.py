@@ -1,13 +1,20 @@
-"""Provider factory for AI services."""
+"""Provider factory for AI services.
+
+Provider modules are imported by the registry only when a provider is first
+requested, so the Azure and Ollama SDKs are not loaded before they are
+needed.
+"""
 
 from .base import BaseProvider
-from .azure_provider import AzureProvider
-from .ollama_provider import OllamaProvider
+from .registry import get_provider
 from model import Model
 
 
 def create_provider(model: Model) -> BaseProvider:
-    """Create appropriate provider based on model.
+    """Get the appropriate provider for a model.
+
+    Providers are long-lived and shared by the whole process (see
+    registry.py), so repeated calls reuse the same client and connections.
 
     Args:
         model: The model to use for processing
@@ -19,12 +26,7 @@ def create_provider(model: Model) -> BaseProvider:
         ValueError: If provider type is not supported
     """
     # Use the provider_type field from the model
-    if model.provider_type == "ollama":
-        return OllamaProvider()
-    elif model.provider_type == "azure":
-        return AzureProvider()
-    else:
-        raise ValueError(f"Unsupported provider type: {model.provider_type}")
+    return get_provider(model.provider_type)
 
 
 def get_best_available_provider(preferred_model: Model = None) -> BaseProvider:
@@ -37,12 +39,12 @@ def get_best_available_provider(preferred_model: Model = None) -> BaseProvider:
         BaseProvider: Best available provider
     """
     if preferred_model and preferred_model.provider_type == "ollama":
-        ollama_provider = OllamaProvider()
+        ollama_provider = get_provider("ollama")
         if ollama_provider.is_service_available():
             return ollama_provider
         else:
             # Fallback to Azure if Ollama is not available
-            return AzureProvider()
+            return get_provider("azure")
 
     # Default to Azure provider
-    return AzureProvider()
+    return get_provider("azure")
@@ -0,0 +1,99 @@
+"""Cached service health shared by every provider instance in a process."""
+
+import threading
+import time
+from typing import Callable, Optional
+
+DEFAULT_HEALTH_TTL = 15.0  # seconds
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """Check whether an error means the service could not be reached at all.
+
+    Errors the service itself reports (unknown model, bad request, ...) are
+    not connection errors and must not mark the service as down.
+    """
+    if isinstance(error, ConnectionError):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+class ServiceHealth:
+    """Availability of a service, probed at most once per TTL.
+
+    A known-good state is returned immediately and refreshed in a background
+    thread once it is older than the TTL, so requests never wait for a health
+    probe. A known-bad state fails fast until the TTL expires and is then
+    re-probed synchronously, so a freshly started service is picked up.
+    Outcomes of real requests update the state through mark_available() and
+    mark_unavailable().
+
+    `probe` is a cheap request against the service that raises on failure.
+    """
+
+    def __init__(self, probe: Callable[[], None], ttl: float = DEFAULT_HEALTH_TTL):
+        self._probe = probe
+        self.ttl = ttl
+        self._available: Optional[bool] = None
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _record(self, available: bool) -> None:
+        with self._lock:
+            self._available = available
+            self._checked_at = time.monotonic()
+
+    def mark_available(self) -> None:
+        """Record that a request to the service succeeded."""
+        self._record(True)
+
+    def mark_unavailable(self) -> None:
+        """Record that a request failed because the service was unreachable."""
+        self._record(False)
+
+    def check(self) -> bool:
+        """Probe the service now and record the result."""
+        try:
+            self._probe()
+        except Exception as e:
+            if not is_connection_error(e):
+                # The service answered, just not with success
+                self._record(True)
+                return True
+            self._record(False)
+            return False
+        self._record(True)
+        return True
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self.check()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def cached(self) -> Optional[bool]:
+        """The cached state, or None if the service has to be probed first."""
+        with self._lock:
+            stale = time.monotonic() - self._checked_at > self.ttl
+            if self._available is None or (stale and not self._available):
+                return None
+
+            if stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(
+                    target=self._refresh_in_background,
+                    name="handmark-health",
+                    daemon=True,
+                ).start()
+            return self._available
+
+    def is_available(self) -> bool:
+        """The cached state, probing synchronously only when it is unknown."""
+        available = self.cached()
+        return self.check() if available is None else available
@@ -1,16 +1,46 @@
 """Ollama provider implementation."""
 
-import base64
-from typing import List
+import asyncio
+import threading
+import time
+from typing import Iterator, List, Optional
 from .base import BaseProvider
+from .concurrency import alimit_concurrency, is_timeout_error, limit_concurrency
+from .retry import get_retry_policy
+from .health import DEFAULT_HEALTH_TTL, ServiceHealth, is_connection_error
 from model import Model
+from payload import ImagePayload, open_payload
+from profiling import count, span, traced
+from usage import TEXT_ONLY, Usage, record
+
+# One health state per process, shared by every OllamaProvider instance
+_health: Optional[ServiceHealth] = None
+_health_lock = threading.Lock()
+
+
+def _transient_errors() -> tuple:
+    """httpx errors of a request that timed out or lost its connection."""
+    try:
+        import httpx
+    except ImportError:
+        return ()
+    return (httpx.TimeoutException, httpx.RemoteProtocolError)
 
 
 class OllamaProvider(BaseProvider):
     """Ollama provider for local image processing."""
 
-    def __init__(self):
+    # Images go to the model as they are; Ollama has no detail levels
+    image_detail = "full"
+
+    def __init__(self, client_options: Optional[dict] = None):
         self._client = None
+        self._async_client = None
+        # Extra httpx client options, e.g. connection pool limits
+        self._client_options = client_options or {}
+        self._retry_policy = get_retry_policy(
+            "ollama", transient_errors=_transient_errors()
+        )
         self._initialize_client()
 
     def _initialize_client(self):
@@ -18,12 +48,49 @@ class OllamaProvider(BaseProvider):
         try:
             import ollama
 
-            self._client = ollama.Client()
+            self._client = ollama.Client(**self._client_options)
         except ImportError:
             self._client = None
 
+    def _get_health(self) -> ServiceHealth:
+        """Get the process-wide health state of the Ollama service."""
+        global _health
+
+        with _health_lock:
+            if _health is None:
+                from config import get_provider_settings
+
+                settings = get_provider_settings("ollama")
+                try:
+                    ttl = float(settings.get("health_ttl", DEFAULT_HEALTH_TTL))
+                except (TypeError, ValueError):
+                    ttl = DEFAULT_HEALTH_TTL
+                _health = ServiceHealth(probe=self._client.list, ttl=ttl)
+            return _health
+
+    def _retry_delay(self, budget, error: Exception):
+        """Seconds to wait before retrying a failed request, None to give up."""
+        # An unreachable service is reported at once (see ServiceHealth)
+        if is_connection_error(error):
+            return None
+        return budget.next_delay(error)
+
+    def _request_failed(self, error: Exception, model_name: str) -> Exception:
+        """Update the health state for a failed request and translate the error."""
+        if is_connection_error(error):
+            self._get_health().mark_unavailable()
+            return ConnectionError(
+                "Ollama service is not running. Please start Ollama service first."
+            )
+        return self._translate_error(error, model_name)
+
     def get_response(
-        self, image_path: str, system_message: str, user_message: str, model_name: str
+        self,
+        image_path: str,
+        system_message: str,
+        user_message: str,
+        model_name: str,
+        payload: Optional[ImagePayload] = None,
     ) -> str:
         """Get AI response using Ollama service."""
         if not self._client:
@@ -36,29 +103,230 @@ class OllamaProvider(BaseProvider):
                 "Ollama service is not running. Please start Ollama service first."
             )
 
-        # Read and encode image
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode("utf-8")
+        with open_payload(image_path, payload) as image:
+            # Encoded once; every attempt sends the same messages
+            messages = self._build_messages(image, system_message, user_message)
+        return self._chat(messages, model_name, self.image_detail)
 
-        try:
-            response = self._client.chat(
+    def _chat(self, messages: list, model_name: str, detail: str = TEXT_ONLY) -> str:
+        """Send chat messages, retrying transient failures."""
+        budget = self._retry_policy.start()
+        while True:
+            try:
+                started = time.monotonic()
+                with limit_concurrency("ollama", model_name), span("network"):
+                    response = self._client.chat(model=model_name, messages=messages)
+                break
+
+            except Exception as e:
+                delay = self._retry_delay(budget, e)
+                if delay is None:
+                    raise self._request_failed(e, model_name) from e
+
+                count("retries")
+                with span("backoff"):
+                    time.sleep(delay)
+                budget.before_retry()
+
+        self._get_health().mark_available()
+        self._record_usage(response, model_name, started, detail)
+        return response["message"]["content"]
+
+    def complete_text(
+        self, system_message: str, user_message: str, model_name: str
+    ) -> str:
+        """Get AI response to a text-only request using Ollama service."""
+        if not self._client:
+            raise ValueError(
+                "Ollama client not available. Please install ollama package."
+            )
+
+        if not self.is_service_available():
+            raise ConnectionError(
+                "Ollama service is not running. Please start Ollama service first."
+            )
+
+        messages = [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message},
+        ]
+        return self._chat(messages, model_name)
+
+    def stream_response(
+        self,
+        image_path: str,
+        system_message: str,
+        user_message: str,
+        model_name: str,
+        payload: Optional[ImagePayload] = None,
+    ) -> Iterator[str]:
+        """Stream the AI response from Ollama service as it is generated."""
+        if not self._client:
+            raise ValueError(
+                "Ollama client not available. Please install ollama package."
+            )
+
+        if not self.is_service_available():
+            raise ConnectionError(
+                "Ollama service is not running. Please start Ollama service first."
+            )
+
+        with open_payload(image_path, payload) as image:
+            messages = self._build_messages(image, system_message, user_message)
+        budget = self._retry_policy.start()
+        yielded = False
+        while True:
+            try:
+                started = time.monotonic()
+                chunk = {}
+                with limit_concurrency("ollama", model_name):
+                    for chunk in self._client.chat(
+                        model=model_name, messages=messages, stream=True
+                    ):
+                        content = chunk["message"]["content"]
+                        if content:
+                            yielded = True
+                            yield content
+                break
+
+            except Exception as e:
+                # Once content has been handed out, a retry would repeat it
+                delay = None if yielded else self._retry_delay(budget, e)
+                if delay is None:
+                    raise self._request_failed(e, model_name) from e
+
+                count("retries")
+                with span("backoff"):
+                    time.sleep(delay)
+                budget.before_retry()
+
+        self._get_health().mark_available()
+        # The last chunk carries the counts and durations of the request
+        self._record_usage(chunk, model_name, started, self.image_detail)
+
+    async def aget_response(
+        self,
+        image_path: str,
+        system_message: str,
+        user_message: str,
+        model_name: str,
+        payload: Optional[ImagePayload] = None,
+    ) -> str:
+        """Get AI response using the async Ollama client."""
+        client = self._get_async_client()
+        if not client:
+            raise ValueError(
+                "Ollama client not available. Please install ollama package."
+            )
+
+        if not await self.ais_service_available():
+            raise ConnectionError(
+                "Ollama service is not running. Please start Ollama service first."
+            )
+
+        with open_payload(image_path, payload) as image:
+            messages = await asyncio.to_thread(
+                self._build_messages, image, system_message, user_message
+            )
+        budget = self._retry_policy.start()
+        while True:
+            try:
+                started = time.monotonic()
+                async with alimit_concurrency("ollama", model_name):
+                    with span("network"):
+                        response = await client.chat(
+                            model=model_name, messages=messages
+                        )
+                break
+
+            except Exception as e:
+                delay = self._retry_delay(budget, e)
+                if delay is None:
+                    raise self._request_failed(e, model_name) from e
+
+                count("retries")
+                with span("backoff"):
+                    await asyncio.sleep(delay)
+                await budget.abefore_retry()
+
+        self._get_health().mark_available()
+        self._record_usage(response, model_name, started, self.image_detail)
+        return response["message"]["content"]
+
+    def _get_async_client(self):
+        """Lazily create the async Ollama client on first use."""
+        if self._async_client is None and self._client is not None:
+            import ollama
+
+            self._async_client = ollama.AsyncClient(**self._client_options)
+        return self._async_client
+
+    @traced("encode")
+    def _build_messages(
+        self, image: ImagePayload, system_message: str, user_message: str
+    ) -> list:
+        """Build the chat messages for an image request.
+
+        The Ollama client validates images as base64 text, so the payload's
+        str form is used; it is built once and shared by every attempt.
+        """
+        image_data = image.base64()
+        count("payload_bytes", len(image_data))
+
+        return [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message, "images": [image_data]},
+        ]
+
+    @staticmethod
+    def _record_usage(
+        response, model_name: str, started: float, detail: str = TEXT_ONLY
+    ) -> None:
+        """Report the token counts and durations Ollama returned for a request."""
+
+        def seconds(name: str) -> Optional[float]:
+            nanoseconds = response.get(name)
+            return nanoseconds / 1e9 if nanoseconds else None
+
+        record(
+            Usage(
+                provider="ollama",
                 model=model_name,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message, "images": [image_data]},
-                ],
+                prompt_tokens=response.get("prompt_eval_count") or 0,
+                completion_tokens=response.get("eval_count") or 0,
+                seconds=time.monotonic() - started,
+                server_seconds=seconds("total_duration"),
+                generation_seconds=seconds("eval_duration"),
+                detail=detail,
             )
+        )
 
-            return response["message"]["content"]
+    def _translate_error(self, error: Exception, model_name: str) -> Exception:
+        """Map an Ollama client error to the error raised to callers.
 
-        except Exception as e:
-            if "model not found" in str(e).lower():
-                raise ValueError(
-                    f"Model '{model_name}' not found. Please pull the model first: "
-                    f"ollama pull {model_name}"
-                ) from e
-            else:
-                raise RuntimeError(f"Ollama request failed: {str(e)}") from e
+        The translated error keeps the HTTP status of the response, if any,
+        as `status_code`.
+        """
+        if is_timeout_error(error):
+            translated = TimeoutError(f"Ollama request timed out: {str(error)}")
+        elif "model not found" in str(error).lower():
+            translated = ValueError(
+                f"Model '{model_name}' not found. Please pull the model first: "
+                f"ollama pull {model_name}"
+            )
+        else:
+            translated = RuntimeError(f"Ollama request failed: {str(error)}")
+        translated.status_code = getattr(error, "status_code", None)
+        return translated
+
+    async def aclose(self) -> None:
+        """Close the async Ollama client and its HTTP session."""
+        if self._async_client is not None:
+            # Older ollama releases have no AsyncClient.close()
+            close = getattr(self._async_client, "close", None)
+            if close is not None:
+                await close()
+            self._async_client = None
 
     def validate_configuration(self) -> bool:
         """Validate Ollama provider configuration."""
@@ -110,17 +378,23 @@ class OllamaProvider(BaseProvider):
         return ollama_models
 
     def is_service_available(self) -> bool:
-        """Check if Ollama service is available."""
+        """Check if Ollama service is available (cached, see ServiceHealth)."""
         if not self._client:
             return False
 
-        try:
-            # Try to list models to check if service is running
-            self._client.list()
-            return True
-        except Exception:
+        return self._get_health().is_available()
+
+    async def ais_service_available(self) -> bool:
+        """Check if Ollama service is available without blocking the event loop."""
+        if not self._client:
             return False
 
+        health = self._get_health()
+        available = health.cached()
+        if available is None:
+            available = await asyncio.to_thread(health.check)
+        return available
+
     def get_installed_models(self) -> List[str]:
         """Get list of locally installed Ollama models."""
         if not self._client or not self.is_service_available():
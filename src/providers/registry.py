@@ -0,0 +1,175 @@
+"""Process-wide registry of long-lived provider instances.
+
+Providers are keyed by provider type and credential, so every dissector,
+batch worker and CLI command in a process shares one SDK client and its
+connection pool instead of paying a TLS handshake per image. The registry
+also builds the HTTP transports those clients use, tuned by the
+`providers.<type>.pool_size` and `keep_alive` settings in config.yaml.
+"""
+
+import hashlib
+import os
+import socket
+import threading
+from typing import Any, Dict, Tuple
+
+from .base import BaseProvider
+
+DEFAULT_POOL_SIZE = 10
+
+_providers: Dict[Tuple[str, str], BaseProvider] = {}
+_providers_lock = threading.Lock()
+# Serializes building providers, so a client and its transport are only
+# ever created once per key; separate from _providers_lock, which the
+# transport helpers take
+_create_lock = threading.Lock()
+_sessions: Dict[str, Any] = {}
+
+
+def get_transport_settings(provider_type: str) -> Tuple[int, bool]:
+    """Get the connection pool size and keep-alive setting for a provider."""
+    from config import get_provider_settings
+
+    settings = get_provider_settings(provider_type)
+    try:
+        pool_size = max(1, int(settings.get("pool_size", DEFAULT_POOL_SIZE)))
+    except (TypeError, ValueError):
+        pool_size = DEFAULT_POOL_SIZE
+    return pool_size, bool(settings.get("keep_alive", True))
+
+
+def _credential_key(provider_type: str) -> str:
+    """Identify the credential a provider would be created with."""
+    if provider_type == "azure":
+        from config import get_github_token
+
+        credential = get_github_token() or ""
+    elif provider_type == "ollama":
+        credential = os.environ.get("OLLAMA_HOST", "")
+    else:
+        raise ValueError(f"Unsupported provider type: {provider_type}")
+    # Only a digest of the token is kept around as a dictionary key
+    return hashlib.sha256(credential.encode("utf-8")).hexdigest()
+
+
+def _get_session(provider_type: str):
+    """Shared requests session with a sized, keep-alive connection pool."""
+    session = _sessions.get(provider_type)
+    if session is not None:
+        return session
+
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection
+
+    pool_size, keep_alive = get_transport_settings(provider_type)
+
+    class _PoolAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            if keep_alive:
+                # Detect connections dropped by middleboxes while idle
+                kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+                    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                ]
+            super().init_poolmanager(*args, **kwargs)
+
+    session = requests.Session()
+    adapter = _PoolAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+
+    _sessions[provider_type] = session
+    return session
+
+
+def create_transport(provider_type: str):
+    """azure-core transport on the provider's shared, pooled session."""
+    from azure.core.pipeline.transport import RequestsTransport
+
+    with _providers_lock:
+        session = _get_session(provider_type)
+    # The registry owns the session; closing a client must not close it
+    return RequestsTransport(session=session, session_owner=False)
+
+
+def get_http_client_options(provider_type: str) -> Dict[str, Any]:
+    """httpx client options (as taken by the Ollama SDK) with a sized pool."""
+    import httpx
+
+    pool_size, keep_alive = get_transport_settings(provider_type)
+    return {
+        "limits": httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size if keep_alive else 0,
+        )
+    }
+
+
+def create_async_transport(provider_type: str):
+    """azure-core async transport with a sized connection pool.
+
+    aiohttp sessions belong to an event loop, so this must be called from
+    the loop that will use the client.
+    """
+    import aiohttp
+    from azure.core.pipeline.transport import AioHttpTransport
+
+    pool_size, keep_alive = get_transport_settings(provider_type)
+    connector = aiohttp.TCPConnector(limit=pool_size, force_close=not keep_alive)
+    return AioHttpTransport(
+        session=aiohttp.ClientSession(connector=connector), session_owner=True
+    )
+
+
+def _create(provider_type: str) -> BaseProvider:
+    if provider_type == "ollama":
+        from .ollama_provider import OllamaProvider
+
+        return OllamaProvider(client_options=get_http_client_options("ollama"))
+    elif provider_type == "azure":
+        from .azure_provider import AzureProvider
+
+        return AzureProvider(transport=create_transport("azure"))
+    else:
+        raise ValueError(f"Unsupported provider type: {provider_type}")
+
+
+def get_provider(provider_type: str) -> BaseProvider:
+    """Get the process-wide provider for a provider type.
+
+    A new provider is only created when none exists yet for the current
+    credential (GitHub token for Azure, OLLAMA_HOST for Ollama).
+
+    Raises:
+        ValueError: If provider type is not supported
+    """
+    key = (provider_type, _credential_key(provider_type))
+    with _providers_lock:
+        provider = _providers.get(key)
+    if provider is not None:
+        return provider
+
+    with _create_lock:
+        # Another thread may have built it while this one waited
+        with _providers_lock:
+            provider = _providers.get(key)
+        if provider is None:
+            provider = _create(provider_type)
+            with _providers_lock:
+                _providers[key] = provider
+    return provider
+
+
+async def aclose_providers() -> None:
+    """Close the async clients of every registered provider.
+
+    Async clients are bound to the event loop they were first used in, so
+    this is called before that loop finishes. Providers stay registered and
+    create new async clients on demand.
+    """
+    with _providers_lock:
+        providers = list(_providers.values())
+    for provider in providers:
+        await provider.aclose()
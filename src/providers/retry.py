@@ -0,0 +1,248 @@
+"""Retry policy shared by the providers.
+
+A failed request is only retried when the error is transient: timeouts,
+dropped connections, 408/425/429 and 5xx responses. Bad requests and
+authentication failures fail at once. The wait before a retry comes from
+the service when it says how long to back off (`Retry-After`,
+`retry-after-ms` or `x-ratelimit-reset*` headers), otherwise from
+exponential backoff with full jitter, so workers that failed together do
+not retry together. All attempts for one image share a deadline. Policies
+are tuned by `providers.<type>.retry` in config.yaml.
+
+Inside `charge_retries()`, every retry takes quota from the request's rate
+limiter like the first attempt did, so the shared quota ledger counts each
+request the service actually received.
+"""
+
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, Optional, Tuple, Type
+
+from profiling import span
+
+RETRYABLE_STATUSES = (408, 425, 429)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# Rate limiter (and whether to wait for its quota) charged for retries
+_retry_quota: ContextVar[Optional[Tuple[Any, bool]]] = ContextVar(
+    "handmark_retry_quota", default=None
+)
+
+
+@contextmanager
+def charge_retries(rate_limiter, wait_for_quota: bool = False) -> Iterator[None]:
+    """Take quota from rate_limiter for every retry of the requests in the block."""
+    token = _retry_quota.set(
+        (rate_limiter, wait_for_quota) if rate_limiter is not None else None
+    )
+    try:
+        yield
+    finally:
+        _retry_quota.reset(token)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    # Ollama reports -1 when the status is unknown
+    return status if isinstance(status, int) and status > 0 else None
+
+
+def _headers(error: BaseException) -> Dict[str, str]:
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return {}
+    return {str(key).lower(): str(value) for key, value in headers.items()}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Seconds in a "1.5", "20ms" or "6m0s" style duration."""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _parse_retry_after(value: str) -> Optional[float]:
+    """Seconds to wait from a Retry-After value (seconds or an HTTP date)."""
+    seconds = _parse_duration(value)
+    if seconds is not None:
+        return seconds
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return (when - datetime.now(timezone.utc)).total_seconds()
+
+
+def header_delay(error: BaseException) -> Optional[float]:
+    """The wait a failed response asks for, in seconds, if it names one."""
+    headers = _headers(error)
+    if not headers:
+        return None
+
+    if "retry-after-ms" in headers:
+        milliseconds = _parse_duration(headers["retry-after-ms"])
+        if milliseconds is not None:
+            return max(0.0, milliseconds / 1000)
+    if "retry-after" in headers:
+        seconds = _parse_retry_after(headers["retry-after"])
+        if seconds is not None:
+            return max(0.0, seconds)
+
+    # OpenAI style durations until the request or token budget resets
+    resets = [
+        _parse_duration(headers[name])
+        for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if name in headers
+    ]
+    resets = [seconds for seconds in resets if seconds is not None]
+    if resets:
+        return max(0.0, max(resets))
+
+    # GitHub style epoch time of the reset
+    if "x-ratelimit-reset" in headers:
+        try:
+            reset = float(headers["x-ratelimit-reset"])
+        except ValueError:
+            return None
+        return max(0.0, reset - time.time() if reset > 1e9 else reset)
+    return None
+
+
+@dataclass
+class RetryPolicy:
+    """Dataclass for the retry settings of a provider."""
+
+    max_attempts: int = 3
+    base_delay: float = 2.0
+    # Caps backoff; waits the service asks for are honored as they are
+    max_delay: float = 60.0
+    # Seconds all attempts for one image may take together, None for no limit
+    deadline: Optional[float] = 300.0
+    # Provider SDK errors that mean the connection failed or timed out
+    transient_errors: Tuple[Type[BaseException], ...] = field(default=(), repr=False)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "RetryPolicy":
+        """Create RetryPolicy from configuration dictionary"""
+        deadline = config.get("deadline", 300.0)
+        return cls(
+            max_attempts=max(1, int(config.get("max_attempts", 3))),
+            base_delay=max(0.0, float(config.get("base_delay", 2.0))),
+            max_delay=max(0.0, float(config.get("max_delay", 60.0))),
+            deadline=None if deadline is None else max(1.0, float(deadline)),
+        )
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """Check whether a request that failed with error may succeed on retry."""
+        status = _status_code(error)
+        if status is not None:
+            return status in RETRYABLE_STATUSES or status >= 500
+        return isinstance(error, (TimeoutError, ConnectionError)) or isinstance(
+            error, self.transient_errors
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number attempt + 1."""
+        return random.uniform(0.0, min(self.max_delay, self.base_delay * (2**attempt)))
+
+    def delay_for(self, error: BaseException, attempt: int) -> float:
+        """Seconds to wait after the failed attempt number attempt (from 0)."""
+        requested = header_delay(error)
+        if requested is None:
+            return self.backoff(attempt)
+        # Spread out the workers that were all told the same time
+        return requested + random.uniform(0.0, self.base_delay)
+
+    def start(self) -> "RetryBudget":
+        """Begin the attempts for one image."""
+        return RetryBudget(self)
+
+
+class RetryBudget:
+    """Attempts and deadline left for one image."""
+
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.attempts = 0
+        self._quota = _retry_quota.get()
+        self._deadline = (
+            None if policy.deadline is None else time.monotonic() + policy.deadline
+        )
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, None without one."""
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def next_delay(self, error: BaseException) -> Optional[float]:
+        """Record a failed attempt and decide about the next one.
+
+        Returns:
+            Optional[float]: Seconds to wait before retrying, or None if the
+            error is final, the attempts are used up, or the wait would
+            overrun the deadline
+        """
+        self.attempts += 1
+        if self.attempts >= self.policy.max_attempts:
+            return None
+        if not self.policy.is_retryable(error):
+            return None
+        delay = self.policy.delay_for(error, self.attempts - 1)
+        remaining = self.remaining()
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
+
+    def before_retry(self) -> None:
+        """Take quota for the next attempt, as for the first one.
+
+        Raises:
+            QuotaExceededError: If the quota is used up and the request
+                does not wait for it
+        """
+        if self._quota is not None:
+            rate_limiter, wait_for_quota = self._quota
+            with span("rate_limit"):
+                rate_limiter.acquire(wait_for_quota=wait_for_quota)
+
+    async def abefore_retry(self) -> None:
+        """Async variant of before_retry."""
+        if self._quota is not None:
+            rate_limiter, wait_for_quota = self._quota
+            with span("rate_limit"):
+                await rate_limiter.aacquire(wait_for_quota=wait_for_quota)
+
+
+def get_retry_policy(
+    provider_type: str, transient_errors: Tuple[Type[BaseException], ...] = ()
+) -> RetryPolicy:
+    """Returns the retry policy of a provider."""
+    from config import get_provider_settings
+
+    try:
+        policy = RetryPolicy.from_config(
+            get_provider_settings(provider_type).get("retry") or {}
+        )
+    except (TypeError, ValueError):
+        policy = RetryPolicy()
+    policy.transient_errors = transient_errors
+    return policy
@@ -0,0 +1,319 @@
+"""Client-side enforcement of model rate limits.
+
+`Model.rate_limit` strings such as "150 requests/day" are parsed into limits.
+A quota ledger on disk records every request so that concurrent workers and
+separate CLI invocations share a single budget. For per-second and
+per-minute limits, a token bucket without burst capacity also spaces
+requests out evenly inside one process, so workers do not fire in bursts.
+Longer windows are left to the ledger alone, since spreading a daily quota
+evenly would hold a small batch back for hours.
+"""
+
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from model import Model
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+_PERIOD_SECONDS = {
+    "s": 1,
+    "sec": 1,
+    "second": 1,
+    "m": 60,
+    "min": 60,
+    "minute": 60,
+    "h": 3600,
+    "hr": 3600,
+    "hour": 3600,
+    "d": 86400,
+    "day": 86400,
+}
+
+_RATE_LIMIT_PATTERN = re.compile(
+    r"(\d[\d,]*)\s*(?:requests?|reqs?|calls?)?\s*(?:/|per)\s*([a-z]+)",
+    re.IGNORECASE,
+)
+
+# Longest single sleep while waiting for quota, so Ctrl-C stays responsive
+# and quota freed by other processes is noticed
+_MAX_WAIT_STEP = 60.0
+
+# Longest limit window that is paced by the token bucket, in seconds
+_MAX_PACED_PERIOD = 60.0
+
+_limiters: Dict[str, "RateLimiter"] = {}
+_limiters_lock = threading.Lock()
+_ledger: Optional["QuotaLedger"] = None
+
+
+class QuotaExceededError(RuntimeError):
+    """Raised when a model's request quota is used up."""
+
+    def __init__(self, model_name: str, retry_after: float):
+        self.model_name = model_name
+        self.retry_after = retry_after
+        super().__init__(
+            f"Request quota for '{model_name}' is exhausted. "
+            f"Next request possible in {format_duration(retry_after)}."
+        )
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration in seconds as a short human-readable string."""
+    seconds = max(0, int(round(seconds)))
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+
+def parse_rate_limit(rate_limit: Optional[str]) -> List[Tuple[int, float]]:
+    """Parse a rate limit string into (requests, period in seconds) pairs.
+
+    Several limits may be combined, e.g. "15 requests/minute, 150 requests/day".
+    Strings without a recognizable limit (such as "Unlimited (Local)") yield
+    an empty list.
+    """
+    if not rate_limit:
+        return []
+
+    limits = []
+    for count, unit in _RATE_LIMIT_PATTERN.findall(rate_limit):
+        unit = unit.lower()
+        period = _PERIOD_SECONDS.get(unit) or _PERIOD_SECONDS.get(unit.rstrip("s"))
+        if period is None:
+            continue
+        requests = int(count.replace(",", ""))
+        if requests > 0:
+            limits.append((requests, float(period)))
+
+    return sorted(limits, key=lambda limit: limit[1])
+
+
+class TokenBucket:
+    """Thread-safe token bucket pacing requests within one process."""
+
+    def __init__(self, capacity: int, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._tokens = min(
+            self.capacity, self._tokens + elapsed * self.refill_per_second
+        )
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available.
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one is
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.refill_per_second
+
+
+class QuotaLedger:
+    """Persistent record of request timestamps per model.
+
+    The ledger is a JSON file guarded by an advisory file lock, so every
+    handmark process on the machine draws from the same sliding-window
+    budget.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(self.path.with_suffix(".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> Dict[str, List[float]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, data: Dict[str, List[float]]) -> None:
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _wait_time(
+        timestamps: List[float], limits: List[Tuple[int, float]], now: float, n: int
+    ) -> float:
+        """Seconds until n more requests fit within every limit."""
+        wait = 0.0
+        for requests, period in limits:
+            if n > requests:
+                return float("inf")
+            in_window = sorted(t for t in timestamps if t > now - period)
+            excess = len(in_window) + n - requests
+            if excess > 0:
+                # The excess-th oldest request has to leave the window first
+                wait = max(wait, in_window[excess - 1] + period - now)
+        return wait
+
+    def try_record(self, key: str, limits: List[Tuple[int, float]]) -> float:
+        """Record a request for key if the quota allows it.
+
+        Returns:
+            float: 0 if the request was recorded, otherwise seconds until
+            the quota allows it
+        """
+        with self._locked():
+            data = self._read()
+            now = time.time()
+            longest = max(period for _, period in limits)
+            timestamps = [t for t in data.get(key, []) if t > now - longest]
+
+            wait = self._wait_time(timestamps, limits, now, 1)
+            if wait > 0:
+                return wait
+
+            timestamps.append(now)
+            data[key] = timestamps
+            self._write(data)
+            return 0.0
+
+    def remaining(self, key: str, limits: List[Tuple[int, float]]) -> int:
+        """Number of requests the quota allows right now."""
+        data = self._read()
+        now = time.time()
+        timestamps = data.get(key, [])
+        return min(
+            max(0, requests - sum(1 for t in timestamps if t > now - period))
+            for requests, period in limits
+        )
+
+    def wait_time(self, key: str, limits: List[Tuple[int, float]], n: int) -> float:
+        """Seconds until the quota allows n requests (inf if it never will)."""
+        return self._wait_time(self._read().get(key, []), limits, time.time(), n)
+
+
+class RateLimiter:
+    """Combines the shared on-disk quota with in-process pacing for a model."""
+
+    def __init__(
+        self, model_name: str, limits: List[Tuple[int, float]], ledger: QuotaLedger
+    ):
+        self.model_name = model_name
+        self.limits = limits
+        self._ledger = ledger
+        # Space requests out at the rate of the shortest window, one at a
+        # time; the ledger is the authority on whether the quota allows a
+        # request at all
+        requests, period = limits[0]
+        self._bucket: Optional[TokenBucket] = None
+        if period <= _MAX_PACED_PERIOD:
+            self._bucket = TokenBucket(capacity=1, refill_per_second=requests / period)
+
+    def _pace_delay(self) -> float:
+        return self._bucket.try_acquire() if self._bucket is not None else 0.0
+
+    def acquire(self, wait_for_quota: bool = False) -> None:
+        """Block until a request may be sent, and record it against the quota.
+
+        Args:
+            wait_for_quota: Wait for the shared quota to free up instead of
+                raising QuotaExceededError when it is exhausted
+        """
+        while True:
+            delay = self._ledger.try_record(self.model_name, self.limits)
+            if delay == 0:
+                break
+            if not wait_for_quota:
+                raise QuotaExceededError(self.model_name, delay)
+            time.sleep(min(delay, _MAX_WAIT_STEP))
+
+        delay = self._pace_delay()
+        while delay > 0:
+            time.sleep(delay)
+            delay = self._pace_delay()
+
+    async def aacquire(self, wait_for_quota: bool = False) -> None:
+        """Async variant of acquire."""
+        while True:
+            delay = await asyncio.to_thread(
+                self._ledger.try_record, self.model_name, self.limits
+            )
+            if delay == 0:
+                break
+            if not wait_for_quota:
+                raise QuotaExceededError(self.model_name, delay)
+            await asyncio.sleep(min(delay, _MAX_WAIT_STEP))
+
+        delay = self._pace_delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._pace_delay()
+
+    def remaining(self) -> int:
+        """Number of requests the shared quota allows right now."""
+        return self._ledger.remaining(self.model_name, self.limits)
+
+    def wait_time(self, n: int) -> float:
+        """Seconds until the shared quota allows n requests."""
+        return self._ledger.wait_time(self.model_name, self.limits, n)
+
+
+def get_rate_limiter(model: Model) -> Optional[RateLimiter]:
+    """Get the process-wide rate limiter for a model.
+
+    Returns:
+        Optional[RateLimiter]: None if the model has no parseable rate limit
+    """
+    limits = parse_rate_limit(model.rate_limit)
+    if not limits:
+        return None
+
+    global _ledger
+
+    with _limiters_lock:
+        limiter = _limiters.get(model.name)
+        if limiter is None or limiter.limits != limits:
+            if _ledger is None:
+                from config import get_config_dir
+
+                _ledger = QuotaLedger(get_config_dir() / "quota.json")
+            limiter = RateLimiter(model.name, limits, _ledger)
+            _limiters[model.name] = limiter
+        return limiter
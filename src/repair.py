@@ -0,0 +1,258 @@
+"""Repair of malformed JSON, YAML and XML model responses.
+
+Models sometimes wrap a document in prose, leave a trailing comma, or stop
+before closing every bracket or tag. Instead of saving such a response as
+unvalidated text (or paying for another image request), the formatter first
+repairs it locally: prose around code fences is dropped, trailing commas are
+removed, unbalanced JSON brackets are closed, YAML values that need quoting
+are quoted, and XML goes through lxml's recovering parser. Only when that
+fails, and `repair.remote` is enabled, the text (never the image) is sent
+back to the model with a request to fix it.
+"""
+
+import json
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+REPAIRABLE_FORMATS = ("json", "yaml", "xml")
+
+# Truncated JSON is cut back to earlier commas at most this many times
+_MAX_JSON_CUTS = 64
+
+_FENCE = re.compile(r"```[ \t]*([\w+-]*)[^\n]*\n(.*?)(?:\n[ \t]*```|\Z)", re.DOTALL)
+_CLOSERS = {"{": "}", "[": "]"}
+
+# "key: value" lines of YAML block mappings and sequences of mappings
+_YAML_ENTRY = re.compile(r"^(\s*(?:- +)?[^\s#'\"{\[][^:#]*?:[ \t]+)(\S.*?)\s*$")
+_YAML_KEY_LINE = re.compile(r"^(?:- |[\w'\"][^:]*:(?:\s|$))")
+# Plain scalars cannot contain ": " nor start with these characters
+_YAML_PLAIN_UNSAFE = re.compile(r": |^[@`%]")
+
+_BARE_AMPERSAND = re.compile(r"&(?!#\d+;|#x[0-9a-fA-F]+;|\w+;)")
+
+REMOTE_SYSTEM_MESSAGE = (
+    "You fix malformed {name} documents. Reply with only the corrected "
+    "{name}: no code fences, no commentary. Keep all text and values "
+    "unchanged; only repair the syntax."
+)
+
+
+@dataclass
+class RepairConfig:
+    """Dataclass for malformed output repair settings."""
+
+    local: bool = True
+    remote: bool = False
+    # Provider-side model for remote repair, None for the digest model
+    model: Optional[str] = None
+    # Longer responses are not sent for remote repair
+    max_chars: int = 20000
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "RepairConfig":
+        """Create RepairConfig from configuration dictionary"""
+        model = config.get("model")
+        return cls(
+            local=bool(config.get("local", True)),
+            remote=bool(config.get("remote", False)),
+            model=str(model) if model else None,
+            max_chars=max(0, int(config.get("max_chars", 20000))),
+        )
+
+
+def get_repair_config() -> RepairConfig:
+    """Returns the malformed output repair configuration."""
+    from config import get_repair_settings
+
+    try:
+        return RepairConfig.from_config(get_repair_settings())
+    except (TypeError, ValueError):
+        return RepairConfig()
+
+
+def extract_block(content: str, output_format: str) -> str:
+    """The code-fenced part of content, without the prose around it.
+
+    A fence labelled with output_format wins over other fences; a fence
+    left open by a truncated response runs to the end of the text.
+    """
+    blocks = _FENCE.findall(content)
+    if not blocks:
+        return content.strip()
+    for language, body in blocks:
+        if language.lower() == output_format:
+            return body.strip()
+    return blocks[0][1].strip()
+
+
+def _scan_json(text: str) -> Tuple[str, List[str], List[Tuple[int, List[str]]]]:
+    """Copy the first JSON value in text, dropping trailing commas.
+
+    Returns:
+        Tuple: The copied text, the brackets still open at its end, and for
+        every comma between values its position and the brackets open there
+    """
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("No JSON object or array found")
+
+    out: List[str] = []
+    stack: List[str] = []
+    commas: List[Tuple[int, List[str]]] = []
+    in_string = escaped = False
+    start = min(starts)
+    for char in text[start:]:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(char)
+        elif char in "}]":
+            opener = "{" if char == "}" else "["
+            if opener not in stack:
+                continue  # Stray closer
+            # A trailing comma before the closer
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                commas.pop()
+            # Close whatever was left open inside, then this bracket
+            while stack[-1] != opener:
+                out.append(_CLOSERS[stack.pop()])
+            stack.pop()
+            out.append(char)
+            if not stack:
+                return "".join(out), [], commas
+            continue
+        elif char == ",":
+            commas.append((len(out), list(stack)))
+        out.append(char)
+
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+    return "".join(out), stack, commas
+
+
+def repair_json(content: str) -> Any:
+    """Parse JSON that is wrapped in prose, has trailing commas or was cut off.
+
+    Raises:
+        ValueError: If no JSON value can be recovered
+    """
+    text, stack, commas = _scan_json(extract_block(content, "json"))
+
+    def close(body: str, open_brackets: List[str]) -> Any:
+        body = body.rstrip().rstrip(",")
+        if body.endswith(":"):
+            body += " null"
+        closing = "".join(_CLOSERS[opener] for opener in reversed(open_brackets))
+        return json.loads(body + closing, strict=False)
+
+    try:
+        return close(text, stack)
+    except json.JSONDecodeError:
+        pass
+    # The value after the last comma was cut off mid-way: drop it
+    for position, open_brackets in reversed(commas[-_MAX_JSON_CUTS:]):
+        try:
+            return close(text[:position], open_brackets)
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("Could not repair JSON")
+
+
+def _quote_yaml_value(line: str) -> str:
+    match = _YAML_ENTRY.match(line)
+    if not match:
+        return line
+    prefix, value = match.groups()
+    if value[0] in "\"'{[|>&*!" or not _YAML_PLAIN_UNSAFE.search(value):
+        return line
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'{prefix}"{escaped}"'
+
+
+def repair_yaml(content: str) -> Any:
+    """Parse YAML that is wrapped in prose, indented with tabs or under-quoted.
+
+    Raises:
+        ValueError: If the YAML cannot be recovered
+    """
+    lines = extract_block(content, "yaml").splitlines()
+    # Prose before the first mapping key or list item
+    for index, line in enumerate(lines):
+        if _YAML_KEY_LINE.match(line):
+            lines = lines[index:]
+            break
+
+    lines = [re.sub(r"^\t+", lambda m: "  " * len(m.group()), line) for line in lines]
+    for candidate in (lines, [_quote_yaml_value(line) for line in lines]):
+        try:
+            document = yaml.safe_load("\n".join(candidate))
+        except yaml.YAMLError:
+            continue
+        # Anything else means the text was prose, not a document
+        if isinstance(document, (dict, list)):
+            return document
+    raise ValueError("Could not repair YAML")
+
+
+def repair_xml(content: str) -> ET.Element:
+    """Parse XML with unclosed tags or bare ampersands using lxml's recovery.
+
+    Raises:
+        ValueError: If no element can be recovered
+    """
+    text = extract_block(content, "xml")
+    start = text.find("<")
+    if start < 0:
+        raise ValueError("No XML element found")
+    # Text after the root element is ignored by the recovering parser
+    text = _BARE_AMPERSAND.sub("&amp;", text[start:])
+
+    try:
+        from lxml import etree
+    except ImportError as e:
+        raise ValueError("XML repair requires lxml") from e
+
+    parser = etree.XMLParser(
+        recover=True, resolve_entities=False, no_network=True, remove_comments=True
+    )
+    root = etree.fromstring(text.encode("utf-8"), parser)
+    if root is None:
+        raise ValueError("Could not repair XML")
+    return ET.fromstring(etree.tostring(root, encoding="unicode"))
+
+
+def repair_document(content: str, output_format: str) -> Any:
+    """Parse malformed content in output_format (json, yaml or xml).
+
+    Returns:
+        Any: The parsed data, or an Element for XML
+
+    Raises:
+        ValueError: If the content cannot be repaired
+    """
+    if output_format == "json":
+        return repair_json(content)
+    if output_format == "yaml":
+        return repair_yaml(content)
+    if output_format == "xml":
+        return repair_xml(content)
+    raise ValueError(f"Cannot repair '{output_format}' content")
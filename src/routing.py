@@ -0,0 +1,481 @@
+"""Latency-aware routing of requests across several models.
+
+With `--model auto`, every image goes to one of the models listed under
+`routing.models`. For each model the router keeps smoothed statistics of its
+recent latency, its latency per hour of the day, and its error rate, and
+persists them, so later runs start from what earlier runs observed. Each
+image is sent to the model that is expected to answer fastest given the
+requests it already has in flight, among the models that are healthy: not
+cooling down after a throttled request, with quota left and without a high
+error rate. A throttled request is retried on the next model.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from model import Model
+from providers.concurrency import is_overload_error
+from ratelimit import QuotaExceededError, get_rate_limiter
+from usage import TEXT_ONLY, Usage, collect
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+AUTO_MODEL = "auto"
+
+# Seconds between saves of the statistics while a run is going
+_SAVE_INTERVAL = 30.0
+
+# Seconds a model's remaining quota is trusted before the ledger is read again
+_QUOTA_CHECK_INTERVAL = 5.0
+
+T = TypeVar("T")
+
+
+@dataclass
+class RoutingConfig:
+    """Dataclass for model routing settings."""
+
+    # Names (from available_models) of the models to route between
+    models: List[str] = field(default_factory=list)
+    # Weight of each new latency or error observation in the averages
+    smoothing: float = 0.2
+    # Seconds for an error rate to halve once a model stops failing
+    error_half_life: float = 3600.0
+    # Models with a higher error rate get no traffic
+    max_error_rate: float = 0.5
+    # Seconds a throttled model gets no traffic, unless it says otherwise
+    cooldown: float = 300.0
+    # Recent latency older than this gives way to the hour-of-day latency
+    stale_after: float = 1800.0
+    # Share of images sent to a random healthy model to keep stats fresh
+    explore: float = 0.05
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "RoutingConfig":
+        """Create RoutingConfig from configuration dictionary"""
+        models = config.get("models") or []
+        if isinstance(models, str):
+            models = [models]
+        return cls(
+            models=[str(name) for name in models],
+            smoothing=min(1.0, max(0.01, float(config.get("smoothing", 0.2)))),
+            error_half_life=max(1.0, float(config.get("error_half_life", 3600))),
+            max_error_rate=min(1.0, max(0.0, float(config.get("max_error_rate", 0.5)))),
+            cooldown=max(0.0, float(config.get("cooldown", 300))),
+            stale_after=max(0.0, float(config.get("stale_after", 1800))),
+            explore=min(1.0, max(0.0, float(config.get("explore", 0.05)))),
+        )
+
+
+def get_routing_config() -> RoutingConfig:
+    """Returns the model routing configuration."""
+    from config import get_routing_settings
+
+    try:
+        return RoutingConfig.from_config(get_routing_settings())
+    except (TypeError, ValueError):
+        return RoutingConfig()
+
+
+def is_throttle_error(error: BaseException) -> bool:
+    """Check whether an error means the model cannot take requests right now."""
+    return isinstance(error, QuotaExceededError) or is_overload_error(error)
+
+
+@dataclass
+class ModelStats:
+    """Smoothed performance observations of one model."""
+
+    # Seconds per successful request
+    latency: Optional[float] = None
+    # Share of failed requests, decaying while the model is not used
+    error_rate: float = 0.0
+    samples: int = 0
+    # Epoch time of the last observation
+    updated: float = 0.0
+    # Epoch time until which the model is throttled
+    throttled_until: float = 0.0
+    # Hour of the day (local time, "0" to "23") -> seconds per request
+    hourly: Dict[str, float] = field(default_factory=dict)
+
+    def current_error_rate(self, now: float, half_life: float) -> float:
+        age = max(0.0, now - self.updated)
+        return self.error_rate * 0.5 ** (age / half_life)
+
+    def expected_latency(
+        self, now: float, hour: int, stale_after: float
+    ) -> Optional[float]:
+        """Latency to expect now, None while nothing is known."""
+        if now - self.updated > stale_after and str(hour) in self.hourly:
+            return self.hourly[str(hour)]
+        return self.latency
+
+    def observe(
+        self,
+        now: float,
+        hour: int,
+        config: RoutingConfig,
+        seconds: Optional[float] = None,
+        error: bool = False,
+        throttle_for: float = 0.0,
+    ) -> None:
+        weight = config.smoothing
+        error_rate = self.current_error_rate(now, config.error_half_life)
+        self.error_rate = error_rate + weight * (float(error) - error_rate)
+        if seconds is not None:
+            self.latency = _smooth(self.latency, seconds, weight)
+            key = str(hour)
+            self.hourly[key] = _smooth(self.hourly.get(key), seconds, weight)
+        if throttle_for:
+            self.throttled_until = max(self.throttled_until, now + throttle_for)
+        self.samples += 1
+        self.updated = now
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "samples": self.samples,
+            "updated": self.updated,
+            "throttled_until": self.throttled_until,
+            "hourly": self.hourly,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ModelStats":
+        latency = data.get("latency")
+        return cls(
+            latency=float(latency) if latency is not None else None,
+            error_rate=float(data.get("error_rate", 0.0)),
+            samples=int(data.get("samples", 0)),
+            updated=float(data.get("updated", 0.0)),
+            throttled_until=float(data.get("throttled_until", 0.0)),
+            hourly={
+                str(hour): float(seconds)
+                for hour, seconds in (data.get("hourly") or {}).items()
+            },
+        )
+
+
+def _smooth(average: Optional[float], value: float, weight: float) -> float:
+    return value if average is None else average + weight * (value - average)
+
+
+class RoutingStats:
+    """Model statistics persisted in a JSON file shared by handmark processes.
+
+    Saving merges with the file under an advisory lock, keeping the most
+    recently updated statistics of each model.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.models: Dict[str, ModelStats] = {}
+        for name, data in self._read().items():
+            try:
+                self.models[name] = ModelStats.from_dict(data)
+            except (AttributeError, TypeError, ValueError):
+                continue  # Start over for entries that do not parse
+        self._changed = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(self.path.with_suffix(".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, name: str) -> ModelStats:
+        if name not in self.models:
+            self.models[name] = ModelStats()
+        return self.models[name]
+
+    def changed(self, name: str) -> None:
+        self._changed.add(name)
+
+    def save(self) -> None:
+        """Write the statistics that changed since the last save."""
+        if not self._changed:
+            return
+        with self._locked():
+            data = self._read()
+            for name in self._changed:
+                stats = self.models[name]
+                stored = data.get(name)
+                # Keep what another process observed more recently
+                if (
+                    isinstance(stored, dict)
+                    and stored.get("updated", 0) > stats.updated
+                ):
+                    continue
+                data[name] = stats.to_dict()
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            self._changed.clear()
+
+
+class ModelRouter:
+    """Picks the model for each request from rolling performance statistics.
+
+    Args:
+        models: Models to route between, in order of preference on ties
+        config: Routing settings
+        stats: Statistics to start from and update
+    """
+
+    def __init__(
+        self,
+        models: List[Model],
+        config: Optional[RoutingConfig] = None,
+        stats: Optional[RoutingStats] = None,
+    ):
+        if not models:
+            raise ValueError("No models to route between")
+        self.models = models
+        self.config = config or RoutingConfig()
+        self.stats = stats or RoutingStats(_stats_path())
+        self.in_flight: Dict[str, int] = {model.name: 0 for model in models}
+        self.routed: Dict[str, int] = {model.name: 0 for model in models}
+        self._lock = threading.Lock()
+        self._saved = time.monotonic()
+        # Model name -> (monotonic time of the check, whether quota was left)
+        self._quota: Dict[str, Tuple[float, bool]] = {}
+
+    def _has_quota(self, model: Model) -> bool:
+        """Whether model's quota had requests left when last checked.
+
+        Reading the quota ledger takes a file lock, so it is read at most
+        every few seconds per model, and never under the router's lock.
+        """
+        checked = self._quota.get(model.name)
+        if (
+            checked is not None
+            and time.monotonic() - checked[0] < _QUOTA_CHECK_INTERVAL
+        ):
+            return checked[1]
+        rate_limiter = get_rate_limiter(model)
+        has_quota = rate_limiter is None or rate_limiter.remaining() > 0
+        self._quota[model.name] = (time.monotonic(), has_quota)
+        return has_quota
+
+    def _healthy(self, model: Model, now: float, has_quota: bool = True) -> bool:
+        stats = self.stats.get(model.name)
+        if stats.throttled_until > now:
+            return False
+        if (
+            stats.current_error_rate(now, self.config.error_half_life)
+            > self.config.max_error_rate
+        ):
+            return False
+        return has_quota
+
+    def _score(self, model: Model, now: float, hour: int) -> Tuple[float, int]:
+        """Expected seconds until a new request to model completes, and its
+        requests in flight to break ties."""
+        in_flight = self.in_flight[model.name]
+        latency = self.stats.get(model.name).expected_latency(
+            now, hour, self.config.stale_after
+        )
+        if latency is None:
+            return 0.0, in_flight  # Try unknown models first
+        return latency * (1 + in_flight), in_flight
+
+    def choose(self, exclude: List[str] = ()) -> Optional[Model]:
+        """The model for the next request, None if every model is excluded.
+
+        When no model is healthy, the one that should recover first is used.
+        """
+        now = time.time()
+        hour = time.localtime(now).tm_hour
+        candidates = [model for model in self.models if model.name not in exclude]
+        if not candidates:
+            return None
+        quota = {model.name: self._has_quota(model) for model in candidates}
+        with self._lock:
+            healthy = [
+                model
+                for model in candidates
+                if self._healthy(model, now, quota[model.name])
+            ]
+            if not healthy:
+                model = min(
+                    candidates,
+                    key=lambda m: (
+                        self.stats.get(m.name).throttled_until,
+                        self.stats.get(m.name).current_error_rate(
+                            now, self.config.error_half_life
+                        ),
+                    ),
+                )
+            elif random.random() < self.config.explore:
+                model = random.choice(healthy)
+            else:
+                model = min(healthy, key=lambda m: self._score(m, now, hour))
+            self.in_flight[model.name] += 1
+            return model
+
+    def observe(
+        self, model: Model, usages: List[Usage], error: Optional[Exception] = None
+    ) -> None:
+        """Update model's statistics after a request chosen by choose()."""
+        now = time.time()
+        images = [usage for usage in usages if usage.detail != TEXT_ONLY]
+        seconds = images[-1].seconds if images and error is None else None
+        throttle_for = 0.0
+        if error is not None and is_throttle_error(error):
+            throttle_for = getattr(error, "retry_after", None) or self.config.cooldown
+
+        with self._lock:
+            self.in_flight[model.name] -= 1
+            # Cache hits say nothing about the model
+            if error is None and seconds is None:
+                return
+            self.routed[model.name] += 1
+            stats = self.stats.get(model.name)
+            stats.observe(
+                now,
+                time.localtime(now).tm_hour,
+                self.config,
+                seconds=seconds,
+                error=error is not None,
+                throttle_for=throttle_for,
+            )
+            self.stats.changed(model.name)
+            save = time.monotonic() - self._saved > _SAVE_INTERVAL
+            if save:
+                self._saved = time.monotonic()
+        if save:
+            self.save()
+
+    @contextmanager
+    def track(self, model: Model):
+        """Observe the requests made to model, chosen by choose(), in the block."""
+        with collect() as usages:
+            try:
+                yield
+            except Exception as e:
+                self.observe(model, usages, e)
+                raise
+        self.observe(model, usages)
+
+    def _retry_elsewhere(self, tried: List[str], error: Exception) -> bool:
+        """Whether a failed request should move on to another model."""
+        return is_throttle_error(error) and len(tried) < len(self.models)
+
+    def request(self, send: Callable[[Model], T]) -> T:
+        """Call send with the chosen model, moving on to the next model
+        while the chosen one is throttled."""
+        tried: List[str] = []
+        while True:
+            model = self.choose(exclude=tried)
+            tried.append(model.name)
+            try:
+                with self.track(model):
+                    return send(model)
+            except Exception as e:
+                if not self._retry_elsewhere(tried, e):
+                    raise
+
+    async def arequest(self, send: Callable[[Model], Awaitable[T]]) -> T:
+        """Async variant of request."""
+        tried: List[str] = []
+        while True:
+            model = self.choose(exclude=tried)
+            tried.append(model.name)
+            try:
+                with self.track(model):
+                    return await send(model)
+            except Exception as e:
+                if not self._retry_elsewhere(tried, e):
+                    raise
+
+    def max_image_edge(self, preprocess) -> Optional[int]:
+        """Longest image edge every routed model accepts, None for no limit."""
+        edges = [preprocess.max_edge_for(model) for model in self.models]
+        return None if None in edges else max(edges)
+
+    def save(self) -> None:
+        """Persist the statistics for later runs."""
+        try:
+            with self._lock:
+                self.stats.save()
+        except OSError:
+            pass  # Statistics are an optimization; never fail a run over them
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Current statistics and routed requests of every model."""
+        now = time.time()
+        hour = time.localtime(now).tm_hour
+        rows = []
+        for model in self.models:
+            stats = self.stats.get(model.name)
+            latency = stats.expected_latency(now, hour, self.config.stale_after)
+            rows.append(
+                {
+                    "model": model.name,
+                    "requests": self.routed[model.name],
+                    "healthy": self._healthy(model, now, self._has_quota(model)),
+                    "latency": None if latency is None else round(latency, 3),
+                    "error_rate": round(
+                        stats.current_error_rate(now, self.config.error_half_life), 3
+                    ),
+                    "throttled_for": round(max(0.0, stats.throttled_until - now), 1),
+                    "samples": stats.samples,
+                }
+            )
+        return rows
+
+
+def _stats_path() -> Path:
+    from config import get_config_dir
+
+    return get_config_dir() / "routing.json"
+
+
+def get_router(config: Optional[RoutingConfig] = None) -> ModelRouter:
+    """Router between the models listed under `routing.models`.
+
+    Raises:
+        ValueError: If no models are listed, or a listed model is unknown
+    """
+    from model import get_available_models
+
+    config = config or get_routing_config()
+    if not config.models:
+        raise ValueError(
+            "No models to route between. List model names from "
+            "available_models under routing.models in config.yaml."
+        )
+    available = {model.name: model for model in get_available_models()}
+    unknown = [name for name in config.models if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown model(s) under routing.models: {', '.join(unknown)}")
+    return ModelRouter([available[name] for name in config.models], config)
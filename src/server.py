@@ -0,0 +1,451 @@
+"""Local HTTP API for `handmark serve`.
+
+`POST /digest?format=markdown` takes an image, either as the body of the
+request (with an image Content-Type) or as a multipart/form-data upload, and
+answers with the document. Several comma-separated formats are derived from
+one model request and returned together as JSON. `GET /health` reports the
+server state without calling the model.
+
+Requests are handed to a bounded worker pool that lives as long as the
+server, so provider clients, configuration and the response cache stay warm.
+Requests beyond the workers plus the queue limit are refused with 503.
+"""
+
+import io
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from email.parser import BytesParser
+from email.policy import HTTP
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from batch import IMAGE_EXTENSIONS
+from cache import ResponseCache
+from dissector import CANONICAL_FORMAT, ContentFormatter, ImageDissector
+from model import Model
+from preprocess import PreprocessConfig, preprocess_image
+from ratelimit import QuotaExceededError, RateLimiter
+from transcript import Transcript, parse_formats
+
+CONTENT_TYPES = {
+    "markdown": "text/markdown; charset=utf-8",
+    "json": "application/json; charset=utf-8",
+    "yaml": "application/yaml; charset=utf-8",
+    "xml": "application/xml; charset=utf-8",
+}
+
+_IMAGE_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/bmp": ".bmp",
+    "image/tiff": ".tiff",
+    "image/webp": ".webp",
+}
+
+
+@dataclass
+class ServerConfig:
+    """Dataclass for HTTP server settings."""
+
+    host: str = "127.0.0.1"
+    port: int = 8765
+    queue_size: int = 16
+    max_upload_mb: float = 20
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ServerConfig":
+        """Create ServerConfig from configuration dictionary"""
+        return cls(
+            host=str(config.get("host", "127.0.0.1")),
+            port=int(config.get("port", 8765)),
+            queue_size=max(0, int(config.get("queue_size", 16))),
+            max_upload_mb=float(config.get("max_upload_mb", 20)),
+        )
+
+    @property
+    def max_upload_bytes(self) -> int:
+        return int(self.max_upload_mb * 1024 * 1024)
+
+
+def get_server_config() -> ServerConfig:
+    """Returns the HTTP server configuration."""
+    from config import get_server_settings
+
+    return ServerConfig.from_config(get_server_settings())
+
+
+class ServerBusyError(RuntimeError):
+    """Raised when every worker is busy and the queue is full."""
+
+
+class RequestError(ValueError):
+    """A request the client has to fix; answered with its HTTP status."""
+
+    def __init__(self, status: HTTPStatus, message: str):
+        self.status = status
+        super().__init__(message)
+
+
+@dataclass
+class DigestOutput:
+    """Documents rendered for one uploaded image."""
+
+    stem: str
+    # Output format and processed content per requested format
+    documents: List[Tuple[str, str]]
+
+
+class DigestService:
+    """Turns uploaded images into documents on a bounded worker pool."""
+
+    def __init__(
+        self,
+        model: Model,
+        workers: int,
+        queue_size: int,
+        cache: Optional[ResponseCache] = None,
+        preprocess: Optional[PreprocessConfig] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.model = model
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_size)
+        self.cache = cache
+        self.preprocess = preprocess
+        self.rate_limiter = rate_limiter
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="handmark-serve"
+        )
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._active = 0
+        self._lock = threading.Lock()
+        self._work_dir = tempfile.TemporaryDirectory(prefix="handmark-serve-")
+
+    def submit(self, data: bytes, extension: str, formats: List[str]) -> Future:
+        """Queue an image for processing.
+
+        Raises:
+            ServerBusyError: If the workers and the queue are all taken
+        """
+        if not self._slots.acquire(blocking=False):
+            raise ServerBusyError(
+                f"Server is at capacity ({self.capacity} requests); retry later."
+            )
+        with self._lock:
+            self._active += 1
+        future = self._executor.submit(self._process, data, extension, formats)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _: Future) -> None:
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+    def _process(self, data: bytes, extension: str, formats: List[str]) -> DigestOutput:
+        fd, image_path = tempfile.mkstemp(suffix=extension, dir=self._work_dir.name)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+        upload_path = image_path
+        try:
+            if self.preprocess is not None and self.preprocess.enabled:
+                upload_path = self._preprocess(image_path, data)
+
+            derived = len(formats) > 1
+            dissector = ImageDissector(
+                image_path=upload_path,
+                model=self.model,
+                output_format=CANONICAL_FORMAT if derived else formats[0],
+                cache=self.cache,
+                rate_limiter=self.rate_limiter,
+            )
+            response = dissector.get_response()
+        finally:
+            for path in {image_path, upload_path}:
+                os.unlink(path)
+
+        if derived:
+            transcript = Transcript(content=response, model=self.model.name)
+            stem, files = transcript.render_all(formats, "document")
+            documents = [(fmt, content) for fmt, (_, content) in zip(formats, files)]
+            return DigestOutput(stem=stem, documents=documents)
+
+        formatter = ContentFormatter(formats[0])
+        extension = formatter.format_config.file_extension
+        filename, content = formatter.render(response, f"document{extension}")
+        return DigestOutput(
+            stem=os.path.splitext(filename)[0], documents=[(formats[0], content)]
+        )
+
+    def _preprocess(self, image_path: str, data: bytes) -> str:
+        """Preprocess an upload, blaming the client for images that do not decode."""
+        from PIL import Image
+
+        try:
+            return preprocess_image(
+                image_path,
+                self.preprocess,
+                self._work_dir.name,
+                self.preprocess.max_edge_for(self.model),
+                data,
+            )
+        except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+            # Pillow's decoding errors carry no errno, file system errors do
+            if getattr(e, "errno", None) is not None:
+                raise
+            raise RequestError(
+                HTTPStatus.UNPROCESSABLE_ENTITY, f"The image could not be decoded: {e}"
+            ) from e
+
+    def health(self) -> Dict[str, Any]:
+        """Server state; never calls the model."""
+        with self._lock:
+            active = self._active
+        health = {
+            "status": "ok",
+            "model": self.model.name,
+            "provider": self.model.provider_type,
+            "workers": self.workers,
+            "in_flight": min(active, self.workers),
+            "queued": max(0, active - self.workers),
+            "capacity": self.capacity,
+        }
+        if self.rate_limiter is not None:
+            health["remaining_quota"] = self.rate_limiter.remaining()
+        return health
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._work_dir.cleanup()
+
+
+def _extension_for(filename: Optional[str], content_type: Optional[str]) -> str:
+    """Image file extension from an upload's filename or Content-Type."""
+    if filename:
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in IMAGE_EXTENSIONS:
+            return extension
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in _IMAGE_TYPES:
+        return _IMAGE_TYPES[media_type]
+    raise RequestError(
+        HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+        "Upload an image (JPEG, PNG, GIF, BMP, TIFF or WebP).",
+    )
+
+
+def _request_formats(query: str) -> List[str]:
+    """Output formats named by the `format` query parameter.
+
+    Raises:
+        RequestError: If a format is unknown
+    """
+    try:
+        return parse_formats(parse_qs(query).get("format", ["markdown"])[0])
+    except ValueError as e:
+        raise RequestError(HTTPStatus.BAD_REQUEST, str(e)) from e
+
+
+def check_image(data: bytes) -> None:
+    """Make sure an upload is an image Pillow can read, from its header.
+
+    Raises:
+        RequestError: If the data is not a readable image
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(data)):
+            pass
+    except (UnidentifiedImageError, OSError):
+        raise RequestError(
+            HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+            "The upload is not a readable image.",
+        )
+
+
+def parse_upload(content_type: str, body: bytes) -> Tuple[bytes, str]:
+    """Extract the image and its file extension from a request body.
+
+    Raises:
+        RequestError: If the body holds no supported image
+    """
+    if not content_type.lower().startswith("multipart/form-data"):
+        return body, _extension_for(None, content_type)
+
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+    )
+    if not message.is_multipart():
+        raise RequestError(HTTPStatus.BAD_REQUEST, "Malformed multipart body.")
+
+    # The 'image' field, or else the first uploaded file
+    files = [part for part in message.iter_parts() if part.get_filename()]
+    if not files:
+        raise RequestError(HTTPStatus.BAD_REQUEST, "No file in the multipart upload.")
+    part = next(
+        (
+            part
+            for part in files
+            if part.get_param("name", header="content-disposition") == "image"
+        ),
+        files[0],
+    )
+    return (
+        part.get_payload(decode=True) or b"",
+        _extension_for(part.get_filename(), part.get_content_type()),
+    )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "handmark"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self) -> DigestService:
+        return self.server.service
+
+    def _send(
+        self,
+        status: HTTPStatus,
+        body: bytes,
+        content_type: str,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(
+        self, status: HTTPStatus, data: Any, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self._send(status, body, CONTENT_TYPES["json"], headers)
+
+    def _send_error(
+        self,
+        status: HTTPStatus,
+        message: str,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self._send_json(status, {"error": message}, headers)
+
+    def do_GET(self):
+        if urlsplit(self.path).path.rstrip("/") == "/health":
+            self._send_json(HTTPStatus.OK, self.service.health())
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "Not found.")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/digest":
+            self._send_error(HTTPStatus.NOT_FOUND, "Not found.")
+            return
+
+        try:
+            formats = _request_formats(url.query)
+            data, extension = self._read_upload()
+            if not data:
+                raise RequestError(HTTPStatus.BAD_REQUEST, "The image is empty.")
+            check_image(data)
+            output = self.service.submit(data, extension, formats).result()
+        except RequestError as e:
+            self._send_error(e.status, str(e))
+        except ServerBusyError as e:
+            self._send_error(
+                HTTPStatus.SERVICE_UNAVAILABLE, str(e), {"Retry-After": "1"}
+            )
+        except QuotaExceededError as e:
+            self._send_error(
+                HTTPStatus.TOO_MANY_REQUESTS,
+                str(e),
+                {"Retry-After": str(max(1, int(e.retry_after)))},
+            )
+        except TimeoutError as e:
+            self._send_error(HTTPStatus.GATEWAY_TIMEOUT, str(e))
+        except (ConnectionError, RuntimeError) as e:
+            self._send_error(HTTPStatus.BAD_GATEWAY, str(e))
+        except ValueError as e:
+            # Providers raise errors the service answered (authentication,
+            # unknown model) from the SDK error; the others are this
+            # server's configuration
+            upstream = e.__cause__ is not None
+            self._send_error(
+                (
+                    HTTPStatus.BAD_GATEWAY
+                    if upstream
+                    else HTTPStatus.INTERNAL_SERVER_ERROR
+                ),
+                str(e),
+            )
+        except Exception as e:
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+        else:
+            self._send_output(output)
+
+    def _read_upload(self) -> Tuple[bytes, str]:
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            raise RequestError(HTTPStatus.LENGTH_REQUIRED, "Content-Length required.")
+        if length < 0:
+            self.close_connection = True
+            raise RequestError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.")
+        if length > self.server.max_upload_bytes:
+            # The body is not read, so the connection cannot be reused
+            self.close_connection = True
+            raise RequestError(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                f"Upload exceeds {self.server.max_upload_bytes} bytes.",
+            )
+        body = self.rfile.read(length)
+        return parse_upload(self.headers.get("Content-Type", ""), body)
+
+    def _send_output(self, output: DigestOutput) -> None:
+        if len(output.documents) > 1:
+            self._send_json(
+                HTTPStatus.OK,
+                {"filename": output.stem, "documents": dict(output.documents)},
+            )
+            return
+
+        output_format, content = output.documents[0]
+        extension = ContentFormatter(output_format).format_config.file_extension
+        self._send(
+            HTTPStatus.OK,
+            (content or "").encode("utf-8"),
+            CONTENT_TYPES[output_format],
+            {"Content-Disposition": (f'inline; filename="{output.stem}{extension}"')},
+        )
+
+    def log_message(self, format: str, *args) -> None:
+        from utils import console
+
+        console.print(f"[dim]{self.address_string()} {format % args}[/dim]")
+
+
+class DigestServer(ThreadingHTTPServer):
+    """HTTP server answering every request from one DigestService."""
+
+    daemon_threads = True
+    # Overload is answered with 503, not refused by a short listen backlog
+    request_queue_size = 128
+
+    def __init__(
+        self, address: Tuple[str, int], service: DigestService, max_upload_bytes: int
+    ):
+        self.service = service
+        self.max_upload_bytes = max_upload_bytes
+        super().__init__(address, _Handler)
@@ -0,0 +1,302 @@
+"""Raw model transcripts that can be rendered into any output format.
+
+When several output formats are requested at once, the model is asked a
+single time for a canonical JSON document (title, content, sections and a
+complete Markdown transcription). Every requested format is derived from it
+locally, and the raw response is kept next to the outputs so that
+`handmark reformat` can render further formats without another model call.
+"""
+
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from dissector import ContentFormatter, DigestResult
+from profiling import traced
+
+OUTPUT_FORMATS = ["markdown", "json", "yaml", "xml"]
+
+TRANSCRIPT_SUFFIX = ".transcript.json"
+TRANSCRIPT_VERSION = 1
+
+# Only used by the Markdown rendering; the structured formats carry the
+# document without it
+_MARKDOWN_KEY = "markdown"
+
+
+def parse_formats(value: str) -> List[str]:
+    """Parse a comma-separated list of output formats.
+
+    Raises:
+        ValueError: If the list is empty or names an unknown format
+    """
+    formats: List[str] = []
+    for name in value.split(","):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in OUTPUT_FORMATS:
+            raise ValueError(
+                f"Invalid format '{name}'. Valid formats: {', '.join(OUTPUT_FORMATS)}"
+            )
+        if name not in formats:
+            formats.append(name)
+
+    if not formats:
+        raise ValueError(
+            f"No output format given. Valid formats: {', '.join(OUTPUT_FORMATS)}"
+        )
+    return formats
+
+
+def transcript_stem(path: str) -> str:
+    """Strip the transcript suffix from a file name."""
+    name = os.path.basename(path)
+    if name.endswith(TRANSCRIPT_SUFFIX):
+        return name[: -len(TRANSCRIPT_SUFFIX)]
+    return os.path.splitext(name)[0]
+
+
+def _xml_tag(name: str) -> str:
+    """Turn a dictionary key into a valid XML element name."""
+    tag = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(name)).strip("_") or "item"
+    if not (tag[0].isalpha() or tag[0] == "_"):
+        tag = f"_{tag}"
+    return tag
+
+
+def _append_xml(parent: ET.Element, tag: str, value: Any) -> None:
+    element = ET.SubElement(parent, _xml_tag(tag))
+    if isinstance(value, dict):
+        for key, child in value.items():
+            _append_xml(element, key, child)
+    elif isinstance(value, list):
+        # <sections><section>...</section></sections>
+        item_tag = tag[:-1] if len(tag) > 1 and tag.endswith("s") else "item"
+        for child in value:
+            _append_xml(element, item_tag, child)
+    elif value is not None:
+        element.text = str(value)
+
+
+def _section_markdown(section: Any) -> List[str]:
+    if not isinstance(section, dict):
+        return [f"- {section}"]
+
+    lines = []
+    heading = section.get("heading") or section.get("title")
+    if heading:
+        lines += [f"## {heading}", ""]
+    body = section.get("content")
+    if isinstance(body, list):
+        lines += [f"- {item}" for item in body]
+    elif body:
+        lines.append(str(body))
+    for item in section.get("items") or []:
+        lines.append(f"- {item}")
+    return lines
+
+
+@dataclass
+class Transcript:
+    """A raw canonical model response plus where it came from."""
+
+    content: str
+    model: Optional[str] = None
+    source: Optional[str] = None
+    created_at: Optional[str] = None
+
+    # Parsed canonical document and the content it was parsed from
+    _parsed: Optional[Tuple[str, Optional[Dict[str, Any]]]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        if self.created_at is None:
+            self.created_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    def document(self) -> Optional[Dict[str, Any]]:
+        """The parsed canonical document, or None if the model broke the schema.
+
+        The content is parsed once, however many formats are rendered.
+        """
+        if self._parsed is not None and self._parsed[0] is self.content:
+            return self._parsed[1]
+
+        formatter = ContentFormatter("json")
+        try:
+            document = formatter._parse_document(self.content)
+        except ValueError:
+            try:
+                document = formatter._repair_document(self.content)
+            except ValueError:
+                document = None
+        if not isinstance(document, dict):
+            document = None
+        self._parsed = (self.content, document)
+        return document
+
+    def digest(self, output_format: str) -> DigestResult:
+        """The transcript in one output format, built from the parsed document."""
+        formatter = ContentFormatter(output_format)
+        output_format = formatter.output_format
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{output_format}'.")
+
+        document = self.document()
+        if document is None:
+            # Not the JSON we asked for: pass the text through unchanged
+            return formatter.parse(self.content)
+
+        if output_format == "markdown":
+            return formatter.parse(self._markdown(document))
+
+        data = {k: v for k, v in document.items() if k != _MARKDOWN_KEY}
+        if output_format == "xml":
+            root = ET.Element("document")
+            for key, value in data.items():
+                _append_xml(root, key, value)
+            return formatter.from_document(root, self.content)
+        return formatter.from_document(data, self.content)
+
+    @staticmethod
+    def _markdown(document: Dict[str, Any]) -> str:
+        markdown = document.get(_MARKDOWN_KEY)
+        if isinstance(markdown, str) and markdown.strip():
+            return markdown.strip() + "\n"
+
+        # Build Markdown from the structured fields instead
+        lines = []
+        if document.get("title"):
+            lines += [f"# {document['title']}", ""]
+        if document.get("content"):
+            lines += [str(document["content"]), ""]
+        for section in document.get("sections") or []:
+            lines += _section_markdown(section) + [""]
+        return "\n".join(lines).strip() + "\n"
+
+    @traced("format")
+    def render(
+        self, output_format: str, fallback_filename: str = None
+    ) -> Tuple[str, str]:
+        """Render the transcript in one output format.
+
+        Returns:
+            Tuple[str, str]: Output filename and processed content
+        """
+        result = self.digest(output_format)
+        formatter = ContentFormatter(result.output_format)
+        return formatter.filename_for(result, fallback_filename), result.content
+
+    def render_all(
+        self, output_formats: List[str], fallback_stem: str = None
+    ) -> Tuple[str, List[Tuple[str, str]]]:
+        """Render the transcript in several formats under one shared file stem.
+
+        The stem is derived from the content of the first format, so that
+        e.g. `notes.md` and `notes.json` always belong together.
+
+        Returns:
+            Tuple[str, List[Tuple[str, str]]]: The file stem, and the file
+            extension and processed content per format
+        """
+        stem = None
+        outputs = []
+        for output_format in output_formats:
+            extension = ContentFormatter(output_format).format_config.file_extension
+            if stem is None:
+                fallback = f"{fallback_stem}{extension}" if fallback_stem else None
+                filename, content = self.render(output_format, fallback)
+                stem = (
+                    filename[: -len(extension)]
+                    if extension and filename.endswith(extension)
+                    else os.path.splitext(filename)[0]
+                )
+            else:
+                _, content = self.render(output_format)
+            outputs.append((extension, content))
+        return stem or fallback_stem or "response", outputs
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": TRANSCRIPT_VERSION,
+            "model": self.model,
+            "source": self.source,
+            "created_at": self.created_at,
+            "content": self.content,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Transcript":
+        if not isinstance(data, dict) or not isinstance(data.get("content"), str):
+            raise ValueError("Not a handmark transcript: missing 'content'.")
+        return cls(
+            content=data["content"],
+            model=data.get("model"),
+            source=data.get("source"),
+            created_at=data.get("created_at"),
+        )
+
+    def save(self, path: str) -> str:
+        """Write the transcript to path."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "Transcript":
+        """Read a transcript written by save().
+
+        Raises:
+            ValueError: If the file is not a transcript
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Not a handmark transcript: {e}") from e
+        return cls.from_dict(data)
+
+
+@traced("write")
+def write_outputs(
+    transcript: Transcript,
+    output_formats: List[str],
+    dest_path: str,
+    fallback_stem: str = None,
+    keep_transcript: bool = True,
+    stem: str = None,
+) -> List[str]:
+    """Render a transcript into dest_path, optionally saving it alongside.
+
+    Args:
+        transcript: Transcript to render
+        output_formats: Formats to write
+        dest_path: Directory where the files are written
+        fallback_stem: File stem used when none can be derived from the content
+        keep_transcript: Also save the transcript itself
+        stem: File stem to use instead of deriving one from the content
+
+    Returns:
+        List[str]: Paths of the written files, transcript last
+    """
+    os.makedirs(dest_path, exist_ok=True)
+    derived_stem, outputs = transcript.render_all(output_formats, fallback_stem)
+    stem = stem or derived_stem
+
+    written = []
+    for extension, content in outputs:
+        full_output_path = os.path.join(dest_path, f"{stem}{extension}")
+        with open(full_output_path, "w", encoding="utf-8") as f:
+            f.write(content if content else "")
+        written.append(full_output_path)
+
+    if keep_transcript:
+        written.append(
+            transcript.save(os.path.join(dest_path, f"{stem}{TRANSCRIPT_SUFFIX}"))
+        )
+    return written
@@ -0,0 +1,192 @@
+"""Token usage and timing of model requests.
+
+Providers report every request they complete with `record()`: prompt and
+completion tokens as counted by the service, the request's wall time, and
+the service's own timings where it reports them (Ollama). Usage is only kept
+while `collect()` is active in the current context, which ImageDissector
+does for each image, so results carry the usage of the requests made for
+them. A UsageSummary aggregates a run into tokens per image, tokens per
+second and the cost per model, format and image detail level.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from profiling import count, summarize
+
+# Detail level of text-only requests, e.g. remote repairs
+TEXT_ONLY = "text"
+
+_current: ContextVar[Optional[List["Usage"]]] = ContextVar(
+    "handmark_usage", default=None
+)
+
+
+@dataclass
+class Usage:
+    """Tokens and time spent on one model request."""
+
+    provider: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Wall time of the request as seen by handmark, in seconds
+    seconds: Optional[float] = None
+    # Time the service reports for the whole request and for generating
+    # the completion, where it reports them
+    server_seconds: Optional[float] = None
+    generation_seconds: Optional[float] = None
+    # Image detail level sent with the request, TEXT_ONLY without an image
+    detail: str = TEXT_ONLY
+    output_format: Optional[str] = None
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def generation_time(self) -> Optional[float]:
+        """Best known time spent generating the completion."""
+        for seconds in (self.generation_seconds, self.server_seconds, self.seconds):
+            if seconds:
+                return seconds
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "format": self.output_format,
+            "detail": self.detail,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "seconds": _round(self.seconds),
+            "server_seconds": _round(self.server_seconds),
+            "generation_seconds": _round(self.generation_seconds),
+        }
+
+
+@contextmanager
+def collect() -> Iterator[List[Usage]]:
+    """Gather the usage of the requests completed in the block.
+
+    Collections nest: an enclosing collect() also receives the usage.
+    """
+    usages: List[Usage] = []
+    parent = _current.get()
+    token = _current.set(usages)
+    try:
+        yield usages
+    finally:
+        _current.reset(token)
+        if parent is not None:
+            parent.extend(usages)
+
+
+def record(usage: Usage) -> None:
+    """Report the usage of a completed request."""
+    usages = _current.get()
+    if usages is not None:
+        usages.append(usage)
+    count("prompt_tokens", usage.prompt_tokens)
+    count("completion_tokens", usage.completion_tokens)
+
+
+def tokens_per_second(usages: List[Usage]) -> Optional[float]:
+    """Completion tokens generated per second over requests with known timing."""
+    timed = [usage for usage in usages if usage.generation_time]
+    seconds = sum(usage.generation_time for usage in timed)
+    if not seconds:
+        return None
+    return sum(usage.completion_tokens for usage in timed) / seconds
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 3)
+
+
+class UsageSummary:
+    """Aggregates the usage of the images of a run."""
+
+    def __init__(self):
+        self.requests: List[Usage] = []
+        # Total tokens of every image that needed at least one request
+        self.image_tokens: List[int] = []
+
+    def add(self, usages: List[Usage]) -> None:
+        """Add the usage of one image."""
+        if usages:
+            self.requests.extend(usages)
+            self.image_tokens.append(sum(usage.total_tokens for usage in usages))
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(usage.prompt_tokens for usage in self.requests)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(usage.completion_tokens for usage in self.requests)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def tokens_per_image(self) -> Optional[float]:
+        if not self.image_tokens:
+            return None
+        return self.total_tokens / len(self.image_tokens)
+
+    def tokens_per_second(self) -> Optional[float]:
+        return tokens_per_second(self.requests)
+
+    def breakdown(self, key: Callable[[Usage], Any]) -> List[Dict[str, Any]]:
+        """Usage per value of key, most expensive first."""
+        groups: Dict[Any, List[Usage]] = {}
+        for usage in self.requests:
+            groups.setdefault(key(usage), []).append(usage)
+
+        rows = []
+        for name, usages in groups.items():
+            total = sum(usage.total_tokens for usage in usages)
+            speed = tokens_per_second(usages)
+            rows.append(
+                {
+                    "name": name,
+                    "requests": len(usages),
+                    "prompt_tokens": sum(usage.prompt_tokens for usage in usages),
+                    "completion_tokens": sum(
+                        usage.completion_tokens for usage in usages
+                    ),
+                    "total_tokens": total,
+                    "tokens_per_request": round(total / len(usages), 1),
+                    "tokens_per_second": _round(speed),
+                }
+            )
+        rows.sort(key=lambda row: row["total_tokens"], reverse=True)
+        return rows
+
+    def breakdowns(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Usage per model, output format and image detail level."""
+        return {
+            "model": self.breakdown(lambda usage: f"{usage.provider}/{usage.model}"),
+            "format": self.breakdown(lambda usage: usage.output_format),
+            "detail": self.breakdown(lambda usage: usage.detail),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        per_image = self.tokens_per_image()
+        return {
+            "images": len(self.image_tokens),
+            "requests": len(self.requests),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "tokens_per_image": None if per_image is None else round(per_image, 1),
+            "image_tokens": (
+                summarize(self.image_tokens) if self.image_tokens else None
+            ),
+            "tokens_per_second": _round(self.tokens_per_second()),
+            **self.breakdowns(),
+        }
@@ -55,11 +55,9 @@ def check_ollama_service() -> bool:
         bool: True if Ollama service is running
     """
     try:
-        import ollama
+        from providers.registry import get_provider
 
-        client = ollama.Client()
-        client.list()
-        return True
+        return get_provider("ollama").is_service_available()
     except Exception:
         return False
 
@@ -71,17 +69,9 @@ def list_ollama_models() -> List[str]:
         List[str]: List of available model names
     """
     try:
-        import ollama
-
-        client = ollama.Client()
-        response = client.list()
-        models = []
-        for model in response.get("models", []):
-            if hasattr(model, "model"):
-                models.append(model.model)
-            elif isinstance(model, dict) and "name" in model:
-                models.append(model["name"])
-        return models
+        from providers.registry import get_provider
+
+        return get_provider("ollama").get_installed_models()
     except Exception:
         return []
 
@@ -0,0 +1,337 @@
+"""Folder watching for `handmark watch`.
+
+New or changed images are picked up through inotify on Linux, or by
+polling the folder elsewhere (and on network shares, where inotify does not
+see writes made by other machines). A file is handed out only once its size
+and mtime have stopped changing for a settle period, so images a scanner is
+still writing are never processed half-finished. Processed images are
+recorded in an append-only index next to the outputs, so a restarted
+watcher skips everything it has already done.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from batch import is_image_file
+
+INDEX_FILENAME = ".handmark-watch.jsonl"
+
+# inotify event flags (see inotify(7))
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+# (size, mtime in nanoseconds) of a file
+Signature = Tuple[int, int]
+
+
+@dataclass
+class WatchConfig:
+    """Dataclass for folder watch settings."""
+
+    settle_seconds: float = 2.0
+    poll_interval: float = 2.0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "WatchConfig":
+        """Create WatchConfig from configuration dictionary"""
+        return cls(
+            settle_seconds=max(0.0, float(config.get("settle_seconds", 2.0))),
+            poll_interval=max(0.1, float(config.get("poll_interval", 2.0))),
+        )
+
+
+def get_watch_config() -> WatchConfig:
+    """Returns the folder watch configuration."""
+    from config import get_watch_settings
+
+    return WatchConfig.from_config(get_watch_settings())
+
+
+def _signature(path: Path) -> Optional[Signature]:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _scan(root: Path, recursive: bool) -> Iterator[Path]:
+    for dirpath, dirs, files in os.walk(root):
+        if not recursive:
+            dirs.clear()
+        for name in files:
+            yield Path(dirpath) / name
+
+
+class PollingWatcher:
+    """Reports files whose signature changed since the previous scan."""
+
+    def __init__(self, root: Path, recursive: bool, interval: float):
+        self.root = root
+        self.recursive = recursive
+        self.interval = interval
+        # Files already in place are reported by the initial scan instead
+        self._known: Dict[Path, Signature] = {
+            path: signature
+            for path in _scan(root, recursive)
+            if (signature := _signature(path)) is not None
+        }
+
+    def events(self, timeout: float) -> List[Path]:
+        """Wait up to timeout seconds, then return the changed files."""
+        time.sleep(min(timeout, self.interval))
+        changed = []
+        current: Dict[Path, Signature] = {}
+        for path in _scan(self.root, self.recursive):
+            signature = _signature(path)
+            if signature is None:
+                continue
+            current[path] = signature
+            if self._known.get(path) != signature:
+                changed.append(path)
+        self._known = current
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """Reports files written, created or moved into the watched folder."""
+
+    def __init__(self, root: Path, recursive: bool):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify is only available on Linux.")
+
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.root = root
+        self.recursive = recursive
+        self._dirs: Dict[int, Path] = {}
+        self._add_tree(root)
+
+    def _add_watch(self, directory: Path) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            raise OSError(
+                ctypes.get_errno(), f"Cannot watch {directory}", str(directory)
+            )
+        self._dirs[wd] = directory
+
+    def _add_tree(self, directory: Path) -> None:
+        self._add_watch(directory)
+        if not self.recursive:
+            return
+        for dirpath, dirs, _ in os.walk(directory):
+            for name in dirs:
+                self._add_watch(Path(dirpath) / name)
+
+    def events(self, timeout: float) -> List[Path]:
+        """Wait up to timeout seconds for events and return the files involved."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            end = offset + length
+            name = data[offset:end].rstrip(b"\0")
+            offset = end
+
+            if mask & _IN_Q_OVERFLOW:
+                # Events were dropped; fall back to a full rescan
+                changed.extend(_scan(self.root, self.recursive))
+                continue
+
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+
+            if mask & _IN_ISDIR:
+                if self.recursive and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # Files may have landed before the new watch was added
+                    self._add_tree(path)
+                    changed.extend(_scan(path, recursive=True))
+                continue
+            changed.append(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def create_watcher(
+    root: Path, recursive: bool, config: WatchConfig, poll: bool = False
+):
+    """An inotify watcher, or a polling watcher if inotify is unavailable."""
+    if not poll:
+        try:
+            return InotifyWatcher(root, recursive)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(root, recursive, config.poll_interval)
+
+
+class ProcessedIndex:
+    """Append-only record of the images a watcher has already processed.
+
+    An image counts as processed for one exact (size, mtime), so an image
+    that is replaced or edited is processed again. Images handed out for
+    processing are tracked until finish() so they are not queued twice.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._done: Dict[str, Signature] = {}
+        self._queued: Dict[str, Signature] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self._done[entry["path"]] = (entry["size"], entry["mtime_ns"])
+                    except (ValueError, KeyError, TypeError):
+                        continue  # Line cut short by a crash
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def begin(self, path: Path, signature: Signature) -> bool:
+        """Claim an image for processing.
+
+        Returns:
+            bool: False if the image is already processed or queued as is
+        """
+        key = os.path.realpath(path)
+        with self._lock:
+            if signature in (self._done.get(key), self._queued.get(key)):
+                return False
+            self._queued[key] = signature
+            return True
+
+    def finish(self, path: Path, success: bool) -> None:
+        """Release a claimed image, recording it as processed on success."""
+        key = os.path.realpath(path)
+        with self._lock:
+            signature = self._queued.pop(key, None)
+            if not success or signature is None:
+                return
+            self._done[key] = signature
+            entry = {"path": key, "size": signature[0], "mtime_ns": signature[1]}
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+class _Debouncer:
+    """Holds files back until they have stopped changing for `settle` seconds."""
+
+    def __init__(self, settle: float):
+        self.settle = settle
+        # Path -> [last seen signature, when it or an event last changed it]
+        self._pending: Dict[Path, list] = {}
+
+    def touch(self, path: Path, at: Optional[float] = None) -> None:
+        """Note activity on path (at=-inf for files found already in place)."""
+        at = time.monotonic() if at is None else at
+        if path in self._pending:
+            entry = self._pending[path]
+            entry[1] = max(entry[1], at)
+        else:
+            self._pending[path] = [None, at]
+
+    def ready(self) -> List[Tuple[Path, Signature]]:
+        """Pop the files that have settled, with their final signatures."""
+        now = time.monotonic()
+        settled = []
+        for path, entry in list(self._pending.items()):
+            signature = _signature(path)
+            if signature is None:
+                del self._pending[path]  # Deleted or moved away again
+                continue
+            if entry[0] is not None and signature != entry[0]:
+                entry[1] = now
+            entry[0] = signature
+            # Empty files are usually still being created
+            if signature[0] > 0 and now - entry[1] >= self.settle:
+                del self._pending[path]
+                settled.append((path, signature))
+        return settled
+
+    def __bool__(self) -> bool:
+        return bool(self._pending)
+
+
+def watch_images(
+    root: Path,
+    index: ProcessedIndex,
+    recursive: bool = False,
+    config: Optional[WatchConfig] = None,
+    poll: bool = False,
+    stop: Optional[threading.Event] = None,
+) -> Iterator[Path]:
+    """Yield images under root as they settle, forever or until stop is set.
+
+    Images already in the folder are yielded first, unless the index shows
+    they were processed in their current state. Every yielded image is
+    claimed in the index; release it with index.finish() once processed.
+    """
+    config = config or WatchConfig()
+    stop = stop or threading.Event()
+    watcher = create_watcher(root, recursive, config, poll)
+    debouncer = _Debouncer(config.settle_seconds)
+
+    for path in _scan(root, recursive):
+        if is_image_file(path):
+            debouncer.touch(path, at=float("-inf"))
+
+    try:
+        while not stop.is_set():
+            for path, signature in debouncer.ready():
+                if index.begin(path, signature):
+                    yield path
+
+            # Re-check pending files at least every settle period
+            timeout = config.settle_seconds / 2 if debouncer else 1.0
+            for path in watcher.events(max(0.1, timeout)):
+                if is_image_file(path):
+                    debouncer.touch(path)
+    finally:
+        watcher.close()
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from batch import iter_batch, run_batch_async
+from dedup import DuplicatePlan
+from model import Model
+from providers.base import BaseProvider
+
+
+class StubProvider(BaseProvider):
+    """Answers with the image's name, and fails the image named fail."""
+
+    def get_response(
+        self, image_path, system_message, user_message, model_name, payload=None
+    ):
+        if Path(image_path).stem == "fail":
+            raise RuntimeError("boom")
+        return f"# Page\n\nText of {image_path}"
+
+    def validate_configuration(self):
+        return True
+
+    def list_available_models(self):
+        return []
+
+    def is_service_available(self):
+        return True
+
+
+@pytest.fixture(autouse=True)
+def provider(mocker):
+    mocker.patch("dissector.create_provider", return_value=StubProvider())
+
+
+@pytest.fixture
+def model():
+    return Model(name="stub", pretty_name="stub", provider="ollama", rate_limit="")
+
+
+@pytest.fixture
+def images(tmp_path):
+    source = tmp_path / "images"
+    source.mkdir()
+    for name in ("a", "b", "fail", "copy"):
+        (source / f"{name}.png").write_bytes(name.encode())
+    return source
+
+
+def run_async(paths, model, dest, **options):
+    return asyncio.run(run_batch_async(paths, model, dest_path=str(dest), **options))
+
+
+def run_sync(paths, model, dest, **options):
+    return list(iter_batch(paths, model, dest_path=str(dest), **options))
+
+
+RUNNERS = pytest.mark.parametrize("run", [run_sync, run_async], ids=["sync", "async"])
+
+
+@RUNNERS
+def test_existing_files_are_kept_without_overwrite(run, model, images, tmp_path):
+    dest = tmp_path / "out"
+    dest.mkdir()
+    (dest / "page.md").write_text("mine")
+
+    [result] = run([images / "a.png"], model, dest, overwrite=False)
+
+    assert result.output_path == str(dest / "page_1.md")
+    assert (dest / "page.md").read_text() == "mine"
+
+
+@RUNNERS
+def test_inputs_are_hashed(run, model, images, tmp_path):
+    results = run(
+        [images / "a.png", images / "b.png"], model, tmp_path, hash_inputs=True
+    )
+
+    assert {result.image_path.name: result.input_hash for result in results} == {
+        "a.png": hashlib.sha256(b"a").hexdigest(),
+        "b.png": hashlib.sha256(b"b").hexdigest(),
+    }
+
+
+@RUNNERS
+def test_duplicates_link_to_outputs(run, model, images, tmp_path):
+    plan = DuplicatePlan(
+        representatives=[images / "a.png"],
+        duplicates={images / "a.png": [images / "copy.png"]},
+        link="copy",
+    )
+
+    results = run(plan.representatives, model, tmp_path, duplicates=plan)
+
+    by_name = {result.image_path.name: result for result in results}
+    assert by_name["copy.png"].duplicate_of == images / "a.png"
+    assert (tmp_path / "page_1.md").read_text() == (tmp_path / "page.md").read_text()
+
+
+@RUNNERS
+def test_duplicate_of_failed_image_is_requested(run, model, images, tmp_path):
+    plan = DuplicatePlan(
+        representatives=[images / "fail.png"],
+        duplicates={images / "fail.png": [images / "copy.png"]},
+    )
+
+    results = run(plan.representatives, model, tmp_path, duplicates=plan)
+
+    by_name = {result.image_path.name: result for result in results}
+    assert not by_name["fail.png"].success
+    assert by_name["copy.png"].success
+    assert by_name["copy.png"].duplicate_of is None
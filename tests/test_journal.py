@@ -0,0 +1,230 @@
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+from PIL import Image
+from typer.testing import CliRunner
+
+from batch import BatchResult
+from journal import (
+    JOURNAL_FILENAME,
+    STATUS_DONE,
+    STATUS_FAILED,
+    JobJournal,
+    read_journal,
+)
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for index in range(3):
+        path = tmp_path / "in" / f"page{index}.png"
+        path.parent.mkdir(exist_ok=True)
+        Image.new("RGB", (8, 8), (index * 80, 0, 0)).save(path)
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return tmp_path / "out" / JOURNAL_FILENAME
+
+
+def done(path):
+    return BatchResult(image_path=path, output_path=f"{path.stem}.md")
+
+
+def failed(path):
+    return BatchResult(image_path=path, error=RuntimeError("HTTP 503"))
+
+
+def interrupted_job(journal_path, images):
+    """A journal of a 3 image job that finished one image and failed another."""
+    journal_path.parent.mkdir(exist_ok=True)
+    journal = JobJournal(journal_path)
+    journal.start(resume=False, total=len(images))
+    journal.record(done(images[0]))
+    journal.record(failed(images[1]))
+    journal.close()
+
+
+def test_resume_skips_done_images(journal_path, images):
+    interrupted_job(journal_path, images)
+
+    state = read_journal(journal_path)
+    assert len(state.done) == 1
+    assert [state.is_done(path) for path in images] == [True, False, False]
+
+
+def test_changed_image_is_not_done(journal_path, images):
+    interrupted_job(journal_path, images)
+    stat = images[0].stat()
+    os.utime(images[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert not read_journal(journal_path).is_done(images[0])
+
+
+def test_rewritten_image_with_restored_mtime_is_not_done(journal_path, images):
+    journal_path.parent.mkdir()
+    journal = JobJournal(journal_path)
+    journal.start(resume=False, total=2)
+    for path in images[:2]:
+        result = done(path)
+        result.input_hash = hashlib.sha256(path.read_bytes()).hexdigest()
+        journal.record(result)
+    journal.close()
+
+    # Same size and mtime, other content, as after `cp -p` of another scan
+    stat = images[0].stat()
+    data = bytearray(images[0].read_bytes())
+    data[-1] ^= 0xFF
+    images[0].write_bytes(bytes(data))
+    os.utime(images[0], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    state = read_journal(journal_path)
+    assert not state.is_done(images[0])
+    assert state.is_done(images[1])
+
+
+def test_read_journal_leaves_it_unchanged(journal_path, images):
+    interrupted_job(journal_path, images)
+    before = journal_path.read_bytes()
+    read_journal(journal_path)
+    assert journal_path.read_bytes() == before
+
+
+def test_read_missing_or_foreign_journal(journal_path):
+    assert read_journal(journal_path) is None
+    journal_path.parent.mkdir()
+    journal_path.write_bytes(b"not a database")
+    assert read_journal(journal_path) is None
+
+
+def test_records_are_buffered_until_flush(journal_path, images):
+    journal_path.parent.mkdir()
+    journal = JobJournal(journal_path, batch_size=10, flush_interval=3600)
+    journal.start(resume=False, total=3)
+    journal.record(done(images[0]))
+
+    reader = JobJournal(journal_path)
+    assert reader.counts() == {}
+    journal.flush()
+    assert reader.counts() == {STATUS_DONE: 1}
+    reader.close()
+    journal.close()
+
+
+def test_retried_image_counts_attempts(journal_path, images):
+    interrupted_job(journal_path, images)
+    journal = JobJournal(journal_path)
+    journal.start(resume=True, total=3)
+    journal.record(done(images[1]))
+    journal.close()
+
+    journal = JobJournal(journal_path)
+    assert journal.counts() == {STATUS_DONE: 2}
+    (attempts,) = journal._db.execute(
+        "SELECT attempts FROM items WHERE path = ?", (os.path.realpath(images[1]),)
+    ).fetchone()
+    assert attempts == 2
+    journal.close()
+
+
+@pytest.mark.parametrize(
+    "outcomes, total, unfinished",
+    [
+        ([done, done, done], 3, 0),
+        ([done, failed, done], 3, 1),
+        ([done], 3, 2),
+        ([done, failed], 3, 2),
+        ([], 2, 2),
+    ],
+    ids=["complete", "failed", "interrupted", "interrupted-and-failed", "none-done"],
+)
+def test_unfinished(journal_path, images, outcomes, total, unfinished):
+    journal_path.parent.mkdir()
+    journal = JobJournal(journal_path)
+    journal.start(resume=False, total=total)
+    for outcome, path in zip(outcomes, images):
+        journal.record(outcome(path))
+    journal.close()
+    assert read_journal(journal_path).unfinished == unfinished
+
+
+def test_unfinished_without_recorded_total(journal_path, images):
+    journal_path.parent.mkdir()
+    journal = JobJournal(journal_path)
+    journal.record(done(images[0]))
+    journal.record(failed(images[1]))
+    journal.close()
+    assert read_journal(journal_path).unfinished == 1
+
+
+def test_start_without_resume_discards_records(journal_path, images):
+    interrupted_job(journal_path, images)
+    journal = JobJournal(journal_path)
+    journal.start(resume=False, total=3)
+    assert journal.counts() == {}
+    journal.close()
+    assert read_journal(journal_path).unfinished == 3
+
+
+def test_start_with_resume_keeps_records(journal_path, images):
+    interrupted_job(journal_path, images)
+    journal = JobJournal(journal_path)
+    journal.start(resume=True, total=3)
+    assert journal.counts() == {STATUS_DONE: 1, STATUS_FAILED: 1}
+    journal.close()
+
+
+def test_set_settings_reports_changes(journal_path):
+    journal_path.parent.mkdir()
+    journal = JobJournal(journal_path)
+    assert journal.set_settings({"model": "a", "formats": ["markdown"]}) is None
+    assert journal.set_settings({"model": "a", "formats": ["markdown"]}) is None
+    assert journal.set_settings({"model": "b", "formats": ["markdown"]}) == {
+        "model": "a",
+        "formats": ["markdown"],
+    }
+    journal.close()
+
+
+def _digest(*args):
+    from main import app
+
+    return CliRunner().invoke(app, ["digest", *map(str, args)])
+
+
+@pytest.mark.parametrize("flags", [[], ["--resume"]], ids=["new", "resume"])
+def test_failed_validation_keeps_journal(journal_path, images, monkeypatch, flags):
+    monkeypatch.setenv("GITHUB_TOKEN", "token")
+    interrupted_job(journal_path, images)
+    before = journal_path.read_bytes()
+
+    result = _digest(
+        images[0].parent, "-o", journal_path.parent, *flags, "-m", "no-such-model"
+    )
+    assert result.exit_code == 1
+    assert "Unknown model" in result.output
+    assert journal_path.read_bytes() == before
+
+
+def test_rerun_without_resume_warns_about_unfinished_job(
+    journal_path, images, monkeypatch
+):
+    monkeypatch.setenv("GITHUB_TOKEN", "token")
+    interrupted_job(journal_path, images)
+
+    result = _digest(images[0].parent, "-o", journal_path.parent, "-m", "no-such-model")
+    assert "unfinished batch (2 images not done)" in result.output
+    assert "--resume" in result.output
+
+
+def test_no_journal_is_created_when_validation_fails(tmp_path, images, monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "token")
+    output = tmp_path / "fresh"
+    result = _digest(images[0].parent, "-o", output, "-m", "no-such-model")
+    assert result.exit_code == 1
+    assert not Path(output / JOURNAL_FILENAME).exists()
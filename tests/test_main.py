@@ -0,0 +1,32 @@
+import pytest
+
+from main import _profile_report
+
+
+@pytest.fixture
+def profiler(mocker):
+    profiler = mocker.Mock()
+    profiler.write.side_effect = PermissionError("denied")
+    return profiler
+
+
+def test_profile_write_error_keeps_batch_error(profiler, tmp_path):
+    with pytest.raises(RuntimeError, match="batch failed"):
+        with _profile_report(profiler, tmp_path / "profile.json"):
+            raise RuntimeError("batch failed")
+    profiler.write.assert_called_once()
+
+
+def test_profile_write_error_is_reported(profiler, tmp_path, capsys):
+    with _profile_report(profiler, tmp_path / "profile.json"):
+        pass
+    assert "Could not save profile report" in capsys.readouterr().out
+
+
+def test_profile_report_is_written(tmp_path, capsys):
+    from profiling import Profiler
+
+    with _profile_report(Profiler(), tmp_path / "profile.json"):
+        pass
+    assert (tmp_path / "profile.json").exists()
+    assert "Profile report saved" in capsys.readouterr().out
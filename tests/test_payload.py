@@ -0,0 +1,61 @@
+import base64
+
+import pytest
+
+from payload import _ENCODE_CHUNK, ImagePayload
+
+SIZES = [0, 1, 2, 3, _ENCODE_CHUNK - 1, _ENCODE_CHUNK, 2 * _ENCODE_CHUNK + 1]
+
+
+@pytest.fixture
+def image(tmp_path):
+    def make(size, name="scan.jpg"):
+        path = tmp_path / name
+        path.write_bytes(bytes(index % 251 for index in range(size)))
+        return path
+
+    return make
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_encoded_forms_match_base64(image, size):
+    path = image(size)
+    expected = base64.b64encode(path.read_bytes())
+    with ImagePayload(path) as payload:
+        assert bytes(payload.encoded()) == expected
+        assert payload.base64() == expected.decode()
+        assert payload.data_url() == "data:image/jpeg;base64," + expected.decode()
+
+
+def test_encoded_is_kept_and_read_only(image):
+    with ImagePayload(image(100)) as payload:
+        first = payload.encoded()
+        assert first.readonly
+        assert first.obj is payload.encoded().obj
+
+
+def test_text_replaces_encoded_buffer(image):
+    with ImagePayload(image(100)) as payload:
+        encoded = bytes(payload.encoded())
+        text = payload.base64()
+        assert payload._encoded is None
+        assert payload.base64() is text
+        assert bytes(payload.encoded()) == encoded
+        assert payload._encoded is None
+
+
+@pytest.mark.parametrize(
+    "name, mime_type",
+    [("scan.jpg", "image/jpeg"), ("scan.TIF", "image/tiff"), ("scan.png", "image/png")],
+)
+def test_mime_type(image, name, mime_type):
+    with ImagePayload(image(3, name)) as payload:
+        assert payload.mime_type == mime_type
+
+
+def test_close_releases_everything(image):
+    payload = ImagePayload(image(100))
+    payload.base64()
+    payload.close()
+    assert payload._base64 is None
+    assert payload._file.closed
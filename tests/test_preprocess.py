@@ -0,0 +1,159 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from model import Model
+from preprocess import PreprocessConfig, preprocess_image
+
+ORIENTATION = 0x0112
+
+
+def noisy(size, mode="RGB"):
+    """An image that does not compress to nothing, like a real scan."""
+    width, height = size
+    data = bytes((x * 7 + y * 13) % 256 for y in range(height) for x in range(width))
+    gray = Image.frombytes("L", size, data)
+    return gray.convert(mode)
+
+
+@pytest.fixture
+def save(tmp_path):
+    def save(image, name, **options):
+        path = tmp_path / name
+        image.save(path, **options)
+        return str(path)
+
+    return save
+
+
+@pytest.fixture
+def work_dir(tmp_path):
+    path = tmp_path / "work"
+    path.mkdir()
+    return str(path)
+
+
+def test_exif_orientation_is_applied(save, work_dir):
+    exif = Image.Exif()
+    exif[ORIENTATION] = 6  # Rotated 90° clockwise
+    path = save(noisy((40, 20)), "phone.jpg", exif=exif)
+
+    output = preprocess_image(path, PreprocessConfig(), work_dir)
+
+    assert output != path
+    with Image.open(output) as image:
+        assert image.size == (20, 40)
+        assert image.getexif().get(ORIENTATION, 1) == 1
+
+
+def test_longest_edge_is_downscaled(save, work_dir):
+    path = save(noisy((400, 100)), "wide.png")
+
+    output = preprocess_image(path, PreprocessConfig(), work_dir, max_edge=200)
+
+    with Image.open(output) as image:
+        assert image.size == (200, 50)
+
+
+def test_small_images_keep_their_size(save, work_dir):
+    path = save(noisy((100, 50)), "small.png")
+
+    output = preprocess_image(
+        path, PreprocessConfig(grayscale=True), work_dir, max_edge=200
+    )
+
+    with Image.open(output) as image:
+        assert image.size == (100, 50)
+
+
+@pytest.mark.parametrize(
+    "output_format, extension, pil_format",
+    [("jpeg", ".jpg", "JPEG"), ("webp", ".webp", "WEBP")],
+)
+def test_format_round_trip(save, work_dir, output_format, extension, pil_format):
+    path = save(noisy((300, 200), "RGBA"), "scan.png")
+
+    output = preprocess_image(
+        path, PreprocessConfig(format=output_format), work_dir, max_edge=150
+    )
+
+    assert output.endswith(extension)
+    with Image.open(output) as image:
+        assert image.format == pil_format
+        assert image.mode == "RGB"
+        assert image.size == (150, 100)
+
+
+def test_grayscale(save, work_dir):
+    path = save(noisy((60, 60)), "scan.png")
+
+    output = preprocess_image(path, PreprocessConfig(grayscale=True), work_dir)
+
+    with Image.open(output) as image:
+        assert image.mode == "L"
+
+
+def test_original_is_kept_when_not_smaller(save, work_dir):
+    path = save(noisy((60, 60)), "scan.jpg", quality=20)
+
+    output = preprocess_image(path, PreprocessConfig(quality=100), work_dir)
+
+    assert output == path
+    assert not os.listdir(work_dir)
+
+
+def test_data_is_used_instead_of_the_file(save, work_dir):
+    buffer = io.BytesIO()
+    noisy((400, 100)).save(buffer, format="PNG")
+
+    output = preprocess_image(
+        "missing.png", PreprocessConfig(), work_dir, 200, buffer.getvalue()
+    )
+
+    with Image.open(output) as image:
+        assert image.size == (200, 50)
+
+
+def test_disabled_by_default():
+    assert not PreprocessConfig().enabled
+    assert not PreprocessConfig.from_config({}).enabled
+    assert PreprocessConfig.from_config({"enabled": True}).enabled
+
+
+def test_from_config_formats():
+    assert PreprocessConfig.from_config({"format": "JPG"}).format == "jpeg"
+    with pytest.raises(ValueError):
+        PreprocessConfig.from_config({"format": "gif"})
+
+
+@pytest.mark.parametrize(
+    "max_edge, use_model_resolution, model_edge, expected",
+    [
+        (2048, True, 1024, 1024),
+        (512, True, 1024, 512),
+        (None, True, 1024, 1024),
+        (2048, False, 1024, 2048),
+        (2048, True, None, 2048),
+    ],
+    ids=[
+        "model-smaller",
+        "config-smaller",
+        "model-only",
+        "model-ignored",
+        "no-model-edge",
+    ],
+)
+def test_max_edge_for(max_edge, use_model_resolution, model_edge, expected):
+    model = Model(
+        name="m",
+        pretty_name="m",
+        provider="azure",
+        rate_limit="",
+        max_image_edge=model_edge,
+    )
+    settings = PreprocessConfig(
+        max_edge=max_edge, use_model_resolution=use_model_resolution
+    )
+    assert settings.max_edge_for(model) == expected
@@ -0,0 +1,169 @@
+import pytest
+
+from ratelimit import (
+    QuotaExceededError,
+    QuotaLedger,
+    RateLimiter,
+    TokenBucket,
+    format_duration,
+    parse_rate_limit,
+)
+
+DAILY = [(3, 86400.0)]
+
+
+@pytest.mark.parametrize(
+    "rate_limit, expected",
+    [
+        ("150 requests/day", [(150, 86400.0)]),
+        ("15 requests/minute, 150 requests/day", [(15, 60.0), (150, 86400.0)]),
+        ("150 requests/day, 15 requests/minute", [(15, 60.0), (150, 86400.0)]),
+        ("1,000 requests per hour", [(1000, 3600.0)]),
+        ("10 req/s", [(10, 1.0)]),
+        ("50 calls per min", [(50, 60.0)]),
+        ("5/hours", [(5, 3600.0)]),
+        ("0 requests/day", []),
+        ("10 requests/fortnight", []),
+        ("Unlimited (Local)", []),
+        ("", []),
+        (None, []),
+    ],
+    ids=[
+        "daily",
+        "combined",
+        "sorted-by-period",
+        "thousands-separator",
+        "abbreviated",
+        "calls-per",
+        "plural-unit",
+        "zero",
+        "unknown-unit",
+        "unlimited",
+        "empty",
+        "none",
+    ],
+)
+def test_parse_rate_limit(rate_limit, expected):
+    assert parse_rate_limit(rate_limit) == expected
+
+
+@pytest.mark.parametrize(
+    "seconds, expected",
+    [(0, "0s"), (59.6, "1m 0s"), (61, "1m 1s"), (7322, "2h 2m"), (-5, "0s")],
+)
+def test_format_duration(seconds, expected):
+    assert format_duration(seconds) == expected
+
+
+@pytest.fixture
+def clock(mocker):
+    """Controls time.time() as seen by the ledger."""
+    return mocker.patch("ratelimit.time.time", return_value=1_000_000.0)
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return QuotaLedger(tmp_path / "quota.json")
+
+
+def test_ledger_records_until_quota_is_used(ledger, clock):
+    assert [ledger.try_record("m", DAILY) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert ledger.remaining("m", DAILY) == 0
+    assert ledger.try_record("m", DAILY) == 86400.0
+    # Refused requests are not recorded
+    assert ledger.remaining("m", DAILY) == 0
+
+
+def test_ledger_window_slides(ledger, clock):
+    for offset in (0, 100, 200):
+        clock.return_value = 1_000_000.0 + offset
+        ledger.try_record("m", DAILY)
+    clock.return_value = 1_000_000.0 + 300
+    assert ledger.try_record("m", DAILY) == 86400.0 - 300
+    # Once the oldest request leaves the window, one request fits again
+    clock.return_value = 1_000_000.0 + 86401
+    assert ledger.remaining("m", DAILY) == 1
+    assert ledger.try_record("m", DAILY) == 0.0
+
+
+def test_ledger_combined_limits(ledger, clock):
+    limits = [(2, 60.0), (3, 86400.0)]
+    ledger.try_record("m", limits)
+    ledger.try_record("m", limits)
+    assert ledger.try_record("m", limits) == 60.0
+    clock.return_value += 61
+    assert ledger.try_record("m", limits) == 0.0
+    clock.return_value += 61
+    # The minute window is free again, but the daily quota is used up
+    assert ledger.try_record("m", limits) == pytest.approx(86400.0 - 122)
+
+
+def test_ledger_wait_time(ledger, clock):
+    ledger.try_record("m", DAILY)
+    clock.return_value += 10
+    assert ledger.wait_time("m", DAILY, 2) == 0.0
+    assert ledger.wait_time("m", DAILY, 3) == 86400.0 - 10
+    assert ledger.wait_time("m", DAILY, 4) == float("inf")
+
+
+def test_ledger_is_shared_and_per_model(tmp_path, clock):
+    first = QuotaLedger(tmp_path / "quota.json")
+    second = QuotaLedger(tmp_path / "quota.json")
+    first.try_record("m", DAILY)
+    first.try_record("other", DAILY)
+    assert second.remaining("m", DAILY) == 2
+    second.try_record("m", DAILY)
+    assert first.remaining("m", DAILY) == 1
+    assert first.remaining("other", DAILY) == 2
+
+
+def test_ledger_survives_corrupt_file(ledger, clock):
+    ledger.path.write_text("not json")
+    assert ledger.remaining("m", DAILY) == 3
+    assert ledger.try_record("m", DAILY) == 0.0
+
+
+def test_token_bucket_paces_after_burst(mocker):
+    monotonic = mocker.patch("ratelimit.time.monotonic", return_value=0.0)
+    bucket = TokenBucket(capacity=1, refill_per_second=2.0)
+    assert bucket.try_acquire() == 0.0
+    assert bucket.try_acquire() == 0.5
+    monotonic.return_value = 0.25
+    assert bucket.try_acquire() == 0.25
+    monotonic.return_value = 0.5
+    assert bucket.try_acquire() == 0.0
+
+
+def test_rate_limiter_raises_when_quota_is_used(ledger, clock):
+    limiter = RateLimiter("m", DAILY, ledger)
+    for _ in range(3):
+        limiter.acquire()
+    with pytest.raises(QuotaExceededError) as excinfo:
+        limiter.acquire()
+    assert excinfo.value.retry_after == 86400.0
+    assert limiter.remaining() == 0
+
+
+def test_rate_limiter_waits_for_quota(ledger, clock, mocker):
+    limiter = RateLimiter("m", [(1, 3600.0)], ledger)
+    limiter.acquire()
+
+    def sleep(seconds):
+        clock.return_value += seconds
+
+    mocker.patch("ratelimit.time.sleep", side_effect=sleep)
+    limiter.acquire(wait_for_quota=True)
+    # Waited in steps until the recorded request left the window
+    assert clock.return_value == pytest.approx(1_003_600.0, abs=1e-3)
+
+
+def test_rate_limiter_paces_short_windows(ledger):
+    limiter = RateLimiter("m", [(600, 60.0)], ledger)
+    assert limiter._bucket is not None
+    assert limiter._bucket.capacity == 1
+    assert limiter._bucket.refill_per_second == 10.0
+
+
+def test_rate_limiter_leaves_long_windows_to_the_ledger(ledger):
+    limiter = RateLimiter("m", [(150, 86400.0)], ledger)
+    assert limiter._bucket is None
@@ -0,0 +1,205 @@
+import pytest
+
+from repair import (
+    _scan_json,
+    extract_block,
+    repair_document,
+    repair_json,
+    repair_xml,
+    repair_yaml,
+)
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        ('{"a": 1}', '{"a": 1}'),
+        ('Here you go:\n```json\n{"a": 1}\n```\nHope it helps!', '{"a": 1}'),
+        ('```\n{"a": 1}\n```', '{"a": 1}'),
+        ('```yaml\na: 1\n```\n```json\n{"a": 2}\n```', '{"a": 2}'),
+        ('```json\n{"a": 1,\n"b": [2', '{"a": 1,\n"b": [2'),
+    ],
+    ids=["plain", "fenced-prose", "unlabelled", "labelled-wins", "open-fence"],
+)
+def test_extract_block(content, expected):
+    assert extract_block(content, "json") == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected_text, expected_stack",
+    [
+        ('{"a": 1}', '{"a": 1}', []),
+        ('{"a": [1, 2,]}', '{"a": [1, 2]}', []),
+        ('{"a": 1,\n}', '{"a": 1}', []),
+        ('{"a": "x, ]}"}', '{"a": "x, ]}"}', []),
+        ('{"a": "say \\"hi\\"",}', '{"a": "say \\"hi\\""}', []),
+        ('{"a": [1', '{"a": [1', ["{", "["]),
+        ('{"a": "unterminated', '{"a": "unterminated"', ["{"]),
+        ('{"a": [1}', '{"a": [1]}', []),
+        ('{"a": 1}]', '{"a": 1}', []),
+        ('prose {"a": 1} more prose', '{"a": 1}', []),
+    ],
+    ids=[
+        "complete",
+        "trailing-comma-array",
+        "trailing-comma-object",
+        "brackets-in-string",
+        "escaped-quotes",
+        "truncated",
+        "truncated-string",
+        "unclosed-inner",
+        "stray-closer",
+        "surrounding-prose",
+    ],
+)
+def test_scan_json(text, expected_text, expected_stack):
+    scanned, stack, _ = _scan_json(text)
+    assert scanned == expected_text
+    assert stack == expected_stack
+
+
+def test_scan_json_records_open_brackets_at_commas():
+    _, _, commas = _scan_json('{"a": [1, 2], "b": 3')
+    assert [open_brackets for _, open_brackets in commas] == [["{", "["], ["{"]]
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        ('{"title": "Notes", "items": [1, 2]}', {"title": "Notes", "items": [1, 2]}),
+        (
+            'Sure! Here is the JSON:\n```json\n{"title": "Notes"}\n```\nLet me know.',
+            {"title": "Notes"},
+        ),
+        ('{"title": "Notes", "items": [1, 2,],}', {"title": "Notes", "items": [1, 2]}),
+        ('{"title": "Notes", "items": [1, 2', {"title": "Notes", "items": [1, 2]}),
+        (
+            '{"title": "Notes", "body": "cut off mid',
+            {"title": "Notes", "body": "cut off mid"},
+        ),
+        ('{"title": "Notes", "body":', {"title": "Notes", "body": None}),
+        (
+            '{"title": "Notes", "items": [{"a": 1}, {"a": tr',
+            {"title": "Notes", "items": [{"a": 1}]},
+        ),
+        ('[{"a": 1}, {"b": 2},', [{"a": 1}, {"b": 2}]),
+        ('{"text": "line one\nline two"}', {"text": "line one\nline two"}),
+    ],
+    ids=[
+        "valid",
+        "fenced-prose",
+        "trailing-commas",
+        "truncated-array",
+        "truncated-string",
+        "truncated-after-key",
+        "truncated-value",
+        "truncated-top-level-array",
+        "raw-newline-in-string",
+    ],
+)
+def test_repair_json(content, expected):
+    assert repair_json(content) == expected
+
+
+@pytest.mark.parametrize(
+    "content",
+    ["No JSON in this answer.", '{"title" "Notes"}', ""],
+    ids=["prose-only", "missing-colon", "empty"],
+)
+def test_repair_json_unrecoverable(content):
+    with pytest.raises(ValueError):
+        repair_json(content)
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        (
+            "title: Notes\nitems:\n  - one\n  - two",
+            {"title": "Notes", "items": ["one", "two"]},
+        ),
+        ("Here is the YAML:\n```yaml\ntitle: Notes\n```\nDone.", {"title": "Notes"}),
+        (
+            "Here is the YAML you asked for.\ntitle: Notes\ncount: 2",
+            {"title": "Notes", "count": 2},
+        ),
+        (
+            "title: Notes\nsection:\n\tname: A",
+            {"title": "Notes", "section": {"name": "A"}},
+        ),
+        ("title: Meeting: 10am\nroom: B", {"title": "Meeting: 10am", "room": "B"}),
+        ("- name: A: first\n- name: B", [{"name": "A: first"}, {"name": "B"}]),
+    ],
+    ids=[
+        "valid",
+        "fenced-prose",
+        "leading-prose",
+        "tab-indent",
+        "colon-in-value",
+        "sequence",
+    ],
+)
+def test_repair_yaml(content, expected):
+    assert repair_yaml(content) == expected
+
+
+@pytest.mark.parametrize(
+    "content",
+    ["Just a sentence of prose.", "title: [unclosed"],
+    ids=["prose-only", "broken-flow"],
+)
+def test_repair_yaml_unrecoverable(content):
+    with pytest.raises(ValueError):
+        repair_yaml(content)
+
+
+@pytest.mark.parametrize(
+    "content, tag, texts",
+    [
+        ("<doc><title>Notes</title></doc>", "doc", {"title": "Notes"}),
+        (
+            "Here is the XML:\n```xml\n<doc><title>Notes</title></doc>\n```\nThanks.",
+            "doc",
+            {"title": "Notes"},
+        ),
+        (
+            "<doc><title>Notes</title><body>Cut off",
+            "doc",
+            {"title": "Notes", "body": "Cut off"},
+        ),
+        ("<doc><title>Notes<body>Text</body></doc>", "doc", {"title": "Notes"}),
+        ("<doc><title>Tom & Jerry</title></doc>", "doc", {"title": "Tom & Jerry"}),
+        ("<doc><title>&lt;b&gt; &amp; co</title></doc>", "doc", {"title": "<b> & co"}),
+        ("<doc><title>Notes</title></doc> trailing prose", "doc", {"title": "Notes"}),
+    ],
+    ids=[
+        "valid",
+        "fenced-prose",
+        "unclosed-tags",
+        "unclosed-inner-tag",
+        "bare-ampersand",
+        "entities-kept",
+        "trailing-prose",
+    ],
+)
+def test_repair_xml(content, tag, texts):
+    root = repair_xml(content)
+    assert root.tag == tag
+    for child, text in texts.items():
+        assert root.find(f".//{child}").text == text
+
+
+@pytest.mark.parametrize(
+    "content", ["No markup at all.", ""], ids=["prose-only", "empty"]
+)
+def test_repair_xml_unrecoverable(content):
+    with pytest.raises(ValueError):
+        repair_xml(content)
+
+
+def test_repair_document_dispatches_by_format():
+    assert repair_document('{"a": 1,}', "json") == {"a": 1}
+    assert repair_document("a: 1", "yaml") == {"a": 1}
+    assert repair_document("<a>1", "xml").text == "1"
+    with pytest.raises(ValueError):
+        repair_document("# Notes", "markdown")
@@ -0,0 +1,224 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+
+from providers.retry import RetryPolicy, charge_retries, header_delay
+
+
+class _Response:
+    """Stub of the HTTP response an azure-core error carries."""
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.reason = "stub"
+        self.headers = headers or {}
+
+    def text(self):
+        return ""
+
+
+def http_error(status_code, headers=None):
+    return HttpResponseError(
+        message=f"HTTP {status_code}", response=_Response(status_code, headers)
+    )
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after-ms": "1500"}, 1.5),
+        ({"Retry-After-Ms": "250"}, 0.25),
+        ({"Retry-After": "7"}, 7.0),
+        ({"retry-after": "2.5"}, 2.5),
+        ({"retry-after-ms": "500", "retry-after": "9"}, 0.5),
+        ({"x-ratelimit-reset-requests": "20ms"}, 0.02),
+        ({"x-ratelimit-reset-requests": "1m30s"}, 90.0),
+        (
+            {"x-ratelimit-reset-requests": "2s", "x-ratelimit-reset-tokens": "6m0s"},
+            360.0,
+        ),
+        ({"x-ratelimit-reset": "12"}, 12.0),
+        ({"Retry-After": "-3"}, 0.0),
+        ({"retry-after": "soon"}, None),
+        ({"x-ratelimit-reset-requests": "5 parsecs"}, None),
+        ({"x-request-id": "abc"}, None),
+        ({}, None),
+    ],
+    ids=[
+        "retry-after-ms",
+        "retry-after-ms-case",
+        "retry-after-seconds",
+        "retry-after-fraction",
+        "ms-wins",
+        "reset-milliseconds",
+        "reset-compound",
+        "reset-longest",
+        "github-reset-seconds",
+        "negative-clamped",
+        "unparseable",
+        "unparseable-reset",
+        "unrelated",
+        "no-headers",
+    ],
+)
+def test_header_delay(headers, expected):
+    delay = header_delay(http_error(429, headers))
+    if expected is None:
+        assert delay is None
+    else:
+        assert delay == pytest.approx(expected)
+
+
+def test_header_delay_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    delay = header_delay(
+        http_error(503, {"Retry-After": format_datetime(when, usegmt=True)})
+    )
+    assert 28 <= delay <= 30
+
+
+def test_header_delay_past_http_date():
+    when = datetime.now(timezone.utc) - timedelta(minutes=5)
+    delay = header_delay(
+        http_error(503, {"Retry-After": format_datetime(when, usegmt=True)})
+    )
+    assert delay == 0.0
+
+
+def test_header_delay_epoch_reset(mocker):
+    mocker.patch("providers.retry.time.time", return_value=1_700_000_000.0)
+    assert header_delay(http_error(429, {"x-ratelimit-reset": "1700000045"})) == 45.0
+
+
+def test_header_delay_without_response():
+    assert header_delay(TimeoutError("timed out")) is None
+
+
+@pytest.mark.parametrize(
+    "error, retryable",
+    [
+        (http_error(400), False),
+        (http_error(401), False),
+        (http_error(403), False),
+        (http_error(404), False),
+        (http_error(408), True),
+        (http_error(425), True),
+        (http_error(429), True),
+        (http_error(500), True),
+        (http_error(503), True),
+        (TimeoutError("timed out"), True),
+        (ConnectionError("reset by peer"), True),
+        (ServiceRequestError("connection failed"), False),
+        (ValueError("bad image"), False),
+    ],
+    ids=[
+        "400",
+        "401",
+        "403",
+        "404",
+        "408",
+        "425",
+        "429",
+        "500",
+        "503",
+        "timeout",
+        "connection",
+        "sdk-error-not-registered",
+        "value-error",
+    ],
+)
+def test_is_retryable(error, retryable):
+    assert RetryPolicy().is_retryable(error) is retryable
+
+
+def test_is_retryable_transient_sdk_errors():
+    policy = RetryPolicy(transient_errors=(ServiceRequestError,))
+    assert policy.is_retryable(ServiceRequestError("connection failed"))
+
+
+def test_is_retryable_ollama_unknown_status():
+    error = RuntimeError("boom")
+    error.status_code = -1
+    assert not RetryPolicy().is_retryable(error)
+
+
+def test_backoff_is_capped(mocker):
+    mocker.patch("providers.retry.random.uniform", side_effect=lambda low, high: high)
+    policy = RetryPolicy(base_delay=2.0, max_delay=10.0)
+    assert [policy.backoff(attempt) for attempt in range(4)] == [2.0, 4.0, 8.0, 10.0]
+
+
+def test_requested_delay_is_not_capped(mocker):
+    mocker.patch("providers.retry.random.uniform", return_value=0.0)
+    policy = RetryPolicy(max_delay=10.0)
+    assert policy.delay_for(http_error(429, {"Retry-After": "120"}), 0) == 120.0
+
+
+def test_next_delay_stops_on_final_errors():
+    budget = RetryPolicy(max_attempts=5).start()
+    assert budget.next_delay(http_error(401)) is None
+    assert budget.attempts == 1
+
+
+def test_next_delay_uses_up_attempts(mocker):
+    mocker.patch("providers.retry.random.uniform", return_value=0.0)
+    budget = RetryPolicy(max_attempts=3, deadline=None).start()
+    delays = [budget.next_delay(http_error(503)) for _ in range(3)]
+    assert delays == [0.0, 0.0, None]
+
+
+def test_next_delay_respects_deadline(mocker):
+    mocker.patch("providers.retry.random.uniform", return_value=0.0)
+    clock = mocker.patch("providers.retry.time.monotonic", return_value=100.0)
+    budget = RetryPolicy(max_attempts=10, deadline=60.0).start()
+
+    assert budget.next_delay(http_error(429, {"Retry-After": "30"})) == 30.0
+    clock.return_value = 125.0
+    # 35 seconds left: a 30 second wait still fits, a 40 second one does not
+    assert budget.next_delay(http_error(429, {"Retry-After": "30"})) == 30.0
+    assert budget.next_delay(http_error(429, {"Retry-After": "40"})) is None
+    assert budget.remaining() == 35.0
+
+
+def test_from_config():
+    policy = RetryPolicy.from_config(
+        {"max_attempts": 0, "base_delay": -1, "max_delay": 5, "deadline": None}
+    )
+    assert (policy.max_attempts, policy.base_delay, policy.max_delay) == (1, 0.0, 5.0)
+    assert policy.deadline is None
+    assert RetryPolicy.from_config({"deadline": 0.2}).deadline == 1.0
+
+
+def test_retries_take_quota(mocker):
+    limiter = mocker.Mock()
+    with charge_retries(limiter, wait_for_quota=True):
+        budget = RetryPolicy().start()
+    budget.before_retry()
+    limiter.acquire.assert_called_once_with(wait_for_quota=True)
+
+
+def test_retries_outside_charge_retries_take_no_quota(mocker):
+    limiter = mocker.Mock()
+    with charge_retries(limiter):
+        pass
+    RetryPolicy().start().before_retry()
+    with charge_retries(None):
+        RetryPolicy().start().before_retry()
+    limiter.acquire.assert_not_called()
+
+
+async def _abefore_retry(budget):
+    await budget.abefore_retry()
+
+
+def test_async_retries_take_quota(mocker):
+    import asyncio
+
+    limiter = mocker.Mock()
+    limiter.aacquire = mocker.AsyncMock()
+    with charge_retries(limiter):
+        budget = RetryPolicy().start()
+    asyncio.run(_abefore_retry(budget))
+    limiter.aacquire.assert_awaited_once_with(wait_for_quota=False)
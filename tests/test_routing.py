@@ -0,0 +1,297 @@
+import json
+
+import pytest
+
+from model import Model
+from ratelimit import QuotaExceededError
+from routing import (
+    ModelRouter,
+    ModelStats,
+    RoutingConfig,
+    RoutingStats,
+    is_throttle_error,
+)
+from usage import Usage, record
+
+NOW = 1_700_000_000.0
+
+
+def make_model(name):
+    return Model(name=name, pretty_name=name, provider="test", rate_limit="")
+
+
+def http_error(status_code, message="API request failed"):
+    """An error as the providers raise it, with the status of the response."""
+    error = RuntimeError(message)
+    error.status_code = status_code
+    return error
+
+
+@pytest.fixture
+def models():
+    return [make_model("fast"), make_model("slow"), make_model("other")]
+
+
+@pytest.fixture
+def stats(tmp_path):
+    return RoutingStats(tmp_path / "routing.json")
+
+
+@pytest.fixture
+def clock(mocker):
+    return mocker.patch("routing.time.time", return_value=NOW)
+
+
+@pytest.fixture
+def router(models, stats, clock):
+    return ModelRouter(models, RoutingConfig(explore=0.0), stats)
+
+
+def known(stats, name, latency, **fields):
+    stats.models[name] = ModelStats(latency=latency, updated=NOW, samples=5, **fields)
+
+
+def finish(router, model, seconds=1.0, error=None):
+    usages = [] if error else [Usage("test", model.name, seconds=seconds, detail="low")]
+    router.observe(model, usages, error)
+
+
+@pytest.mark.parametrize(
+    "error, throttle",
+    [
+        (http_error(429), True),
+        (http_error(503), True),
+        (http_error(500), False),
+        (http_error(401), False),
+        (TimeoutError("Request timed out"), True),
+        (QuotaExceededError("fast", 30), True),
+        (RuntimeError("API request failed: Too Many Requests"), False),
+        (ValueError("timed out"), False),
+    ],
+    ids=[
+        "429",
+        "503",
+        "500",
+        "401",
+        "timeout",
+        "quota",
+        "text-without-status",
+        "text-timeout",
+    ],
+)
+def test_is_throttle_error(error, throttle):
+    assert is_throttle_error(error) is throttle
+
+
+def test_unknown_models_are_tried_first(router, stats, models):
+    known(stats, "fast", 1.0)
+    known(stats, "slow", 5.0)
+    assert router.choose().name == "other"
+
+
+def test_fastest_model_wins(router, stats):
+    known(stats, "fast", 1.0)
+    known(stats, "slow", 5.0)
+    known(stats, "other", 3.0)
+    assert router.choose().name == "fast"
+
+
+def test_requests_in_flight_spread_load(router, stats):
+    known(stats, "fast", 1.0)
+    known(stats, "slow", 2.5)
+    known(stats, "other", 10.0)
+    # fast: 1s, then 2s, then 3s expected with requests in flight
+    assert [router.choose().name for _ in range(4)] == ["fast", "fast", "slow", "fast"]
+
+
+def test_unknown_models_spread_by_requests_in_flight(router):
+    assert [router.choose().name for _ in range(3)] == ["fast", "slow", "other"]
+
+
+def test_exclude(router, stats, models):
+    known(stats, "fast", 1.0)
+    assert router.choose(exclude=["fast", "other"]).name == "slow"
+    assert router.choose(exclude=[model.name for model in models]) is None
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [{"throttled_until": NOW + 60}, {"error_rate": 0.9}],
+    ids=["throttled", "failing"],
+)
+def test_unhealthy_models_get_no_traffic(router, stats, fields):
+    known(stats, "fast", 1.0, **fields)
+    known(stats, "slow", 5.0)
+    known(stats, "other", 9.0)
+    assert router.choose().name == "slow"
+
+
+def test_error_rate_decays(router, stats, clock):
+    known(stats, "fast", 1.0, error_rate=0.9)
+    known(stats, "slow", 5.0)
+    known(stats, "other", 9.0)
+    clock.return_value = NOW + 2 * 3600  # Two half lives: 0.225
+    assert router.choose().name == "fast"
+
+
+def test_model_without_quota_gets_no_traffic(router, stats, mocker):
+    known(stats, "fast", 1.0)
+    known(stats, "slow", 5.0)
+    known(stats, "other", 9.0)
+    exhausted = mocker.Mock()
+    exhausted.remaining.return_value = 0
+    mocker.patch(
+        "routing.get_rate_limiter",
+        side_effect=lambda model: exhausted if model.name == "fast" else None,
+    )
+    assert router.choose().name == "slow"
+
+
+def test_quota_is_read_at_most_once_per_interval(router, mocker):
+    limiter = mocker.Mock()
+    limiter.remaining.return_value = 10
+    get_rate_limiter = mocker.patch("routing.get_rate_limiter", return_value=limiter)
+    monotonic = mocker.patch("routing.time.monotonic", return_value=100.0)
+
+    for _ in range(5):
+        router.choose()
+    assert get_rate_limiter.call_count == 3  # Once per model
+
+    monotonic.return_value = 110.0
+    router.choose()
+    assert get_rate_limiter.call_count == 6
+
+
+def test_all_unhealthy_uses_first_to_recover(router, stats):
+    known(stats, "fast", 1.0, throttled_until=NOW + 300)
+    known(stats, "slow", 5.0, throttled_until=NOW + 60)
+    known(stats, "other", 9.0, throttled_until=NOW + 120)
+    assert router.choose().name == "slow"
+
+
+def test_observe_updates_statistics(router, stats, models):
+    model = router.choose()
+    finish(router, model, seconds=2.0)
+    assert stats.models[model.name].latency == 2.0
+    assert stats.models[model.name].samples == 1
+    assert router.in_flight[model.name] == 0
+    assert router.routed[model.name] == 1
+
+
+def test_cache_hits_are_not_observed(router, stats):
+    model = router.choose()
+    router.observe(model, [])
+    assert model.name not in stats.models or stats.models[model.name].samples == 0
+    assert router.in_flight[model.name] == 0
+
+
+def test_throttle_cools_model_down(router, stats):
+    model = router.choose()
+    finish(router, model, error=http_error(429))
+    assert stats.models[model.name].throttled_until == NOW + router.config.cooldown
+
+    model = router.choose()
+    finish(router, model, error=QuotaExceededError(model.name, 42))
+    assert stats.models[model.name].throttled_until == NOW + 42
+
+
+def test_request_fails_over_on_throttle(router, stats):
+    known(stats, "fast", 1.0)
+    known(stats, "slow", 2.0)
+    known(stats, "other", 3.0)
+    sent = []
+
+    def send(model):
+        sent.append(model.name)
+        if model.name == "fast":
+            raise http_error(429)
+        record(Usage("test", model.name, seconds=1.5, detail="low"))
+        return f"answer from {model.name}"
+
+    assert router.request(send) == "answer from slow"
+    assert sent == ["fast", "slow"]
+    assert stats.models["fast"].throttled_until > NOW
+    assert stats.models["slow"].latency == pytest.approx(1.9)
+
+
+def test_request_does_not_fail_over_on_other_errors(router):
+    sent = []
+
+    def send(model):
+        sent.append(model.name)
+        raise http_error(400)
+
+    with pytest.raises(RuntimeError):
+        router.request(send)
+    assert len(sent) == 1
+
+
+def test_request_gives_up_when_every_model_is_throttled(router):
+    def send(model):
+        raise http_error(503)
+
+    with pytest.raises(RuntimeError):
+        router.request(send)
+    assert sum(router.routed.values()) == 3
+
+
+def test_async_request_fails_over(router, stats):
+    import asyncio
+
+    known(stats, "fast", 1.0)
+    known(stats, "slow", 2.0)
+    known(stats, "other", 3.0)
+
+    async def send(model):
+        if model.name == "fast":
+            raise TimeoutError("Request timed out")
+        return model.name
+
+    assert asyncio.run(router.arequest(send)) == "slow"
+
+
+def test_statistics_persist(models, stats, clock, tmp_path):
+    router = ModelRouter(models, RoutingConfig(explore=0.0), stats)
+    model = router.choose()
+    finish(router, model, seconds=2.0)
+    router.save()
+
+    reloaded = RoutingStats(tmp_path / "routing.json")
+    assert reloaded.models[model.name].latency == 2.0
+    assert reloaded.models[model.name].hourly
+
+
+def test_save_keeps_newer_statistics_of_other_processes(stats, tmp_path):
+    path = tmp_path / "routing.json"
+    path.write_text(
+        json.dumps(
+            {
+                "fast": ModelStats(latency=9.0, updated=NOW + 10).to_dict(),
+                "slow": ModelStats(latency=9.0, updated=NOW - 10).to_dict(),
+            }
+        )
+    )
+    stats = RoutingStats(path)
+    for name in ("fast", "slow"):
+        stats.models[name] = ModelStats(latency=1.0, updated=NOW)
+        stats.changed(name)
+    stats.save()
+
+    saved = json.loads(path.read_text())
+    assert saved["fast"]["latency"] == 9.0
+    assert saved["slow"]["latency"] == 1.0
+
+
+def test_unreadable_statistics_start_over(tmp_path):
+    path = tmp_path / "routing.json"
+    path.write_text('{"fast": {"latency": "quick"}, "slow": {"latency": 2}}')
+    stats = RoutingStats(path)
+    assert "fast" not in stats.models
+    assert stats.models["slow"].latency == 2.0
+
+
+def test_stale_latency_gives_way_to_hour_of_day(clock):
+    stats = ModelStats(latency=1.0, updated=NOW - 7200, hourly={"9": 4.0})
+    assert stats.expected_latency(NOW, 9, stale_after=1800) == 4.0
+    assert stats.expected_latency(NOW, 10, stale_after=1800) == 1.0
+    assert stats.expected_latency(NOW - 7000, 9, stale_after=1800) == 1.0
@@ -0,0 +1,171 @@
+import http.client
+import io
+import threading
+from concurrent.futures import Future
+from http import HTTPStatus
+
+import pytest
+from PIL import Image
+
+from model import Model
+from preprocess import PreprocessConfig
+from ratelimit import QuotaExceededError
+from server import (
+    DigestOutput,
+    DigestServer,
+    DigestService,
+    RequestError,
+    ServerBusyError,
+)
+
+
+def png_bytes(size=(64, 64)):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class StubService:
+    """Stands in for DigestService: answers every upload with outcome."""
+
+    def __init__(self):
+        self.outcome = DigestOutput(stem="notes", documents=[("markdown", "# Notes")])
+
+    def submit(self, data, extension, formats):
+        if isinstance(self.outcome, ServerBusyError):
+            raise self.outcome
+        future = Future()
+        if isinstance(self.outcome, BaseException):
+            future.set_exception(self.outcome)
+        else:
+            future.set_result(self.outcome)
+        return future
+
+
+@pytest.fixture
+def server():
+    service = StubService()
+    server = DigestServer(("127.0.0.1", 0), service, max_upload_bytes=1 << 20)
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body, content_type="image/png", query="", headers=None):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+    request_headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+    request_headers.update(headers or {})
+    connection.request("POST", f"/digest{query}", body=body, headers=request_headers)
+    response = connection.getresponse()
+    payload = response.read()
+    connection.close()
+    return response, payload
+
+
+def upstream_error(message):
+    """A provider error raised from the SDK error the service answered with."""
+    try:
+        raise RuntimeError("HTTP 401 Unauthorized")
+    except RuntimeError as cause:
+        try:
+            raise ValueError(message) from cause
+        except ValueError as e:
+            return e
+
+
+def test_digest_ok(server):
+    response, payload = post(server, png_bytes())
+    assert response.status == HTTPStatus.OK
+    assert payload == b"# Notes"
+
+
+@pytest.mark.parametrize(
+    "outcome, status",
+    [
+        (RequestError(HTTPStatus.BAD_REQUEST, "bad"), HTTPStatus.BAD_REQUEST),
+        (QuotaExceededError("gpt-4o", 30), HTTPStatus.TOO_MANY_REQUESTS),
+        (ServerBusyError("busy"), HTTPStatus.SERVICE_UNAVAILABLE),
+        (RuntimeError("API request failed: 500"), HTTPStatus.BAD_GATEWAY),
+        (ConnectionError("Ollama is not running"), HTTPStatus.BAD_GATEWAY),
+        (upstream_error("Authentication failed"), HTTPStatus.BAD_GATEWAY),
+        (TimeoutError("Request timed out"), HTTPStatus.GATEWAY_TIMEOUT),
+        (
+            ValueError("GITHUB_TOKEN was not found in environment or configuration."),
+            HTTPStatus.INTERNAL_SERVER_ERROR,
+        ),
+        (KeyError("choices"), HTTPStatus.INTERNAL_SERVER_ERROR),
+    ],
+    ids=[
+        "request-error",
+        "quota",
+        "busy",
+        "provider-failure",
+        "provider-down",
+        "upstream-rejected",
+        "timeout",
+        "server-config",
+        "unexpected",
+    ],
+)
+def test_error_status(server, outcome, status):
+    server.service.outcome = outcome
+    response, payload = post(server, png_bytes())
+    assert response.status == status
+    assert payload.startswith(b'{"error": ')
+
+
+def test_quota_and_busy_say_when_to_retry(server):
+    server.service.outcome = QuotaExceededError("gpt-4o", 30)
+    response, _ = post(server, png_bytes())
+    assert response.getheader("Retry-After") == "30"
+    server.service.outcome = ServerBusyError("busy")
+    response, _ = post(server, png_bytes())
+    assert response.getheader("Retry-After") == "1"
+
+
+@pytest.mark.parametrize(
+    "body, content_type, query, status",
+    [
+        (b"x", "image/png", "?format=pdf", HTTPStatus.BAD_REQUEST),
+        (b"", "image/png", "", HTTPStatus.BAD_REQUEST),
+        (b"not an image", "image/png", "", HTTPStatus.UNSUPPORTED_MEDIA_TYPE),
+        (b"%PDF-1.7", "application/pdf", "", HTTPStatus.UNSUPPORTED_MEDIA_TYPE),
+    ],
+    ids=["unknown-format", "empty", "not-an-image", "not-an-image-type"],
+)
+def test_bad_requests(server, body, content_type, query, status):
+    response, payload = post(server, body, content_type, query)
+    assert response.status == status
+    assert b"BytesIO" not in payload
+
+
+def test_negative_content_length(server):
+    response, _ = post(server, b"", headers={"Content-Length": "-5"})
+    assert response.status == HTTPStatus.BAD_REQUEST
+
+
+def test_oversized_upload(server):
+    server.max_upload_bytes = 10
+    response, _ = post(server, png_bytes())
+    assert response.status == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+
+def test_undecodable_image_is_the_clients_fault():
+    data = png_bytes((256, 256))
+    service = DigestService(
+        Model(name="gpt-4o", pretty_name="GPT-4o", provider="OpenAI", rate_limit=""),
+        workers=1,
+        queue_size=0,
+        preprocess=PreprocessConfig(enabled=True),
+    )
+    try:
+        with pytest.raises(RequestError) as excinfo:
+            # The header still reads, the pixel data is cut off
+            service.submit(data[: len(data) // 2], ".png", ["markdown"]).result()
+        assert excinfo.value.status == HTTPStatus.UNPROCESSABLE_ENTITY
+    finally:
+        service.close()